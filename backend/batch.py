@@ -0,0 +1,249 @@
+"""
+Traitement par lots: plusieurs jeux de fichiers dans une seule demande
+
+L'archive zip contient les fichiers de chaque site et un manifeste
+batch.json à la racine:
+
+    {
+        "items": [
+            {
+                "name": "site-a",
+                "files": {"tracking": "site-a/suivi.xlsx", "export": "site-a/export.xlsx"},
+                "params": {"export_date": "31/01/2025"}
+            },
+            ...
+        ]
+    }
+
+Chaque élément est exécuté séparément dans le pool de workers, en parallèle
+sur les cœurs disponibles. L'échec d'un site n'interrompt pas les autres.
+Le zip résultat contient un dossier par site réussi et un manifest.json
+indiquant le statut de chaque élément.
+
+Utilisation en ligne de commande (depuis le dossier backend):
+    python batch.py stock-tracking lots.zip -o resultats.zip --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from pathlib import PurePosixPath
+
+from processors import PROCESSORS_REGISTRY, PREFLIGHT_CHECKS, accepted_extensions, check_files, concurrency_limits, run_processor, merge_worker_failure, validate_params, warm_up
+from processors import instrumentation
+from workers import ProcessingPool, PoolSaturatedError
+
+MANIFEST_NAME = "batch.json"
+RESULT_MANIFEST_NAME = "manifest.json"
+SUBMIT_RETRY_SECONDS = 1
+
+
+class BatchError(ValueError):
+    """Archive ou manifeste invalide"""
+
+
+class BatchItem:
+    """Un jeu de fichiers et de paramètres à traiter"""
+
+    def __init__(self, name: str, files: dict, params: dict):
+        self.name = name
+        self.files = files
+        self.params = params
+        self.result_path = None
+        self.stats = None
+        self.error = None
+
+
+def safe_name(name: str) -> str:
+    """Nom utilisable comme dossier dans le zip résultat"""
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', str(name)).strip('._') or "site"
+
+
+def extract_batch(archive_path: str, work_dir: str, processor_config: dict, max_file_size: int,
+                  max_archive_size=None) -> list:
+    """
+    Lit le manifeste et extrait les fichiers de chaque élément dans work_dir
+
+    Seuls les fichiers référencés par le manifeste sont extraits, chacun sous
+    un nom contrôlé (pas de chemin issu de l'archive), avec une extension
+    déclarée par le traitement ("accept") et dans la limite de max_file_size
+    une fois décompressé (max_archive_size pour un fichier .zip, par défaut
+    max_file_size).
+    """
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile:
+        raise BatchError("L'archive n'est pas un fichier zip valide")
+
+    with archive:
+        try:
+            manifest = json.loads(archive.read(MANIFEST_NAME))
+        except KeyError:
+            raise BatchError(f"Manifeste {MANIFEST_NAME} absent de l'archive")
+        except ValueError:
+            raise BatchError(f"Manifeste {MANIFEST_NAME} invalide")
+
+        entries = manifest.get("items") if isinstance(manifest, dict) else None
+        if not entries:
+            raise BatchError("Le manifeste ne contient aucun élément")
+
+        items = []
+        used_names = set()
+        for index, entry in enumerate(entries):
+            name = safe_name(entry.get("name") or f"site-{index + 1}")
+            if name in used_names:
+                name = f"{name}-{index + 1}"
+            used_names.add(name)
+
+            item_dir = os.path.join(work_dir, f"{index:03d}")
+            os.makedirs(item_dir)
+            item = BatchItem(name, {}, entry.get("params") or {})
+            items.append(item)
+
+            try:
+                for file_id, file_config in processor_config["files"].items():
+                    member = (entry.get("files") or {}).get(file_id)
+                    if not member:
+                        raise BatchError(f"Fichier manquant: {file_config['label']}")
+                    item.files[file_id] = _extract_member(archive, member, item_dir, file_id, file_config,
+                                                          max_file_size, max_archive_size or max_file_size)
+
+                try:
+                    # Mêmes règles que l'API (parse_params): valeurs par défaut et options
+                    item.params = validate_params(processor_config, item.params)
+                except ValueError as e:
+                    raise BatchError(str(e))
+            except (BatchError, KeyError) as e:
+                item.error = str(e) if isinstance(e, BatchError) else f"Fichier absent de l'archive: {e}"
+
+    return items
+
+
+def _extract_member(archive, member: str, item_dir: str, file_id: str, file_config: dict,
+                    max_file_size: int, max_archive_size: int) -> str:
+    info = archive.getinfo(member)
+    ext = PurePosixPath(member).suffix.lower()
+    if ext not in accepted_extensions(file_config):
+        raise BatchError(f"Extension non autorisée: {member}")
+    if info.file_size > (max_archive_size if ext == '.zip' else max_file_size):
+        raise BatchError(f"Fichier trop volumineux: {member}")
+
+    dest_path = os.path.join(item_dir, f"{file_id}{ext}")
+    with archive.open(info) as src, open(dest_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    return dest_path
+
+
+async def run_items(pool: ProcessingPool, treatment_id: str, items: list, progress_callback=None,
+                    memory_slots=None):
+    """
+    Exécute les éléments valides dans le pool, au plus max_workers à la fois
+
+    memory_slots: voir concurrency_limits (le pool de l'API applique
+    MEMORY_HEAVY_SLOTS, la ligne de commande dispose de tous ses workers).
+
+    Quand le pool est plein (autres traitements en cours), la soumission est
+    retentée au lieu d'échouer: le lot attend son tour. Un élément refusé par
+    la vérification préalable (en-têtes) est en échec sans passer par le pool.
+    """
+    runnable = [item for item in items if item.error is None]
+    slots = asyncio.Semaphore(pool.max_workers)
+    done = 0
+
+    async def run_item(item):
+        nonlocal done
+        problems = await asyncio.to_thread(check_files, treatment_id, item.files, item.params) if PREFLIGHT_CHECKS else []
+        if problems:
+            item.error = "; ".join(problem["msg"] for problem in problems)
+            instrumentation.count_treatment(treatment_id, "rejected")
+        else:
+            await submit_item(item)
+        done += 1
+        if progress_callback:
+            progress_callback(done, len(runnable))
+
+    async def submit_item(item):
+        async with slots:
+            while True:
+                try:
+                    future = pool.submit(run_processor, treatment_id, item.files, item.params,
+                                         limits=concurrency_limits(treatment_id, memory_slots))
+                    break
+                except PoolSaturatedError:
+                    await asyncio.sleep(SUBMIT_RETRY_SECONDS)
+            try:
+                result = await asyncio.wrap_future(future)
+                item.result_path = result["result_path"]
+                item.stats = result["stats"]
+            except Exception as e:
+                item.error = str(e) or e.__class__.__name__
+                merge_worker_failure(treatment_id, e)
+
+    await asyncio.gather(*(run_item(item) for item in runnable))
+    return items
+
+
+def write_results(items: list, output_path: str):
+    """Zip des résultats avec le manifeste de statut de chaque élément"""
+    report = []
+    with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for item in items:
+            entry = {"name": item.name, "params": item.params}
+            if item.error is None and item.result_path and os.path.exists(item.result_path):
+                arcname = f"{item.name}/{item.name}_resultat{os.path.splitext(item.result_path)[1]}"
+                archive.write(item.result_path, arcname)
+                entry.update(status="ok", result=arcname)
+            else:
+                entry.update(status="error", error=item.error or "Aucun fichier résultat")
+            report.append(entry)
+
+        archive.writestr(RESULT_MANIFEST_NAME, json.dumps({"items": report}, ensure_ascii=False, indent=2))
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Traitement par lots de fichiers Excel")
+    parser.add_argument("treatment_id", help="Identifiant du traitement (ex: stock-tracking)")
+    parser.add_argument("archive", help=f"Archive zip contenant {MANIFEST_NAME}")
+    parser.add_argument("-o", "--output", default="resultats_batch.zip", help="Zip résultat")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Nombre de processus")
+    parser.add_argument("--max-file-size", type=int, default=50 * 1024 * 1024)
+    parser.add_argument("--max-archive-size", type=int, default=200 * 1024 * 1024,
+                        help="Taille maximale d'un fichier .zip du lot (ex: exports d'une reprise)")
+    args = parser.parse_args()
+
+    if args.treatment_id not in PROCESSORS_REGISTRY:
+        parser.error(f"Traitement '{args.treatment_id}' non trouvé")
+
+    work_dir = tempfile.mkdtemp()
+    pool = ProcessingPool(args.workers, max_queued=0, initializer=warm_up)
+    try:
+        items = extract_batch(args.archive, work_dir, PROCESSORS_REGISTRY[args.treatment_id], args.max_file_size,
+                              args.max_archive_size)
+
+        def print_progress(done, total):
+            print(f"📦 {done}/{total} éléments traités")
+
+        asyncio.run(run_items(pool, args.treatment_id, items, print_progress, memory_slots=0))
+        report = write_results(items, args.output)
+    except BatchError as e:
+        parser.exit(1, f"❌ {e}\n")
+    finally:
+        pool.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    failed = [entry for entry in report if entry["status"] != "ok"]
+    for entry in failed:
+        print(f"❌ {entry['name']}: {entry['error']}")
+    print(f"🎉 {len(report) - len(failed)}/{len(report)} réussis - {args.output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,6 @@
+"""
+Scripts de mesure de performance du backend
+
+A lancer depuis le dossier backend, par exemple:
+    python -m benchmarks.bench_merge
+"""
@@ -0,0 +1,126 @@
+"""
+Comparaison du regroupement des exports en un passage (export_aggregator)
+avec l'ancienne lecture pandas complète suivie de deux groupby
+
+Vérifie d'abord que les deux implémentations produisent le même tableau
+sur des exports contenant des cas limites (cellules vides, "N/A", codes
+numériques, dates, colonnes dans le désordre), puis mesure chaque méthode
+sur un export synthétique. Chaque méthode tourne dans son propre processus
+pour que le pic de mémoire résidente (RSS) mesuré soit le sien.
+
+Usage:
+    python -m benchmarks.bench_export [--rows 300000] [--articles 50000]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from openpyxl import Workbook
+
+from benchmarks.synthetic import make_export, make_keys
+from processors import export_aggregator
+from processors.excel_reader import CALAMINE_AVAILABLE, read_excel
+
+METHODS = ["pandas", "openpyxl"] + (["calamine"] if CALAMINE_AVAILABLE else [])
+
+
+def legacy_group_export(file_export):
+    """Ancienne implémentation (lecture complète + deux groupby), conservée comme référence"""
+    df_export = read_excel(file_export, usecols=export_aggregator.EXPORT_COLUMNS, dtype=object)
+    df_grouped = df_export.groupby(['Code article', 'Emplacement']).size().reset_index(name='Quantité')
+    df_descriptions = df_export.groupby(['Code article', 'Emplacement']).agg({
+        "Description de l'actif": 'first',
+        "Description de l'emplacement": 'first'
+    }).reset_index()
+    return df_grouped.merge(df_descriptions, on=['Code article', 'Emplacement'], how='left')
+
+
+def make_edge_case_export(path, seed):
+    """Export avec valeurs vides ou numériques et colonnes supplémentaires"""
+    rnd = random.Random(seed)
+    codes = ['A1', 'B2', 123, 45.0, 'NA', '', None, 'n/a', 'Z9', 7, '#N/A', 'null']
+    locations = ['M1', 'M2', 10, None, 'N/A', 'M3']
+    descriptions = [None, '', 'desc a', 'desc b', 'NaN', 3.5, 12, datetime.datetime(2024, 1, 2)]
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['Autre', 'Emplacement', 'Code article', "Description de l'emplacement", 'X',
+                  "Description de l'actif"])
+    for _ in range(rnd.randint(50, 3000)):
+        sheet.append([rnd.random(), rnd.choice(locations), rnd.choice(codes), rnd.choice(descriptions), 'x',
+                      rnd.choice(descriptions)])
+    workbook.save(path)
+
+
+def check_equivalence(work_dir):
+    """Compare les deux implémentations, avec chaque lecteur de lignes"""
+    for seed in range(5):
+        path = os.path.join(work_dir, f"edge_{seed}.xlsx")
+        make_edge_case_export(path, seed)
+        expected = legacy_group_export(path)
+        for reader in METHODS[1:]:
+            os.environ["EXPORT_ROW_READER"] = reader
+            pd.testing.assert_frame_equal(export_aggregator.aggregate_export(path), expected)
+    os.environ.pop("EXPORT_ROW_READER", None)
+    print("✅ Équivalence vérifiée avec la lecture pandas + groupby")
+
+
+def measure(method, path):
+    """Exécuté dans un processus séparé: durée et pic RSS d'une méthode"""
+    start = time.perf_counter()
+    if method == "pandas":
+        df = legacy_group_export(path)
+    else:
+        os.environ["EXPORT_ROW_READER"] = method
+        df = export_aggregator.aggregate_export(path)
+    seconds = time.perf_counter() - start
+    print(json.dumps({"method": method, "seconds": round(seconds, 3), "keys": len(df),
+                      "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}))
+
+
+def run_measure(method, path):
+    output = subprocess.run([sys.executable, "-m", "benchmarks.bench_export", "--measure", method, path],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=300_000, help="Nombre de lignes de l'export")
+    parser.add_argument('--articles', type=int, default=50_000, help="Nombre d'articles distincts")
+    parser.add_argument('--locations', type=int, default=30, help="Nombre de magasins")
+    parser.add_argument('--measure', nargs=2, metavar=('METHODE', 'FICHIER'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="bench-export-")
+    try:
+        check_equivalence(work_dir)
+
+        path = os.path.join(work_dir, "export.xlsx")
+        make_export(path, make_keys(args.articles, args.locations), args.rows)
+        print(f"📊 Export: {args.rows} lignes ({os.path.getsize(path) / 2**20:.1f} MB)")
+
+        for method in METHODS:
+            result = run_measure(method, path)
+            print(f"⏱️  {method:<9} {result['seconds']:8.3f} s  {result['keys']} clés  "
+                  f"(pic RSS {result['peak_rss_bytes'] / 2**20:.0f} MB)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
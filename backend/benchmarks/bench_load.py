@@ -0,0 +1,469 @@
+"""
+Test de charge de l'API: plusieurs clients simultanés sur un seul processus uvicorn
+
+Démarre `uvicorn main:app` en local (ou vise --url), génère un fichier de
+suivi et un export synthétiques (voir synthetic.py), puis pour chaque niveau
+de concurrence envoie --requests requêtes réparties entre les clients selon
+le mélange --mix de GET /api/treatments et POST /api/process/stock-tracking.
+
+Chaque traitement porte une date d'export différente: les demandes ne sont
+ni dédupliquées ni refusées par la vérification préalable. Le cache des
+exports du serveur démarré est désactivé (comme dans bench_process).
+
+Mesures par niveau: latences p50/p95/p99 par type de requête, débit
+(réponses réussies par seconde), taux
+d'erreur (réponses >= 400 et erreurs de connexion, 503 compris), pic de
+mémoire résidente du serveur et de ses workers (Linux: /proc). Les
+résultats sont enregistrés en JSON pour comparer deux versions:
+
+    python -m benchmarks.bench_load --concurrency 1 2 4 8 -o avant.json
+    python -m benchmarks.bench_load --concurrency 1 2 4 8 -o apres.json --compare avant.json
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+
+from benchmarks.bench_process import LAST_TRACKING_DATE, SCENARIOS, git_commit
+from benchmarks.synthetic import make_export, make_tracking_workbook
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESS_PATH = "/api/process/stock-tracking"
+TREATMENTS_PATH = "/api/treatments"
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+STARTUP_TIMEOUT = 60      # secondes
+REQUEST_TIMEOUT = 600     # secondes
+MEMORY_SAMPLE_INTERVAL = 0.1
+
+
+def percentile(values, q):
+    """Percentile q (0 à 100) par rang le plus proche, None sans valeur"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))  # arrondi supérieur
+    return ordered[int(rank) - 1]
+
+
+def latency_summary(seconds: list) -> dict:
+    if not seconds:
+        return {"count": 0}
+    return {
+        "count": len(seconds),
+        "p50": round(percentile(seconds, 50), 4),
+        "p95": round(percentile(seconds, 95), 4),
+        "p99": round(percentile(seconds, 99), 4),
+        "mean": round(sum(seconds) / len(seconds), 4),
+        "max": round(max(seconds), 4),
+    }
+
+
+def parse_mix(text: str) -> dict:
+    """"treatments=3,process=1" -> poids de chaque type de requête"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ("treatments", "process"):
+            raise argparse.ArgumentTypeError(f"Type de requête inconnu: {name}")
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Poids invalide: {part}")
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("Le mélange ne contient aucune requête")
+    return mix
+
+
+# Mémoire du serveur (Linux)
+
+def _status_kb(pid: int, field: str):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def process_tree(pid: int) -> list:
+    """pid et tous ses descendants (workers du pool, resource_tracker...)"""
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                # Le nom du processus est entre parenthèses et peut contenir des espaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+class MemorySampler(threading.Thread):
+    """
+    Relève la mémoire résidente du serveur et de ses descendants
+
+    peak_rss_bytes: pic de la somme des RSS (relevée toutes les
+    MEMORY_SAMPLE_INTERVAL secondes). Les pics propres à chaque processus
+    (VmHWM, depuis son démarrage) sont lus à la fin, dans hwm_bytes().
+    """
+
+    def __init__(self, pid: int):
+        super().__init__(name="memory-sampler", daemon=True)
+        self.pid = pid
+        self.peak_rss_bytes = 0
+        self._done = threading.Event()
+
+    @staticmethod
+    def supported() -> bool:
+        return os.path.isdir("/proc/self")
+
+    def sample(self):
+        total_kb = sum(_status_kb(pid, "VmRSS") or 0 for pid in process_tree(self.pid))
+        self.peak_rss_bytes = max(self.peak_rss_bytes, total_kb * 1024)
+
+    def run(self):
+        while True:
+            self.sample()
+            if self._done.wait(MEMORY_SAMPLE_INTERVAL):
+                return
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.sample()
+
+    def hwm_bytes(self) -> dict:
+        """VmHWM du processus de l'API et max des autres processus (workers)"""
+        peaks = {pid: (_status_kb(pid, "VmHWM") or 0) * 1024 for pid in process_tree(self.pid)}
+        api = peaks.pop(self.pid, 0)
+        return {"api": api, "max_worker": max(peaks.values(), default=0), "processes": len(peaks) + 1}
+
+
+# Serveur
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, env_overrides: dict, log_path=None):
+    """Démarre uvicorn main:app (un seul processus) depuis le dossier backend"""
+    env = {**os.environ, "STAGE_LOG": "0", "EXPORT_CACHE_MAX_BYTES": "0", **env_overrides}
+    log = open(log_path, 'wb') if log_path else subprocess.DEVNULL
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    if log_path:
+        log.close()
+    return server
+
+
+def wait_ready(host: str, port: int, server=None):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Le serveur s'est arrêté au démarrage (code {server.returncode})")
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=2)
+            connection.request("GET", TREATMENTS_PATH)
+            if connection.getresponse().status == 200:
+                connection.close()
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Le serveur ne répond pas après {STARTUP_TIMEOUT} s")
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+# Requêtes
+
+class ProcessRequests:
+    """Corps multipart des traitements, chacun avec sa propre date d'export"""
+
+    def __init__(self, tracking_path: str, export_path: str, first_date: datetime.date):
+        with open(tracking_path, 'rb') as f:
+            self.tracking = f.read()
+        with open(export_path, 'rb') as f:
+            self.export = f.read()
+        self.first_date = first_date
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def next_date(self) -> str:
+        with self._lock:
+            index, self._next = self._next, self._next + 1
+        return (self.first_date + datetime.timedelta(days=index)).strftime('%d/%m/%Y')
+
+    def body(self):
+        """(corps, type de contenu) d'un POST /api/process/stock-tracking"""
+        boundary = uuid.uuid4().hex
+        params = json.dumps({"export_date": self.next_date()})
+        parts = [
+            f'--{boundary}\r\nContent-Disposition: form-data; name="params"\r\n\r\n{params}\r\n'.encode('utf-8'),
+        ]
+        for field, filename, data in (("file_tracking", "suivi.xlsx", self.tracking),
+                                      ("file_export", "export.xlsx", self.export)):
+            parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                f'Content-Type: {XLSX_MEDIA_TYPE}\r\n\r\n'.encode('utf-8')
+            )
+            parts.append(data)
+            parts.append(b"\r\n")
+        parts.append(f"--{boundary}--\r\n".encode('utf-8'))
+        return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+    @property
+    def upload_bytes(self) -> int:
+        return len(self.tracking) + len(self.export)
+
+
+def send(host: str, port: int, kind: str, process_requests: ProcessRequests) -> dict:
+    """Une requête sur une nouvelle connexion: {kind, status, ok, seconds, bytes, error}"""
+    if kind == "process":
+        body, content_type = process_requests.body()
+        method, path, headers = "POST", PROCESS_PATH, {"Content-Type": content_type}
+    else:
+        body, method, path, headers = None, "GET", TREATMENTS_PATH, {}
+
+    start = time.perf_counter()
+    status, size, error = None, 0, None
+    connection = http.client.HTTPConnection(host, port, timeout=REQUEST_TIMEOUT)
+    try:
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        status = response.status
+        size = len(response.read())
+    except (OSError, http.client.HTTPException) as e:
+        error = e.__class__.__name__
+    finally:
+        connection.close()
+    return {"kind": kind, "status": status, "ok": status is not None and status < 400,
+            "seconds": time.perf_counter() - start, "bytes": size, "error": error}
+
+
+def run_level(host: str, port: int, concurrency: int, requests: int, mix: dict,
+              process_requests: ProcessRequests, server_pid=None, seed: int = 0) -> dict:
+    """Envoie `requests` requêtes avec `concurrency` clients simultanés"""
+    rnd = random.Random(seed + concurrency)
+    kinds = rnd.choices(list(mix), weights=list(mix.values()), k=requests)
+    queue_lock = threading.Lock()
+    results = []
+
+    def client():
+        while True:
+            with queue_lock:
+                if not kinds:
+                    return
+                kind = kinds.pop()
+            result = send(host, port, kind, process_requests)
+            with queue_lock:
+                results.append(result)
+
+    sampler = MemorySampler(server_pid) if server_pid and MemorySampler.supported() else None
+    if sampler:
+        sampler.start()
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client, name=f"client-{i}") for i in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    seconds = time.perf_counter() - start
+    if sampler:
+        sampler.stop()
+
+    status_counts = {}
+    for result in results:
+        key = str(result["status"]) if result["status"] is not None else result["error"]
+        status_counts[key] = status_counts.get(key, 0) + 1
+    errors = sum(1 for result in results if not result["ok"])
+
+    level = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "seconds": round(seconds, 4),
+        # Réponses réussies par seconde: les refus ne comptent pas comme du travail fait
+        "throughput_rps": round((len(results) - errors) / seconds, 4) if seconds else None,
+        "errors": errors,
+        "error_rate": round(errors / len(results), 4) if results else 0,
+        "status_counts": status_counts,
+        # Latences des réponses réussies uniquement: un refus 503 immédiat fausserait les percentiles
+        "latency_seconds": latency_summary([r["seconds"] for r in results if r["ok"]]),
+        "endpoints": {},
+    }
+    for kind in mix:
+        done = [r for r in results if r["kind"] == kind]
+        ok = [r["seconds"] for r in done if r["ok"]]
+        level["endpoints"][kind] = {
+            "requests": len(done),
+            "errors": len(done) - len(ok),
+            "latency_seconds": latency_summary(ok),
+        }
+    if sampler:
+        level["peak_rss_bytes"] = sampler.peak_rss_bytes
+        level["hwm_bytes"] = sampler.hwm_bytes()
+
+    print_level(level)
+    return level
+
+
+def print_level(level):
+    print(f"👥 {level['concurrency']} client(s): {level['requests']} requêtes en {level['seconds']:.1f} s, "
+          f"{level['throughput_rps']:.2f} réponses réussies/s, erreurs {level['error_rate']:.1%} {level['status_counts']}")
+    for kind, endpoint in level["endpoints"].items():
+        latency = endpoint["latency_seconds"]
+        if latency["count"]:
+            print(f"    {kind:<11} p50 {latency['p50']:7.3f} s  p95 {latency['p95']:7.3f} s  "
+                  f"p99 {latency['p99']:7.3f} s  ({latency['count']} ok, {endpoint['errors']} erreur(s))")
+    if "peak_rss_bytes" in level:
+        print(f"💾 pic RSS serveur + workers: {level['peak_rss_bytes'] / 2**20:.0f} MB "
+              f"(VmHWM API {level['hwm_bytes']['api'] / 2**20:.0f} MB, "
+              f"worker {level['hwm_bytes']['max_worker'] / 2**20:.0f} MB)")
+
+
+def compare(levels, baseline_path):
+    """Écarts par niveau de concurrence avec un fichier de résultats précédent"""
+    with open(baseline_path) as f:
+        baseline = {level["concurrency"]: level for level in json.load(f)["levels"]}
+
+    print(f"📈 par rapport à {baseline_path}")
+    for level in levels:
+        previous = baseline.get(level["concurrency"])
+        if previous is None:
+            continue
+        rows = [("req/s", previous["throughput_rps"], level["throughput_rps"]),
+                ("erreurs", previous["error_rate"], level["error_rate"])]
+        for kind, endpoint in level["endpoints"].items():
+            before = previous["endpoints"].get(kind, {}).get("latency_seconds", {})
+            after = endpoint["latency_seconds"]
+            rows += [(f"{kind} {q}", before.get(q), after.get(q)) for q in ("p50", "p95", "p99")]
+        if "peak_rss_bytes" in level and previous.get("peak_rss_bytes"):
+            rows.append(("pic RSS MB", previous["peak_rss_bytes"] / 2**20, level["peak_rss_bytes"] / 2**20))
+
+        print(f"    {level['concurrency']} client(s)")
+        for name, before, after in rows:
+            if before is None or after is None:
+                continue
+            change = f"  ({(after - before) / before:+.0%})" if before else ""
+            print(f"        {name:<18} {before:9.3f} -> {after:9.3f}{change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4],
+                        help="Niveaux de concurrence (clients simultanés, défaut: 1 2 4)")
+    parser.add_argument('--requests', type=int, default=20, help="Requêtes par niveau (défaut: 20)")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix("treatments=1,process=1"),
+                        help="Poids des requêtes, ex. treatments=3,process=1 (défaut: 1 pour 1)")
+    parser.add_argument('--scenario', default="small", choices=sorted(SCENARIOS),
+                        help="Taille des fichiers générés (scénarios de bench_process, défaut: small)")
+    parser.add_argument('--url', help="Viser un serveur déjà démarré (http://hôte:port) au lieu d'en lancer un")
+    parser.add_argument('--pid', type=int, help="Avec --url: processus du serveur, pour mesurer sa mémoire")
+    parser.add_argument('--env', action='append', default=[], metavar="NOM=VALEUR",
+                        help="Variable d'environnement du serveur démarré (répétable), ex. MAX_CONCURRENT_JOBS=1")
+    parser.add_argument('--server-log', help="Fichier recevant la sortie du serveur démarré")
+    parser.add_argument('--seed', type=int, default=0, help="Graine du tirage des requêtes")
+    parser.add_argument('-o', '--output', help="Fichier JSON des résultats")
+    parser.add_argument('--compare', help="Fichier JSON d'une exécution précédente")
+    args = parser.parse_args()
+
+    env_overrides = {}
+    for item in args.env:
+        name, sep, value = item.partition('=')
+        if not sep:
+            parser.error(f"--env attend NOM=VALEUR: {item}")
+        env_overrides[name] = value
+
+    work_dir = tempfile.mkdtemp(prefix="bench-load-")
+    server = None
+    try:
+        config = SCENARIOS[args.scenario]
+        tracking_path = os.path.join(work_dir, "tracking.xlsx")
+        export_path = os.path.join(work_dir, "export.xlsx")
+        keys = make_tracking_workbook(tracking_path, config["articles"], config["locations"],
+                                      config["months"], LAST_TRACKING_DATE)
+        make_export(export_path, keys, config["export_rows"])
+        process_requests = ProcessRequests(tracking_path, export_path,
+                                           LAST_TRACKING_DATE + datetime.timedelta(days=1))
+        print(f"🧪 {args.scenario}: {len(keys)} lignes de suivi, {config['export_rows']} lignes d'export "
+              f"({process_requests.upload_bytes / 2**20:.1f} MB envoyés par traitement)")
+
+        if args.url:
+            target = urllib.parse.urlsplit(args.url)
+            host, port, server_pid = target.hostname, target.port or 80, args.pid
+        else:
+            host, port = "127.0.0.1", free_port()
+            server = start_server(port, env_overrides, args.server_log)
+            server_pid = server.pid
+        wait_ready(host, port, server)
+        print(f"🌐 serveur http://{host}:{port}" + (f" (pid {server_pid})" if server_pid else ""))
+
+        levels = [run_level(host, port, concurrency, args.requests, args.mix, process_requests,
+                            server_pid, args.seed)
+                  for concurrency in args.concurrency]
+    finally:
+        if server is not None:
+            stop_server(server)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "scenario": args.scenario,
+        "mix": args.mix,
+        "requests_per_level": args.requests,
+        "server": args.url or "uvicorn main:app",
+        "server_env": env_overrides,
+        "levels": levels,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"📝 Résultats enregistrés dans {args.output}")
+
+    if args.compare:
+        compare(levels, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Comparaison du moteur de fusion vectorisé (merge_export) avec l'ancienne
+boucle iterrows + concat de update_tracking
+
+Vérifie d'abord que les deux implémentations produisent le même tableau,
+puis chronomètre le nouveau moteur sur un export de 100 000 lignes.
+
+Usage:
+    python -m benchmarks.bench_merge [--rows 100000] [--legacy]
+"""
+
+import argparse
+import random
+import time
+
+import pandas as pd
+
+from processors.stock_tracking import merge_export
+
+DATE = '15/06/2025'
+
+
+def legacy_merge(df_tracking, df_grouped, export_date_str):
+    """Ancienne implémentation ligne à ligne, conservée comme référence"""
+    df_tracking[export_date_str] = 0
+    for idx, row in df_grouped.iterrows():
+        condition = (df_tracking['Codification DSNA'] == row['Code article']) & (df_tracking['Magasin'] == row['Emplacement'])
+        if not df_tracking[condition].empty:
+            df_tracking.loc[condition, export_date_str] = row['Quantité']
+        else:
+            new_row = {
+                'Codification DSNA': row['Code article'],
+                'Désignation': row["Description de l'actif"],
+                'Magasin': row['Emplacement'],
+                'Description': row["Description de l'emplacement"],
+                export_date_str: row['Quantité']
+            }
+            df_tracking = pd.concat([df_tracking, pd.DataFrame([new_row])], ignore_index=True)
+    return df_tracking
+
+
+def make_frames(n_rows, n_articles, n_locations=20, months=6, seed=0):
+    """Génère un suivi existant et un export regroupé synthétiques"""
+    rnd = random.Random(seed)
+    keys = sorted({(f"ART{rnd.randrange(n_articles):06d}", f"MAG{rnd.randrange(n_locations):02d}")
+                   for _ in range(n_articles)})
+    dates = [f"28/{m:02d}/2024" for m in range(1, months + 1)]
+    df_tracking = pd.DataFrame({
+        'Codification DSNA': [k[0] for k in keys],
+        'Désignation': [f"Article {k[0]}" for k in keys],
+        'Magasin': [k[1] for k in keys],
+        'Description': [f"Magasin {k[1]}" for k in keys],
+        **{d: [rnd.randrange(20) for _ in keys] for d in dates},
+    })
+    # Cas limites: doublon de clé et clé manquante dans le suivi
+    df_tracking = pd.concat([df_tracking, df_tracking.iloc[:1], pd.DataFrame([{'Codification DSNA': None}])],
+                            ignore_index=True)
+
+    export_rows = []
+    for i in range(n_rows):
+        if rnd.random() < 0.9:
+            code, magasin = rnd.choice(keys)
+        else:
+            code, magasin = f"NEW{rnd.randrange(n_articles // 10 + 1):06d}", f"MAG{rnd.randrange(n_locations):02d}"
+        export_rows.append((code, magasin, f"Desc {code}", f"Lieu {magasin}"))
+    df_export = pd.DataFrame(export_rows, columns=['Code article', 'Emplacement',
+                                                   "Description de l'actif", "Description de l'emplacement"])
+    df_grouped = df_export.groupby(['Code article', 'Emplacement']).size().reset_index(name='Quantité')
+    df_descriptions = df_export.groupby(['Code article', 'Emplacement']).agg({
+        "Description de l'actif": 'first',
+        "Description de l'emplacement": 'first'
+    }).reset_index()
+    return df_tracking, df_grouped.merge(df_descriptions, on=['Code article', 'Emplacement'], how='left')
+
+
+def check_equivalence():
+    """Compare les deux moteurs sur plusieurs jeux de données réduits"""
+    for seed in range(5):
+        df_tracking, df_grouped = make_frames(n_rows=3000, n_articles=400, seed=seed)
+        expected = legacy_merge(df_tracking.copy(), df_grouped, DATE)
+        actual = merge_export(df_tracking.copy(), df_grouped, DATE)
+        pd.testing.assert_frame_equal(actual, expected)
+    print("✅ Équivalence vérifiée avec l'implémentation iterrows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000, help="Nombre de lignes de l'export")
+    parser.add_argument('--articles', type=int, default=30_000, help="Nombre d'articles distincts")
+    parser.add_argument('--legacy', action='store_true', help="Chronométrer aussi l'ancienne boucle (lent)")
+    args = parser.parse_args()
+
+    check_equivalence()
+
+    df_tracking, df_grouped = make_frames(args.rows, args.articles)
+    print(f"📊 Suivi: {len(df_tracking)} lignes, export regroupé: {len(df_grouped)} clés")
+
+    start = time.perf_counter()
+    merge_export(df_tracking.copy(), df_grouped, DATE)
+    print(f"⏱️  merge_export: {time.perf_counter() - start:.3f} s")
+
+    if args.legacy:
+        start = time.perf_counter()
+        legacy_merge(df_tracking.copy(), df_grouped, DATE)
+        print(f"⏱️  iterrows + concat: {time.perf_counter() - start:.3f} s")
+
+
+if __name__ == '__main__':
+    main()
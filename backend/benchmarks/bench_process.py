@@ -0,0 +1,282 @@
+"""
+Benchmark complet du traitement stock-tracking sur des fichiers synthétiques
+
+Pour chaque scénario (taille du suivi et de l'export), génère les fichiers
+(voir synthetic.py), exécute stock_tracking.process et mesure chaque étape:
+lecture du suivi, lecture de l'export, fusion, écriture de la 'Liste de
+Stock', calcul des variations, rapport mensuel, rapport semestriel et
+sauvegarde. Une seconde exécution sous tracemalloc mesure le pic mémoire
+de chaque étape. Avec --http, le même scénario passe aussi par
+POST /api/process/stock-tracking via le TestClient de FastAPI (httpx requis).
+
+Le cache des exports est désactivé pendant les mesures. Les résultats sont
+enregistrés en JSON pour comparer deux versions:
+
+    python -m benchmarks.bench_process --scenario small medium -o avant.json
+    python -m benchmarks.bench_process --scenario small medium -o apres.json --compare avant.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import openpyxl
+import pandas as pd
+
+from benchmarks.synthetic import make_export, make_tracking_workbook, next_month_end
+from processors import export_cache, history_store, instrumentation
+from processors import stock_tracking
+from processors.excel_reader import read_engine
+
+SCENARIOS = {
+    "small": {"articles": 2_000, "locations": 10, "months": 12, "export_rows": 10_000},
+    "medium": {"articles": 10_000, "locations": 30, "months": 36, "export_rows": 60_000},
+    "large": {"articles": 40_000, "locations": 50, "months": 60, "export_rows": 250_000},
+}
+
+LAST_TRACKING_DATE = datetime.date(2024, 12, 31)
+
+
+class StageRecorder:
+    """
+    Chronomètre les fonctions de stock_tracking appelées par process()
+
+    Les fonctions sont remplacées le temps de la mesure par une version qui
+    ajoute leur durée (et leur pic mémoire sous tracemalloc) à leur étape.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.seconds = {}
+        self.peak_bytes = {}
+        self._patches = []
+
+    def wrap(self, owner, attr, stage):
+        original = getattr(owner, attr)
+
+        def timed(*args, **kwargs):
+            name = stage(*args, **kwargs) if callable(stage) else stage
+            if self.trace_memory:
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+                if self.trace_memory:
+                    self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), tracemalloc.get_traced_memory()[1])
+
+        setattr(owner, attr, timed)
+        self._patches.append((owner, attr, original))
+
+    def __enter__(self):
+        st = stock_tracking
+        self.wrap(st.TrackingContext, '__init__', "read_tracking")
+        self.wrap(st, 'load_grouped_export', "read_export")
+        self.wrap(st, 'merge_export', "merge")
+        self.wrap(st, 'write_dataframe', "write")
+        self.wrap(st, 'style_headers', "write")
+        self.wrap(st, 'compute_variations', "variations")
+        self.wrap(st, 'render_variation_report', report_stage)
+        self.wrap(st.TrackingContext, 'save', "save")
+        return self
+
+    def __exit__(self, *exc):
+        for owner, attr, original in reversed(self._patches):
+            setattr(owner, attr, original)
+        self._patches = []
+
+
+def report_stage(worksheet, report, *args, **kwargs):
+    return report["stage"]
+
+
+def run_once(tracking_path, export_path, export_date, work_dir, trace_memory=False):
+    """Une exécution de process() sur une copie du suivi"""
+    work_path = os.path.join(work_dir, "tracking_run.xlsx")
+    shutil.copy(tracking_path, work_path)
+
+    with StageRecorder(trace_memory) as recorder, contextlib.redirect_stdout(io.StringIO()):
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            stock_tracking.process({'tracking': work_path, 'export': export_path},
+                                   {'export_date': export_date})
+            total = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+
+    recorder.seconds["other"] = max(0.0, total - sum(recorder.seconds.values()))
+    return total, recorder, peak
+
+
+def run_http(tracking_path, export_path, export_date):
+    """Même traitement par l'API, avec le TestClient de FastAPI"""
+    from fastapi.testclient import TestClient
+    import main as api
+
+    with TestClient(api.app) as client, open(tracking_path, 'rb') as tracking, open(export_path, 'rb') as export:
+        start = time.perf_counter()
+        response = client.post(
+            "/api/process/stock-tracking",
+            data={"params": json.dumps({"export_date": export_date})},
+            files={"file_tracking": ("suivi.xlsx", tracking), "file_export": ("export.xlsx", export)},
+        )
+        seconds = time.perf_counter() - start
+
+    if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+    return {"seconds": round(seconds, 4), "status": response.status_code, "response_bytes": len(response.content)}
+
+
+def run_scenario(name, config, repeat, measure_memory, http):
+    work_dir = tempfile.mkdtemp(prefix="bench-stock-")
+    try:
+        tracking_path = os.path.join(work_dir, "tracking.xlsx")
+        export_path = os.path.join(work_dir, "export.xlsx")
+        export_date = next_month_end(LAST_TRACKING_DATE).strftime('%d/%m/%Y')
+
+        start = time.perf_counter()
+        keys = make_tracking_workbook(tracking_path, config["articles"], config["locations"],
+                                      config["months"], LAST_TRACKING_DATE)
+        make_export(export_path, keys, config["export_rows"])
+        print(f"🧪 {name}: {len(keys)} lignes de suivi x {config['months']} mois, "
+              f"export de {config['export_rows']} lignes (généré en {time.perf_counter() - start:.1f} s)")
+
+        totals, stage_runs = [], []
+        for _ in range(repeat):
+            total, recorder, _ = run_once(tracking_path, export_path, export_date, work_dir)
+            totals.append(total)
+            stage_runs.append(recorder.seconds)
+
+        stages = {stage: round(statistics.median(run.get(stage, 0.0) for run in stage_runs), 4)
+                  for stage in stage_runs[0]}
+        result = {
+            "name": name,
+            "config": config,
+            "tracking_rows": len(keys),
+            "file_bytes": {"tracking": os.path.getsize(tracking_path), "export": os.path.getsize(export_path)},
+            "repeat": repeat,
+            "total_seconds": round(statistics.median(totals), 4),
+            "stages_seconds": stages,
+        }
+
+        if measure_memory:
+            _, recorder, peak = run_once(tracking_path, export_path, export_date, work_dir, trace_memory=True)
+            result["peak_memory_bytes"] = peak
+            result["stages_peak_memory_bytes"] = recorder.peak_bytes
+
+        if http:
+            result["http"] = run_http(tracking_path, export_path, export_date)
+
+        print_scenario(result)
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_scenario(result):
+    print(f"⏱️  total: {result['total_seconds']:.3f} s")
+    peaks = result.get("stages_peak_memory_bytes", {})
+    for stage, seconds in result["stages_seconds"].items():
+        peak = f"  (pic {peaks[stage] / 2**20:.1f} MB)" if stage in peaks else ""
+        print(f"    {stage:<14} {seconds:8.3f} s{peak}")
+    if "peak_memory_bytes" in result:
+        print(f"💾 pic mémoire (tracemalloc): {result['peak_memory_bytes'] / 2**20:.1f} MB")
+    if "http" in result:
+        print(f"🌐 POST /api/process/stock-tracking: {result['http']['seconds']:.3f} s")
+
+
+def compare(results, baseline_path):
+    """Écarts par étape avec un fichier de résultats précédent"""
+    with open(baseline_path) as f:
+        baseline = {scenario["name"]: scenario for scenario in json.load(f)["scenarios"]}
+
+    for result in results:
+        previous = baseline.get(result["name"])
+        if previous is None:
+            continue
+        print(f"📈 {result['name']} par rapport à {baseline_path}")
+        rows = [("total", previous["total_seconds"], result["total_seconds"])]
+        rows += [(stage, previous["stages_seconds"].get(stage), seconds)
+                 for stage, seconds in result["stages_seconds"].items()]
+        for stage, before, after in rows:
+            if before:
+                print(f"    {stage:<14} {before:8.3f} s -> {after:8.3f} s  ({(after - before) / before:+.0%})")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', nargs='+', default=["small"], choices=sorted(SCENARIOS),
+                        help="Scénarios prédéfinis (défaut: small)")
+    parser.add_argument('--articles', type=int, help="Scénario personnalisé: nombre d'articles")
+    parser.add_argument('--locations', type=int, default=20, help="Scénario personnalisé: nombre de magasins")
+    parser.add_argument('--months', type=int, default=24, help="Scénario personnalisé: mois d'historique")
+    parser.add_argument('--export-rows', type=int, default=50_000, help="Scénario personnalisé: lignes d'export")
+    parser.add_argument('--repeat', type=int, default=1, help="Exécutions par scénario (médiane retenue)")
+    parser.add_argument('--no-memory', action='store_true', help="Ne pas mesurer la mémoire (tracemalloc)")
+    parser.add_argument('--http', action='store_true', help="Mesurer aussi l'appel HTTP (TestClient)")
+    parser.add_argument('--history', action='store_true', help="Laisser l'historique SQLite actif si configuré")
+    parser.add_argument('-o', '--output', help="Fichier JSON des résultats")
+    parser.add_argument('--compare', help="Fichier JSON d'une exécution précédente")
+    args = parser.parse_args()
+
+    # Mesurer la lecture réelle des exports, pas le cache
+    export_cache.CACHE_MAX_BYTES = 0
+    instrumentation.logger.disabled = True
+    os.environ["EXPORT_CACHE_MAX_BYTES"] = "0"
+    if not args.history:
+        history_store.HISTORY_DIR = ""
+        os.environ.pop("HISTORY_STORE_DIR", None)
+
+    if args.articles:
+        scenarios = {"custom": {"articles": args.articles, "locations": args.locations,
+                                "months": args.months, "export_rows": args.export_rows}}
+    else:
+        scenarios = {name: SCENARIOS[name] for name in args.scenario}
+
+    results = [run_scenario(name, config, max(1, args.repeat), not args.no_memory, args.http)
+               for name, config in scenarios.items()]
+
+    report = {
+        "created_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "openpyxl": openpyxl.__version__,
+        "read_engine": read_engine() or "default",
+        "scenarios": results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"📝 Résultats enregistrés dans {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Comparaison de l'écriture de la feuille 'Liste de Stock'
+
+Ancien chemin: worksheet.cell() pour chaque valeur, puis relecture de toutes
+les cellules pour ajuster la largeur des colonnes. Nouveau chemin:
+write_dataframe (append ligne par ligne) et largeurs calculées sur le
+DataFrame. Les deux feuilles produites sont comparées avant la mesure.
+
+Usage:
+    python -m benchmarks.bench_write [--rows 20000] [--months 36]
+"""
+
+import argparse
+import random
+import time
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.utils.dataframe import dataframe_to_rows
+
+from processors.stock_tracking import style_headers, write_dataframe
+
+
+def legacy_write(worksheet, df):
+    """Ancienne écriture cellule par cellule, conservée comme référence"""
+    for r_idx, row in enumerate(dataframe_to_rows(df, index=False, header=True), start=1):
+        for c_idx, value in enumerate(row, start=1):
+            worksheet.cell(row=r_idx, column=c_idx, value=value)
+
+    for column_cells in worksheet.columns:
+        length = max(len(str(cell.value)) for cell in column_cells)
+        worksheet.column_dimensions[column_cells[0].column_letter].width = min(length + 2, 50)
+
+
+def make_tracking(rows, months, seed=0):
+    """Génère un DataFrame 'Liste de Stock' avec une colonne par mois"""
+    rnd = random.Random(seed)
+    data = {
+        'Codification DSNA': [f"ART{i:06d}" for i in range(rows)],
+        'Désignation': [f"Article {i} " + "x" * rnd.randrange(40) for i in range(rows)],
+        'Magasin': [f"MAG{rnd.randrange(30):02d}" for _ in range(rows)],
+        'Description': [rnd.choice([None, "Magasin principal", "Réserve"]) for _ in range(rows)],
+    }
+    for m in range(months):
+        data[f"28/{m % 12 + 1:02d}/{2020 + m // 12}"] = [rnd.choice([None, rnd.randrange(50)]) for _ in range(rows)]
+    return pd.DataFrame(data)
+
+
+def sheet_snapshot(worksheet):
+    values = [[cell.value for cell in row] for row in worksheet.iter_rows()]
+    widths = {key: dim.width for key, dim in worksheet.column_dimensions.items()}
+    return values, widths
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    func(*args)
+    print(f"⏱️  {label}: {time.perf_counter() - start:.3f} s")
+
+
+def new_write(worksheet, df):
+    write_dataframe(worksheet, df)
+    style_headers(worksheet, df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--months', type=int, default=36)
+    args = parser.parse_args()
+
+    df = make_tracking(args.rows, args.months)
+    print(f"📊 {len(df)} lignes x {len(df.columns)} colonnes")
+
+    legacy_sheet = Workbook().active
+    new_sheet = Workbook().active
+    timed("cell() + relecture des largeurs", legacy_write, legacy_sheet, df)
+    timed("append + largeurs pandas", new_write, new_sheet, df)
+
+    legacy_values, legacy_widths = sheet_snapshot(legacy_sheet)
+    new_values, new_widths = sheet_snapshot(new_sheet)
+    # Les valeurs NaN ne sont pas égales à elles-mêmes: comparaison sur leur représentation
+    assert repr(legacy_values) == repr(new_values), "Valeurs différentes"
+    assert legacy_widths == new_widths, "Largeurs de colonnes différentes"
+    print("✅ Feuilles identiques")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Fichiers synthétiques pour les benchmarks du suivi des stocks
+
+- make_tracking_workbook: fichier de suivi avec 'Liste de Stock' (une colonne
+  par fin de mois), 'Suivi Mensuel' et 'Suivi Semestriel' déjà remplis
+- make_export: export d'inventaire, une ligne par actif, avec une part
+  d'articles absents du suivi
+
+Les fichiers sont écrits en mode write_only d'openpyxl pour que la génération
+reste rapide devant le traitement mesuré.
+"""
+
+import datetime
+import random
+
+import pandas as pd
+from openpyxl import Workbook
+
+KEY_COLUMNS = ['Codification DSNA', 'Désignation', 'Magasin', 'Description']
+
+
+def month_ends(months: int, last: datetime.date) -> list:
+    """Les `months` dernières fins de mois jusqu'à `last` inclus"""
+    return [(pd.Timestamp(last) - pd.offsets.MonthEnd(months - 1 - m)).date() for m in range(months)]
+
+
+def next_month_end(date: datetime.date) -> datetime.date:
+    return (pd.Timestamp(date) + pd.offsets.MonthEnd(1)).date()
+
+
+def make_keys(articles: int, locations: int, seed: int = 0) -> list:
+    """Couples (code article, magasin) distincts, dans l'ordre du suivi"""
+    rnd = random.Random(seed)
+    keys = []
+    for i in range(articles):
+        for location in rnd.sample(range(locations), k=min(locations, 1 + rnd.randrange(3))):
+            keys.append((f"ART{i:06d}", f"MAG{location:03d}"))
+    return keys
+
+
+def make_tracking_workbook(path: str, articles: int = 2000, locations: int = 10, months: int = 12,
+                           last_date: datetime.date = datetime.date(2024, 12, 31), seed: int = 0) -> list:
+    """
+    Écrit un fichier de suivi synthétique
+
+    Returns:
+        Les clés (code article, magasin) de la 'Liste de Stock'
+    """
+    rnd = random.Random(seed)
+    keys = make_keys(articles, locations, seed)
+    dates = [d.strftime('%d/%m/%Y') for d in month_ends(months, last_date)]
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Liste de Stock')
+    sheet.append(KEY_COLUMNS + dates)
+    for code, location in keys:
+        # Un article apparaît à une date donnée puis garde une quantité renseignée
+        first_month = rnd.randrange(months) if rnd.random() < 0.3 else 0
+        quantity = rnd.randrange(1, 40)
+        quantities = []
+        for m in range(months):
+            if m < first_month:
+                quantities.append(None)
+            else:
+                quantity = max(0, quantity + rnd.choice([-2, -1, 0, 0, 0, 1, 2]))
+                quantities.append(quantity)
+        sheet.append([code, f"Article {code}", location, f"Magasin {location}"] + quantities)
+
+    # Rapports existants, effacés et réécrits par le traitement
+    for name in ('Suivi Mensuel', 'Suivi Semestriel'):
+        report = workbook.create_sheet(name)
+        report.append([f"Variation précédente ({name})"])
+        report.append(KEY_COLUMNS + ['Variation', 'Quantité actuelle'])
+        for code, location in keys[:min(len(keys), 200)]:
+            report.append([code, f"Article {code}", location, f"Magasin {location}", 1, 10])
+
+    workbook.save(path)
+    return keys
+
+
+def make_export(path: str, keys: list, rows: int = 10000, new_ratio: float = 0.05, seed: int = 0):
+    """Écrit un export d'inventaire synthétique (une ligne par actif)"""
+    rnd = random.Random(seed + 1)
+    new_articles = max(1, len(keys) // 20)
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Export')
+    sheet.append(['Numéro de série', 'Code article', "Description de l'actif", 'Emplacement',
+                  "Description de l'emplacement", 'État'])
+    for i in range(rows):
+        if keys and rnd.random() >= new_ratio:
+            code, location = rnd.choice(keys)
+        else:
+            code, location = f"NEW{rnd.randrange(new_articles):06d}", f"MAG{rnd.randrange(50):03d}"
+        sheet.append([f"SN{i:08d}", code, f"Article {code}", location, f"Magasin {location}",
+                      rnd.choice(['En service', 'En stock', 'En réparation'])])
+    workbook.save(path)
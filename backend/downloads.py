@@ -0,0 +1,216 @@
+"""
+Envoi des fichiers résultat
+
+Les résultats acceptent les requêtes HTTP Range: un téléchargement
+interrompu reprend là où il s'est arrêté (If-Range sur l'ETag pour ne pas
+mélanger deux versions du fichier), sans relancer le traitement.
+
+Sur demande (?package=zip), le résultat est envoyé dans une archive zip avec
+le rapport des modifications écrit par le processeur. Un classeur .xlsx est
+déjà compressé: le zip sert surtout à livrer les deux fichiers ensemble.
+
+Un résultat gardé en mémoire (MemoryFile) est envoyé de la même façon, sans
+passer par le disque ni copier tout son contenu: les tranches sont lues
+dans une vue (memoryview) sur le tampon du résultat, DOWNLOAD_CHUNK_SIZE
+octets à la fois.
+"""
+
+import os
+import re
+import time
+import zipfile
+from email.utils import formatdate
+from urllib.parse import quote
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from processors import change_report, sources
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+PACKAGE_FORMATS = {"zip"}
+REPORT_FILENAME = "rapport_modifications.txt"
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def check_package(package):
+    """Valide le paramètre ?package="""
+    if package is not None and package not in PACKAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format de paquet non supporté: {package}")
+
+
+def build_package(result_path, result_filename: str, package_path: str):
+    """
+    Zip du résultat et de son rapport des modifications
+
+    Construit sur le disque (package_path, réutilisé s'il existe), ou en
+    mémoire pour un résultat en mémoire: l'appelant garde ce paquet
+    (JobStore.keep_package) pour ne pas le reconstruire à chaque demande.
+    """
+    if sources.is_memory(result_path):
+        # Contenu et date fixés par le résultat: même ETag et mêmes octets si le
+        # paquet est reconstruit (après un redémarrage), une reprise reste cohérente
+        package = sources.MemoryFile(name=os.path.basename(package_path))
+        write_package(package, result_path, result_filename)
+        package.mtime = result_path.mtime
+        return package
+
+    if os.path.exists(package_path):
+        return package_path
+
+    tmp_path = f"{package_path}.tmp"
+    write_package(tmp_path, result_path, result_filename)
+    os.replace(tmp_path, package_path)
+    return package_path
+
+
+def write_package(target, result_path, result_filename: str):
+    with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        report = change_report.read_report(result_path)
+        if sources.is_memory(result_path):
+            date_time = time.localtime(result_path.mtime)[:6]
+            with result_path.getbuffer() as data:
+                archive.writestr(zipfile.ZipInfo(result_filename, date_time), data,
+                                 compress_type=zipfile.ZIP_DEFLATED)
+            if report is not None:
+                archive.writestr(zipfile.ZipInfo(REPORT_FILENAME, date_time), change_report.format_report(report),
+                                 compress_type=zipfile.ZIP_DEFLATED)
+            return
+
+        archive.write(result_path, result_filename)
+        if report is not None:
+            archive.writestr(REPORT_FILENAME, change_report.format_report(report))
+
+
+def package_filename(result_filename: str) -> str:
+    return f"{os.path.splitext(result_filename)[0]}.zip"
+
+
+def content_disposition(filename: str) -> str:
+    """Même en-tête que FileResponse, noms non ASCII compris"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def parse_range(range_header: str, size: int):
+    """
+    (début, fin) inclus pour un en-tête "bytes=début-fin"
+
+    Retourne None si l'en-tête n'est pas une plage unique (le fichier entier
+    est alors envoyé), lève 416 si la plage est hors du fichier.
+    """
+    match = RANGE_PATTERN.match(range_header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+
+    start, end = match.groups()
+    if start == '':
+        # Suffixe: les N derniers octets
+        length = int(end)
+        if length == 0:
+            raise range_not_satisfiable(size)
+        return max(0, size - length), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise range_not_satisfiable(size)
+    return start, end
+
+
+def range_not_satisfiable(size: int) -> HTTPException:
+    return HTTPException(status_code=416, detail="Plage demandée invalide",
+                         headers={"Content-Range": f"bytes */{size}"})
+
+
+def iter_file(path: str, start: int, end: int):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def iter_memory(memory_file, start: int, end: int):
+    """Octets [start, end] d'un MemoryFile, par blocs (un seul bloc copié à la fois)"""
+    with memory_file.getbuffer() as view:
+        for offset in range(start, end + 1, DOWNLOAD_CHUNK_SIZE):
+            # Starlette n'envoie que des bytes: copie du bloc seulement
+            yield view[offset:min(offset + DOWNLOAD_CHUNK_SIZE, end + 1)].tobytes()
+
+
+def file_response(request: Request, path, filename: str, media_type: str, headers=None) -> Response:
+    """FileResponse qui accepte aussi les requêtes Range (une plage), ou un MemoryFile"""
+    if sources.is_memory(path):
+        return memory_response(request, path, filename, media_type, headers)
+
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    base_headers = {"Accept-Ranges": "bytes", "ETag": etag, **(headers or {})}
+    byte_range = requested_range(request, stat.st_size, etag, last_modified)
+
+    if byte_range is None:
+        return FileResponse(path=path, filename=filename, media_type=media_type,
+                            headers=base_headers, stat_result=stat)
+
+    start, end = byte_range
+    return StreamingResponse(
+        iter_file(path, start, end),
+        status_code=206,
+        media_type=media_type,
+        headers={
+            **base_headers,
+            "Content-Range": f"bytes {start}-{end}/{stat.st_size}",
+            "Content-Length": str(end - start + 1),
+            "Content-Disposition": content_disposition(filename),
+            "Last-Modified": last_modified,
+        },
+    )
+
+
+def requested_range(request: Request, size: int, etag: str, last_modified: str):
+    """Plage demandée (début, fin), ou None pour envoyer le fichier entier"""
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range in (etag, last_modified)):
+        return parse_range(range_header, size)
+    return None
+
+
+def memory_response(request: Request, memory_file, filename: str, media_type: str, headers=None) -> Response:
+    """file_response pour un résultat en mémoire: mêmes en-têtes, mêmes plages"""
+    size = sources.source_size(memory_file)
+    etag = f'"{int(memory_file.mtime * 1e9):x}-{size:x}"'
+    last_modified = formatdate(memory_file.mtime, usegmt=True)
+    base_headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": content_disposition(filename),
+        "Last-Modified": last_modified,
+        **(headers or {}),
+    }
+
+    byte_range = requested_range(request, size, etag, last_modified)
+    if byte_range is None:
+        return StreamingResponse(iter_memory(memory_file, 0, size - 1), media_type=media_type,
+                                 headers={**base_headers, "Content-Length": str(size)})
+
+    start, end = byte_range
+    return StreamingResponse(
+        iter_memory(memory_file, start, end),
+        status_code=206,
+        media_type=media_type,
+        headers={
+            **base_headers,
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(end - start + 1),
+        },
+    )
@@ -0,0 +1,308 @@
+"""
+Suivi des traitements asynchrones
+
+Chaque traitement soumis via /api/jobs reçoit un identifiant et un
+répertoire de travail sur le disque local. Ce répertoire contient les
+fichiers reçus, le fichier résultat, un fichier progress.json que le
+worker met à jour pendant le traitement et, si le traitement est profilé,
+son profil (dossier profile, voir processors/profiling.py). Les répertoires des traitements
+terminés sont supprimés après JOB_TTL_SECONDS.
+
+Une demande identique à un traitement en cours ou terminé depuis moins de
+dedup_ttl_seconds (même traitement, mêmes fichiers, mêmes paramètres, voir
+request_key) est rattachée à ce traitement au lieu d'en lancer un second.
+
+Un traitement dont les fichiers ont été reçus en mémoire produit un
+résultat en mémoire (MemoryFile): il est gardé tel quel tant que les
+résultats en mémoire ne dépassent pas memory_max_bytes au total, sinon il
+est écrit dans le répertoire du traitement. Le paquet zip d'un résultat
+(?package=zip) est construit une fois et gardé de la même façon.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from processors import change_report, run_processor, merge_worker_stats, merge_worker_failure, sources
+
+PROGRESS_FILENAME = "progress.json"
+PROFILE_DIRNAME = "profile"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class ProgressFile:
+    """
+    Callback de progression écrit dans un fichier JSON
+
+    Passé au processeur dans le worker: il doit rester sérialisable
+    (pickle) et ne dépend que du chemin du fichier.
+    """
+
+    MIN_INTERVAL = 0.5  # secondes entre deux écritures
+
+    def __init__(self, path: str):
+        self.path = path
+        self._last_write = 0.0
+
+    def __call__(self, current, total):
+        now = time.monotonic()
+        if current < total and now - self._last_write < self.MIN_INTERVAL:
+            return
+        self._last_write = now
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"current": current, "total": total}, f)
+        os.replace(tmp_path, self.path)
+
+
+def request_key(treatment_id: str, file_digests: dict, params: dict) -> str:
+    """
+    Empreinte d'une demande de traitement
+
+    file_digests: {file_id: SHA-256 du contenu}. Les paramètres sont ceux
+    validés par l'API (valeurs par défaut comprises), sérialisés avec les
+    clés triées: l'ordre des champs envoyés n'a pas d'importance.
+    """
+    canonical = json.dumps(
+        {"treatment": treatment_id, "files": file_digests, "params": params},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':')
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def run_job(treatment_id: str, files: dict, params: dict, progress_path: str, profile_dir=None) -> dict:
+    """Point d'entrée exécuté dans le worker (profile_dir: voir run_processor)"""
+    progress_callback = ProgressFile(progress_path)
+    progress_callback(0, 1)
+    return run_processor(treatment_id, files, params, progress_callback, profile_dir)
+
+
+class Job:
+    """État d'un traitement côté serveur"""
+
+    def __init__(self, job_id: str, treatment_id: str, params: dict, job_dir: str,
+                 result_filename: str, media_type: str):
+        self.id = job_id
+        self.treatment_id = treatment_id
+        self.params = params
+        self.dir = job_dir
+        self.result_filename = result_filename
+        self.media_type = media_type
+        self.state = QUEUED
+        self.request_key = None
+        self.result_path = None  # chemin ou MemoryFile
+        self.memory_bytes = 0    # taille du résultat (et des paquets) gardés en mémoire
+        self.packages = {}       # format -> paquet déjà construit (chemin ou MemoryFile)
+        self.profile_dir = None  # répertoire du profil, si le traitement est profilé
+        self.future = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def progress_path(self) -> str:
+        return os.path.join(self.dir, PROGRESS_FILENAME)
+
+    def enable_profiling(self):
+        """Le worker écrira le profil du traitement dans le répertoire du traitement"""
+        self.profile_dir = os.path.join(self.dir, PROFILE_DIRNAME)
+
+    def read_progress(self):
+        """Dernière progression écrite par le worker, ou None"""
+        try:
+            with open(self.progress_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def to_dict(self) -> dict:
+        state = self.state
+        progress = self.read_progress()
+        if state == QUEUED and progress is not None:
+            state = RUNNING
+        if state == DONE:
+            progress = {"current": 1, "total": 1}
+
+        percent = 0
+        if progress and progress.get("total"):
+            percent = round(100 * progress["current"] / progress["total"])
+
+        return {
+            "id": self.id,
+            "treatment_id": self.treatment_id,
+            "state": state,
+            "progress": percent,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "profiled": self.profile_dir is not None,
+        }
+
+
+class JobStore:
+    """Registre en mémoire des traitements et de leurs répertoires"""
+
+    def __init__(self, base_dir: str, ttl_seconds: int, dedup_ttl_seconds: int = 0, memory_max_bytes: int = 0):
+        self.base_dir = base_dir
+        self.ttl_seconds = ttl_seconds
+        self.dedup_ttl_seconds = dedup_ttl_seconds
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_bytes = 0  # résultats gardés en mémoire, au total
+        self._jobs = {}
+        self._by_key = {}  # empreinte de la demande -> traitement
+        self._lock = threading.Lock()
+        os.makedirs(base_dir, exist_ok=True)
+
+    def create(self, treatment_id: str, params: dict, result_filename: str, media_type: str) -> Job:
+        """Crée un traitement et son répertoire de travail"""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.base_dir, job_id)
+        os.makedirs(job_dir)
+        job = Job(job_id, treatment_id, params, job_dir, result_filename, media_type)
+        with self._lock:
+            self._jobs[job_id] = job
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job: Job):
+        """Oublie un traitement qui n'a pas pu être lancé"""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+            if self._by_key.get(job.request_key) is job:
+                del self._by_key[job.request_key]
+            self._release(job)
+        shutil.rmtree(job.dir, ignore_errors=True)
+
+    def _reusable(self, job: Job) -> bool:
+        if job.state == FAILED or job.future is None or self._jobs.get(job.id) is not job:
+            return False
+        if job.state != DONE:
+            return True
+        return time.time() - job.finished_at < self.dedup_ttl_seconds and sources.exists(job.result_path)
+
+    def claim(self, job: Job, key: str):
+        """
+        Associe la demande key au traitement job, sauf si une demande
+        identique est en cours ou vient de se terminer
+
+        Returns:
+            Le traitement existant à réutiliser, ou None (job est alors
+            le traitement de référence pour cette demande)
+        """
+        if self.dedup_ttl_seconds <= 0:
+            return None
+        with self._lock:
+            existing = self._by_key.get(key)
+            if existing is not None and existing is not job and self._reusable(existing):
+                return existing
+            job.request_key = key
+            self._by_key[key] = job
+        return None
+
+    def attach(self, job: Job, future):
+        """
+        Met à jour le traitement quand il se termine
+
+        future: concurrent.futures.Future d'un worker (résultat de run_job)
+        ou tâche asyncio dont le résultat est le chemin du fichier produit.
+        """
+        def on_done(future):
+            try:
+                result = future.result()
+                if isinstance(result, dict):
+                    merge_worker_stats(result["stats"])
+                    result = result["result_path"]
+                job.result_path = self._keep(job, result) if sources.is_memory(result) else result
+                job.state = DONE
+            except Exception as e:
+                job.error = str(e)
+                job.state = FAILED
+                merge_worker_failure(job.treatment_id, e)
+            job.finished_at = time.time()
+
+        # Référence forte: la boucle asyncio ne garde qu'une référence faible aux tâches
+        job.future = future
+        future.add_done_callback(on_done)
+
+    def _keep(self, job: Job, result):
+        """Résultat en mémoire gardé tel quel dans la limite de memory_max_bytes, sinon écrit sur le disque"""
+        size = sources.source_size(result)
+        with self._lock:
+            if self.memory_bytes + size <= self.memory_max_bytes:
+                self.memory_bytes += size
+                job.memory_bytes = size
+                return result
+
+        path = os.path.join(job.dir, result.name)
+        with open(path, 'wb') as f:
+            f.write(result.getbuffer())
+        report = change_report.read_report(result)
+        if report is not None:
+            change_report.write_report(path, report)
+        return path
+
+    def keep_package(self, job: Job, package_format: str, package):
+        """
+        Garde le paquet construit pour les téléchargements suivants
+
+        Un paquet en mémoire compte dans memory_max_bytes comme un résultat,
+        sinon il est écrit dans le répertoire du traitement. Retourne le
+        paquet à envoyer (celui d'une construction concurrente s'il existe).
+        """
+        in_memory = sources.is_memory(package)
+        with self._lock:
+            existing = job.packages.get(package_format)
+            if existing is not None:
+                return existing
+            if self._jobs.get(job.id) is not job:
+                return package  # traitement oublié entre-temps: pas de cache
+            size = sources.source_size(package) if in_memory else 0
+            if not in_memory or self.memory_bytes + size <= self.memory_max_bytes:
+                self.memory_bytes += size
+                job.memory_bytes += size
+                job.packages[package_format] = package
+                return package
+
+        path = os.path.join(job.dir, package.name)
+        with open(path, 'wb') as f:
+            f.write(package.getbuffer())
+        with self._lock:
+            return job.packages.setdefault(package_format, path)
+
+    def _release(self, job: Job):
+        """Libère la place du résultat en mémoire (verrou déjà pris)"""
+        self.memory_bytes -= job.memory_bytes
+        job.memory_bytes = 0
+
+    def purge_expired(self):
+        """Supprime les traitements terminés depuis plus de ttl_seconds"""
+        limit = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [job for job in self._jobs.values()
+                       if job.finished_at is not None and job.finished_at < limit]
+            for job in expired:
+                del self._jobs[job.id]
+                if self._by_key.get(job.request_key) is job:
+                    del self._by_key[job.request_key]
+                self._release(job)
+            known = set(self._jobs)
+
+        for job in expired:
+            shutil.rmtree(job.dir, ignore_errors=True)
+
+        # Répertoires laissés par un précédent démarrage du serveur
+        for name in os.listdir(self.base_dir):
+            path = os.path.join(self.base_dir, name)
+            if name not in known and os.path.getmtime(path) < limit:
+                shutil.rmtree(path, ignore_errors=True)
@@ -1,22 +1,75 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import UploadFile as FormFile
+from contextlib import asynccontextmanager
 from typing import Dict, List, Optional
+import asyncio
+import hashlib
+import hmac
 import json
 import tempfile
 import os
-import shutil
 from pathlib import Path
 
 # Import des processeurs de scripts
-from processors import PROCESSORS_REGISTRY, process_files
+from processors import PROCESSORS_REGISTRY, PREFLIGHT_CHECKS, accepted_extensions, check_files, concurrency_limits, merge_worker_stats, validate_params, warm_up, export_cache, instrumentation, sources
+from processors.profiling import PROFILE_FILES, profile_path
+from workers import ProcessingPool, PoolSaturatedError
+from jobs import JobStore, ProgressFile, request_key, run_job, DONE, FAILED
+from batch import BatchError, extract_batch, run_items, write_results
+from uploads import BodySizeLimitMiddleware, memory_upload_route, read_upload, save_upload
+from downloads import build_package, check_package, file_response, package_filename
 
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 
+# Configuration
+MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "4"))
+PREWARM_WORKERS = os.getenv("PREWARM_WORKERS", "0") == "1"
+RETRY_AFTER_SECONDS = 30
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(tempfile.gettempdir(), "mat-portal-jobs"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+DEDUP_TTL_SECONDS = int(os.getenv("DEDUP_TTL_SECONDS", "600"))
+JOB_CLEANUP_INTERVAL = 60
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", str(200 * 1024 * 1024)))
+FORM_MARGIN = 1024 * 1024  # champs du formulaire autour des fichiers
+# Fichiers d'un traitement gardés en mémoire jusqu'à cette taille totale (0: toujours sur le disque)
+MEMORY_PIPELINE_MAX_BYTES = int(os.getenv("MEMORY_PIPELINE_MAX_BYTES", str(16 * 1024 * 1024)))
+MEMORY_RESULTS_MAX_BYTES = int(os.getenv("MEMORY_RESULTS_MAX_BYTES", str(64 * 1024 * 1024)))
+# Jeton d'administration du profilage à la demande (vide: profilage désactivé)
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+RESULT_MEDIA_TYPES = {".xlsx": XLSX_MEDIA_TYPE, ".json": "application/json", ".zip": "application/zip"}
+
+# Les workers importent les processeurs à leur démarrage, l'API ne les charge jamais
+processing_pool = ProcessingPool(MAX_CONCURRENT_JOBS, MAX_QUEUED_JOBS, initializer=warm_up)
+job_store = JobStore(JOBS_DIR, JOB_TTL_SECONDS, min(DEDUP_TTL_SECONDS, JOB_TTL_SECONDS), MEMORY_RESULTS_MAX_BYTES)
+
+
+async def purge_jobs_periodically():
+    """Supprime régulièrement les résultats expirés"""
+    while True:
+        await asyncio.to_thread(job_store.purge_expired)
+        await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    cleanup_task = asyncio.create_task(purge_jobs_periodically())
+    if PREWARM_WORKERS:
+        processing_pool.warm_up()
+    yield
+    cleanup_task.cancel()
+    processing_pool.shutdown()
+
+
 app = FastAPI(
     title="Excel Processing API",
     description="API pour le traitement de fichiers Excel",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -28,11 +81,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Disposition", "Content-Location", "Content-Range", "Accept-Ranges", "ETag",
+                    "X-Profile-Location"],
 )
 
-# Configuration
-MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
-ALLOWED_EXTENSIONS = {'.xlsx', '.xls'}
+def max_upload_size(file_ext: str) -> int:
+    """Taille maximale d'un fichier reçu (archive zip ou fichier Excel)"""
+    return MAX_BATCH_SIZE if file_ext == '.zip' else MAX_FILE_SIZE
+
+
+def route_body_limits() -> dict:
+    """
+    Taille maximale du corps des requêtes d'envoi de fichiers, par route
+    
+    Les fichiers déclarés par le traitement (chacun à sa taille maximale),
+    plus FORM_MARGIN pour les champs du formulaire. Les autres routes sont
+    limitées à FORM_MARGIN.
+    """
+    limits = {}
+    for treatment_id, config in PROCESSORS_REGISTRY.items():
+        files_size = sum(max(max_upload_size(ext) for ext in accepted_extensions(file_config))
+                         for file_config in config["files"].values())
+        for route in ("process", "jobs", "validate"):
+            limits[f"/api/{route}/{treatment_id}"] = files_size + FORM_MARGIN
+        limits[f"/api/batch/{treatment_id}"] = MAX_BATCH_SIZE + FORM_MARGIN
+    return limits
+
+
+app.add_middleware(BodySizeLimitMiddleware, max_body_size=FORM_MARGIN, route_limits=route_body_limits())
 
 
 @app.get("/")
@@ -43,7 +119,14 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "treatments": "/api/treatments",
-            "process": "/api/process/{treatment_id}"
+            "process": "/api/process/{treatment_id}",
+            "validate": "/api/validate/{treatment_id}",
+            "jobs": "/api/jobs/{treatment_id}",
+            "job_status": "/api/jobs/{job_id}",
+            "job_result": "/api/jobs/{job_id}/result",
+            "job_profile": "/api/jobs/{job_id}/profile",
+            "batch": "/api/batch/{treatment_id}",
+            "cache": "/api/cache"
         }
     }
 
@@ -58,129 +141,504 @@ async def get_treatments():
                 "name": config["name"],
                 "description": config["description"],
                 "files": config["files"],
-                "params": config["params"]
+                "params": config["params"],
+                "resource_class": config.get("resource_class", "cpu"),
+                "max_concurrency": config.get("max_concurrency")
             }
             for processor_id, config in PROCESSORS_REGISTRY.items()
         ]
     }
 
 
-@app.post("/api/process/{treatment_id}")
+def get_processor_config(treatment_id: str) -> dict:
+    """Configuration du traitement demandé, ou 404"""
+    if treatment_id not in PROCESSORS_REGISTRY:
+        raise HTTPException(status_code=404, detail=f"Traitement '{treatment_id}' non trouvé")
+    return PROCESSORS_REGISTRY[treatment_id]
+
+
+def parse_params(processor_config: dict, params: str) -> dict:
+    """Parse et valide les paramètres JSON du traitement"""
+    try:
+        params_dict = json.loads(params)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Paramètres JSON invalides")
+    
+    try:
+        return validate_params(processor_config, params_dict)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def form_files(request: Request, processor_config: dict) -> dict:
+    """Fichiers du formulaire pour chaque fichier déclaré par le traitement (champ file_<id>)"""
+    form = await request.form()
+    files_map = {}
+    for file_id in processor_config["files"]:
+        value = form.get(f"file_{file_id}")
+        files_map[file_id] = value if isinstance(value, FormFile) and value.filename else None
+    return files_map
+
+
+def declared_file_fields(path_params: dict) -> set:
+    """Champs file_<id> déclarés par le traitement de la route"""
+    config = PROCESSORS_REGISTRY.get(path_params.get("treatment_id"))
+    return {f"file_{file_id}" for file_id in config["files"]} if config else set()
+
+
+# Routes d'envoi des fichiers d'un traitement: seuls les fichiers déclarés
+# restent en mémoire, MEMORY_PIPELINE_MAX_BYTES au total par requête
+upload_routes = APIRouter(route_class=memory_upload_route(declared_file_fields, MEMORY_PIPELINE_MAX_BYTES))
+
+
+def in_memory(files_map: dict) -> bool:
+    """Les fichiers reçus sont assez petits pour être traités sans passer par le disque"""
+    sizes = [upload_file.size for upload_file in files_map.values() if upload_file]
+    return MEMORY_PIPELINE_MAX_BYTES > 0 and None not in sizes and sum(sizes) <= MEMORY_PIPELINE_MAX_BYTES
+
+
+def uploads_dir(files_map: dict, work_dir: str):
+    """Répertoire où copier les fichiers reçus, ou None pour les garder en mémoire"""
+    return None if in_memory(files_map) else work_dir
+
+
+async def save_uploads(processor_config: dict, files_map: dict, dest_dir, digests=None) -> dict:
+    """
+    Sauvegarde les fichiers attendus par le traitement dans dest_dir
+    
+    dest_dir=None: les fichiers sont gardés en mémoire (MemoryFile).
+    digests, s'il est fourni, reçoit l'empreinte SHA-256 de chaque fichier
+    ({file_id: hexdigest}), calculée pendant la copie.
+    
+    Returns:
+        Dictionnaire {file_id: chemin_fichier ou MemoryFile}
+    """
+    uploaded_files = {}
+    
+    for file_id, file_config in processor_config["files"].items():
+        upload_file = files_map.get(file_id)
+        
+        if not upload_file:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Fichier manquant: {file_config['label']}"
+            )
+        
+        # Valider l'extension (celles déclarées par le traitement pour ce fichier)
+        file_ext = Path(upload_file.filename).suffix.lower()
+        allowed_extensions = accepted_extensions(file_config)
+        if file_ext not in allowed_extensions:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Extension non autorisée: {file_ext}"
+            )
+        
+        # Copier par blocs en validant le format et la taille
+        max_size = max_upload_size(file_ext)
+        digest = hashlib.sha256()
+        if dest_dir is None:
+            uploaded_files[file_id] = await read_upload(upload_file, f"{file_id}{file_ext}", file_ext, max_size, digest)
+        else:
+            temp_file_path = os.path.join(dest_dir, f"{file_id}{file_ext}")
+            await save_upload(upload_file, temp_file_path, file_ext, max_size, digest)
+            uploaded_files[file_id] = temp_file_path
+        if digests is not None:
+            digests[file_id] = digest.hexdigest()
+    
+    return uploaded_files
+
+
+async def receive_uploads(treatment_id: str, processor_config: dict, files_map: dict, dest_dir: str,
+                          digests=None) -> dict:
+    """save_uploads, mesuré comme l'étape "upload" du traitement"""
+    records = []
+    try:
+        with instrumentation.stage("upload", records, treatment_id) as record:
+            uploaded_files = await save_uploads(processor_config, files_map, dest_dir, digests)
+            record.bytes = sum(sources.source_size(source) for source in uploaded_files.values())
+    finally:
+        instrumentation.merge_records(treatment_id, records)
+    return uploaded_files
+
+
+async def run_preflight(treatment_id: str, uploaded_files: dict, params_dict: dict) -> list:
+    """Vérification préalable des en-têtes dans un thread de l'API, mesurée comme l'étape preflight"""
+    records = []
+    try:
+        with instrumentation.stage("preflight", records, treatment_id) as record:
+            problems = await asyncio.to_thread(check_files, treatment_id, uploaded_files, params_dict)
+            record.rows = len(problems)
+    finally:
+        instrumentation.merge_records(treatment_id, records)
+    return problems
+
+
+async def check_preflight(treatment_id: str, uploaded_files: dict, params_dict: dict):
+    """Refuse (422, tous les problèmes) un traitement voué à l'échec avant de le confier à un worker"""
+    if not PREFLIGHT_CHECKS:
+        return
+    problems = await run_preflight(treatment_id, uploaded_files, params_dict)
+    if problems:
+        instrumentation.count_treatment(treatment_id, "rejected")
+        raise HTTPException(status_code=422, detail=problems)
+
+
+def check_admin_token(request: Request):
+    """Refuse (403) une requête sans le jeton PROFILING_TOKEN dans l'en-tête X-Admin-Token"""
+    if not PROFILING_TOKEN:
+        raise HTTPException(status_code=403, detail="Profilage désactivé sur ce serveur")
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode('utf-8'), PROFILING_TOKEN.encode('utf-8')):
+        raise HTTPException(status_code=403, detail="Jeton d'administration invalide")
+
+
+def profiling_requested(request: Request) -> bool:
+    """
+    Le client demande le profilage du traitement (en-tête X-Profile: 1 ou ?profile=1)
+    
+    Réservé aux administrateurs: une demande sans jeton valide est refusée.
+    """
+    flag = request.headers.get("X-Profile") or request.query_params.get("profile")
+    if (flag or "").lower() not in ("1", "true"):
+        return False
+    check_admin_token(request)
+    return True
+
+
+def result_filename(treatment_id: str, params_dict: dict) -> str:
+    """Nom du fichier résultat proposé au téléchargement"""
+    name = f"resultat_{treatment_id}_{params_dict.get('export_date', 'output').replace('/', '-')}"
+    if params_dict.get('mode') == 'delta':
+        return f"{name}_delta.{params_dict.get('delta_format') or 'xlsx'}"
+    return f"{name}.xlsx"
+
+
+def result_media_type(filename: str) -> str:
+    return RESULT_MEDIA_TYPES.get(Path(filename).suffix.lower(), "application/octet-stream")
+
+
+@upload_routes.post("/api/process/{treatment_id}")
 async def process_treatment(
     treatment_id: str,
+    request: Request,
     params: str = Form(...),
-    file_tracking: Optional[UploadFile] = File(None),
-    file_export: Optional[UploadFile] = File(None),
-    file_sales: Optional[UploadFile] = File(None),
-    file_file1: Optional[UploadFile] = File(None),
-    file_file2: Optional[UploadFile] = File(None),
+    package: Optional[str] = None,
 ):
     """
     Traite un fichier Excel selon le traitement sélectionné
-    """
     
-    # Vérifier que le traitement existe
-    if treatment_id not in PROCESSORS_REGISTRY:
-        raise HTTPException(status_code=404, detail=f"Traitement '{treatment_id}' non trouvé")
+    Le résultat est conservé comme celui d'un traitement asynchrone: si le
+    téléchargement est interrompu, il reprend (requête Range) sur l'URL
+    indiquée par l'en-tête Content-Location, sans relancer le traitement.
+    ?package=zip renvoie le résultat et le rapport des modifications en zip.
     
-    processor_config = PROCESSORS_REGISTRY[treatment_id]
+    Avec X-Profile: 1 (ou ?profile=1) et le jeton d'administration, le
+    traitement est profilé: l'en-tête X-Profile-Location donne l'URL du profil.
     
-    # Parser les paramètres
-    try:
-        params_dict = json.loads(params)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="Paramètres JSON invalides")
+    Jusqu'à MEMORY_PIPELINE_MAX_BYTES, fichiers reçus et résultat restent en
+    mémoire, de la réception à la réponse.
+    """
+    processor_config = get_processor_config(treatment_id)
+    check_package(package)
+    profile = profiling_requested(request)
+    
+    # Refuser tout de suite plutôt que de recevoir des fichiers qui ne pourront pas être traités
+    if processing_pool.is_saturated():
+        raise_saturated()
     
-    # Créer un répertoire temporaire
-    temp_dir = tempfile.mkdtemp()
+    params_dict = parse_params(processor_config, params)
+    filename = result_filename(treatment_id, params_dict)
+    job = job_store.create(treatment_id, params_dict, filename, result_media_type(filename))
+    if profile:
+        job.enable_profiling()
     
     try:
-        # Mapper les fichiers reçus
-        files_map = {
-            'tracking': file_tracking,
-            'export': file_export,
-            'sales': file_sales,
-            'file1': file_file1,
-            'file2': file_file2,
-        }
+        # Fichiers reçus (champs file_<id> déclarés par le traitement)
+        files_map = await form_files(request, processor_config)
         
         # Sauvegarder les fichiers uploadés
-        uploaded_files = {}
+        digests = {}
+        uploaded_files = await receive_uploads(treatment_id, processor_config, files_map,
+                                               uploads_dir(files_map, job.dir), digests)
+        await check_preflight(treatment_id, uploaded_files, params_dict)
         
-        for file_id, file_config in processor_config["files"].items():
-            upload_file = files_map.get(file_id)
+        # Demande identique déjà en cours ou terminée à l'instant: on attend son résultat
+        # (un traitement profilé est toujours exécuté)
+        existing = None if profile else job_store.claim(job, request_key(treatment_id, digests, params_dict))
+        if existing is not None:
+            job_store.discard(job)
+            instrumentation.count_deduplicated(treatment_id)
+            # shield: une déconnexion de ce client n'annule pas le traitement partagé
+            await asyncio.shield(asyncio.wrap_future(existing.future))
+            result_job = existing
+        else:
+            # Exécuter le traitement dans le pool de workers
+            try:
+                future = processing_pool.submit(run_job, treatment_id, uploaded_files, params_dict, job.progress_path,
+                                                job.profile_dir, limits=concurrency_limits(treatment_id))
+            except PoolSaturatedError:
+                raise_saturated()
+            job_store.attach(job, future)
+            result = await asyncio.wrap_future(future)
             
-            if not upload_file:
+            if not sources.exists(result["result_path"]):
                 raise HTTPException(
-                    status_code=400,
-                    detail=f"Fichier manquant: {file_config['label']}"
+                    status_code=500,
+                    detail="Le traitement n'a pas produit de fichier résultat"
                 )
-            
-            # Valider l'extension
-            file_ext = Path(upload_file.filename).suffix.lower()
-            if file_ext not in ALLOWED_EXTENSIONS:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Extension non autorisée: {file_ext}"
-                )
-            
-            # Lire et valider la taille
-            content = await upload_file.read()
-            if len(content) > MAX_FILE_SIZE:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Fichier trop volumineux"
-                )
-            
-            # Sauvegarder
-            temp_file_path = os.path.join(temp_dir, f"{file_id}{file_ext}")
-            with open(temp_file_path, 'wb') as f:
-                f.write(content)
-            
-            uploaded_files[file_id] = temp_file_path
-        
-        # Valider les paramètres requis
-        for param_id in processor_config["params"].keys():
-            if param_id not in params_dict:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Paramètre manquant: {processor_config['params'][param_id]['label']}"
-                )
-        
-        # Exécuter le traitement
-        result_path = process_files(treatment_id, uploaded_files, params_dict)
-        
-        if not os.path.exists(result_path):
-            raise HTTPException(
-                status_code=500,
-                detail="Le traitement n'a pas produit de fichier résultat"
-            )
-        
-        # Nom du fichier résultat
-        result_filename = f"resultat_{treatment_id}_{params_dict.get('export_date', 'output').replace('/', '-')}.xlsx"
-        
-        # Retourner le fichier
-        return FileResponse(
-            path=result_path,
-            filename=result_filename,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            background=lambda: cleanup_temp_dir(temp_dir)
-        )
+            result_job = job
         
     except HTTPException:
-        cleanup_temp_dir(temp_dir)
+        job_store.discard(job)
         raise
     except Exception as e:
-        cleanup_temp_dir(temp_dir)
+        job_store.discard(job)
         import traceback
         traceback.print_exc()  # Pour debug sur Render
         raise HTTPException(status_code=500, detail=f"Erreur lors du traitement: {str(e)}")
+    
+    # Hors du try: une erreur de la réponse (Range invalide: 416) ne supprime pas un
+    # résultat réussi, qui reste téléchargeable via /api/jobs et pour les demandes identiques
+    response = await job_result_response(request, result_job, package)
+    if profile:
+        response.headers["X-Profile-Location"] = f"/api/jobs/{job.id}/profile"
+    return response
 
 
-def cleanup_temp_dir(temp_dir: str):
-    """Supprime le répertoire temporaire"""
+@upload_routes.post("/api/validate/{treatment_id}")
+async def validate_treatment(
+    treatment_id: str,
+    request: Request,
+    params: str = Form(...),
+):
+    """
+    Vérifie les fichiers sans lancer le traitement
+    
+    Mêmes champs que /api/process/{treatment_id}. Seuls les onglets et les
+    lignes d'en-tête sont lus, sans passer par le pool de workers: la
+    réponse liste tous les problèmes (onglets, colonnes, date déjà importée).
+    """
+    processor_config = get_processor_config(treatment_id)
+    params_dict = parse_params(processor_config, params)
+    
+    files_map = await form_files(request, processor_config)
+    if in_memory(files_map):
+        uploaded_files = await save_uploads(processor_config, files_map, None)
+        problems = await run_preflight(treatment_id, uploaded_files, params_dict)
+    else:
+        with tempfile.TemporaryDirectory(prefix="mat-portal-validate-") as temp_dir:
+            uploaded_files = await save_uploads(processor_config, files_map, temp_dir)
+            problems = await run_preflight(treatment_id, uploaded_files, params_dict)
+    
+    return {"valid": not problems, "problems": problems}
+
+
+async def job_result_response(request: Request, job, package: Optional[str]):
+    """Résultat d'un traitement terminé, brut ou en paquet zip"""
+    result_url = f"/api/jobs/{job.id}/result"
+    if package is None:
+        return file_response(request, job.result_path, job.result_filename, job.media_type,
+                             headers={"Content-Location": result_url})
+    
+    package_path = job.packages.get(package)
+    if package_path is None:
+        package_path = await asyncio.to_thread(
+            build_package, job.result_path, job.result_filename, os.path.join(job.dir, f"package.{package}")
+        )
+        package_path = job_store.keep_package(job, package, package_path)
+    return file_response(request, package_path, package_filename(job.result_filename), "application/zip",
+                         headers={"Content-Location": f"{result_url}?package={package}"})
+
+
+@upload_routes.post("/api/jobs/{treatment_id}", status_code=202)
+async def create_job(
+    treatment_id: str,
+    request: Request,
+    params: str = Form(...),
+):
+    """
+    Lance un traitement en arrière-plan et retourne immédiatement son identifiant
+    
+    Profilage à la demande comme pour /api/process/{treatment_id}.
+    """
+    processor_config = get_processor_config(treatment_id)
+    profile = profiling_requested(request)
+    
+    if processing_pool.is_saturated():
+        raise_saturated()
+    
+    params_dict = parse_params(processor_config, params)
+    filename = result_filename(treatment_id, params_dict)
+    job = job_store.create(treatment_id, params_dict, filename, result_media_type(filename))
+    if profile:
+        job.enable_profiling()
+    
     try:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-    except Exception as e:
-        print(f"Erreur lors du nettoyage du répertoire temporaire: {e}")
+        files_map = await form_files(request, processor_config)
+        digests = {}
+        uploaded_files = await receive_uploads(treatment_id, processor_config, files_map,
+                                               uploads_dir(files_map, job.dir), digests)
+        await check_preflight(treatment_id, uploaded_files, params_dict)
+        
+        existing = None if profile else job_store.claim(job, request_key(treatment_id, digests, params_dict))
+        if existing is not None:
+            job_store.discard(job)
+            instrumentation.count_deduplicated(treatment_id)
+            return job_links(existing, deduplicated=True)
+        
+        try:
+            future = processing_pool.submit(run_job, treatment_id, uploaded_files, params_dict, job.progress_path,
+                                            job.profile_dir, limits=concurrency_limits(treatment_id))
+        except PoolSaturatedError:
+            raise_saturated()
+    except Exception:
+        job_store.discard(job)
+        raise
+    
+    job_store.attach(job, future)
+    
+    return job_links(job)
+
+
+app.include_router(upload_routes)
+
+
+def job_links(job, deduplicated: bool = False) -> dict:
+    """Réponse de création d'un traitement asynchrone"""
+    links = {
+        "job_id": job.id,
+        "status_url": f"/api/jobs/{job.id}",
+        "result_url": f"/api/jobs/{job.id}/result",
+        "deduplicated": deduplicated
+    }
+    if job.profile_dir:
+        links["profile_url"] = f"/api/jobs/{job.id}/profile"
+    return links
+
+
+def get_job_or_404(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Traitement inconnu ou expiré")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """État et progression d'un traitement"""
+    return get_job_or_404(job_id).to_dict()
+
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str, request: Request, package: Optional[str] = None):
+    """
+    Télécharge le fichier résultat d'un traitement terminé
+    
+    Accepte les requêtes Range pour reprendre un téléchargement interrompu.
+    """
+    job = get_job_or_404(job_id)
+    check_package(package)
+    
+    if job.state == FAILED:
+        raise HTTPException(status_code=409, detail=f"Le traitement a échoué: {job.error}")
+    if job.state != DONE:
+        raise HTTPException(status_code=409, detail="Le traitement n'est pas terminé")
+    if not sources.exists(job.result_path):
+        raise HTTPException(status_code=500, detail="Le traitement n'a pas produit de fichier résultat")
+    
+    return await job_result_response(request, job, package)
+
+
+@app.get("/api/jobs/{job_id}/profile")
+async def get_job_profile(job_id: str, request: Request, format: str = "pstats"):
+    """
+    Télécharge le profil d'un traitement profilé (jeton d'administration requis)
+    
+    format: pstats (cProfile), collapsed (piles échantillonnées, pour un
+    flame graph) ou text (résumé par temps cumulé). Disponible dès la fin
+    du traitement, y compris en échec.
+    """
+    check_admin_token(request)
+    job = get_job_or_404(job_id)
+    if format not in PROFILE_FILES:
+        raise HTTPException(status_code=400, detail=f"Format de profil inconnu: {format}")
+    if job.profile_dir is None:
+        raise HTTPException(status_code=404, detail="Ce traitement n'a pas été profilé")
+    
+    if job.state not in (DONE, FAILED):
+        raise HTTPException(status_code=409, detail="Le traitement n'est pas terminé")
+    
+    path = profile_path(job.profile_dir, format)
+    if not os.path.exists(path):
+        # Worker interrompu avant d'avoir écrit le profil
+        raise HTTPException(status_code=404, detail="Aucun profil enregistré pour ce traitement")
+    filename, media_type = PROFILE_FILES[format]
+    return file_response(request, path, f"{job.id}_{filename}", media_type)
+
+
+@app.post("/api/batch/{treatment_id}", status_code=202)
+async def create_batch(treatment_id: str, file_batch: UploadFile = File(...)):
+    """
+    Lance un traitement par lots à partir d'une archive zip (voir batch.py)
+    
+    Le suivi et le téléchargement du zip résultat passent par /api/jobs/{job_id}.
+    """
+    processor_config = get_processor_config(treatment_id)
+    
+    if Path(file_batch.filename).suffix.lower() != '.zip':
+        raise HTTPException(status_code=400, detail="Le lot doit être une archive .zip")
+    
+    job = job_store.create(f"batch:{treatment_id}", {}, f"resultats_batch_{treatment_id}.zip", "application/zip")
+    
+    try:
+        archive_path = os.path.join(job.dir, "batch.zip")
+        await save_upload(file_batch, archive_path, '.zip', MAX_BATCH_SIZE)
+        items = await asyncio.to_thread(
+            extract_batch, archive_path, os.path.join(job.dir, "items"), processor_config, MAX_FILE_SIZE,
+            MAX_BATCH_SIZE
+        )
+    except BatchError as e:
+        job_store.discard(job)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        job_store.discard(job)
+        raise
+    
+    async def run_batch():
+        await run_items(processing_pool, treatment_id, items, ProgressFile(job.progress_path))
+        for item in items:
+            if item.stats:
+                merge_worker_stats(item.stats)
+        output_path = os.path.join(job.dir, job.result_filename)
+        await asyncio.to_thread(write_results, items, output_path)
+        return output_path
+    
+    job_store.attach(job, asyncio.create_task(run_batch()))
+    
+    return {
+        "job_id": job.id,
+        "items": len(items),
+        "status_url": f"/api/jobs/{job.id}",
+        "result_url": f"/api/jobs/{job.id}/result"
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Mesures des traitements au format Prometheus"""
+    return PlainTextResponse(instrumentation.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/cache")
+async def get_cache_stats():
+    """Compteurs et occupation du cache des exports regroupés"""
+    return await asyncio.to_thread(export_cache.describe)
+
+
+def raise_saturated():
+    """Refus immédiat quand tous les workers et la file d'attente sont occupés"""
+    raise HTTPException(
+        status_code=503,
+        detail="Serveur occupé, trop de traitements en cours. Réessayez dans quelques instants.",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
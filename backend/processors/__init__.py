@@ -3,10 +3,39 @@ Module de gestion des processeurs de scripts
 
 Chaque processeur doit exposer:
 - Une configuration dans PROCESSORS_REGISTRY
-- Une fonction process(files: dict, params: dict) -> str
+- Une fonction process(files: dict, params: dict, progress_callback=None) -> str
+  files associe à chaque fichier un chemin ou un MemoryFile (voir sources.py);
+  le résultat est du même type: chemin, ou MemoryFile pour des fichiers en mémoire
+
+progress_callback(current, total), s'il est fourni, est appelé pendant le
+traitement pour signaler l'avancement global.
+
+Le registre est déclaratif: "entry_point" ("module:fonction") n'est importé
+qu'au premier traitement (load_processor), ou au démarrage des workers avec
+warm_up(). L'API démarre ainsi sans charger pandas ni openpyxl.
+
+Chaque processeur déclare aussi ses besoins:
+- "resource_class": "cpu" ou "memory". Si MEMORY_HEAVY_SLOTS est défini, les
+  traitements "memory" se partagent ce nombre de places dans le pool, quel
+  que soit le nombre de workers (par défaut: pas de limite propre)
+- "max_concurrency": nombre maximal de traitements simultanés de ce type
+  (None: pas de limite propre)
+
+"preflight" (facultatif, "module:fonction") vérifie les en-têtes des fichiers
+avant le traitement, dans le processus de l'API (voir preflight.py).
 """
 
-from .stock_tracking import process as stock_tracking_process
+import importlib
+import os
+
+from . import export_cache, instrumentation, profiling, sources
+
+# Extensions acceptées pour un fichier qui ne déclare pas "accept"
+ALLOWED_EXTENSIONS = {'.xlsx', '.xls'}
+# Traitements "memory" simultanés dans le pool de l'API (0: limités seulement par le nombre de workers)
+MEMORY_HEAVY_SLOTS = int(os.getenv("MEMORY_HEAVY_SLOTS", "0"))
+# Vérification préalable automatique avant chaque traitement (API et lots)
+PREFLIGHT_CHECKS = os.getenv("PREFLIGHT_CHECKS", "1") == "1"
 
 # Registre de tous les processeurs disponibles
 PROCESSORS_REGISTRY = {
@@ -28,9 +57,45 @@ PROCESSORS_REGISTRY = {
                 "label": "Date d'export",
                 "type": "text",
                 "placeholder": "jj/mm/aaaa"
+            },
+            "mode": {
+                "label": "Résultat",
+                "type": "select",
+                "options": ["full", "delta"],
+                "default": "full",
+                "required": False
+            },
+            "delta_format": {
+                "label": "Format du delta",
+                "type": "select",
+                "options": ["xlsx", "json"],
+                "default": "xlsx",
+                "required": False
             }
         },
-        "processor": stock_tracking_process
+        "entry_point": "processors.stock_tracking:process",
+        "preflight": "processors.preflight:check_stock_tracking",
+        "resource_class": "memory",
+        "max_concurrency": None
+    },
+    "stock-tracking-backfill": {
+        "name": "Reprise d'historique des stocks",
+        "description": "Import de plusieurs exports datés en une seule fois (rattrapage de mois manquants)",
+        "files": {
+            "tracking": {
+                "label": "Fichier de suivi",
+                "accept": ".xlsx,.xls"
+            },
+            "exports": {
+                "label": "Archive des exports (AAAA-MM-JJ.xlsx)",
+                "accept": ".zip"
+            }
+        },
+        "params": {},
+        "entry_point": "processors.stock_tracking:process_backfill",
+        "preflight": "processors.preflight:check_stock_tracking_backfill",
+        "resource_class": "memory",
+        "max_concurrency": 1
     },
     # Ajoutez d'autres processeurs ici
     # "sales-analysis": { ... },
@@ -38,7 +103,106 @@ PROCESSORS_REGISTRY = {
 }
 
 
-def process_files(processor_id: str, files: dict, params: dict) -> str:
+def accepted_extensions(file_config: dict) -> set:
+    """Extensions acceptées pour un fichier ("accept" du registre)"""
+    accept = file_config.get("accept")
+    if not accept:
+        return ALLOWED_EXTENSIONS
+    return {ext.strip().lower() for ext in accept.split(',') if ext.strip()}
+
+
+def validate_params(processor_config: dict, params: dict) -> dict:
+    """
+    Paramètres du traitement complétés par les valeurs par défaut
+
+    Lève ValueError si un paramètre obligatoire manque ou si une valeur
+    n'est pas parmi les "options" déclarées (API et lots).
+    """
+    if not isinstance(params, dict):
+        raise ValueError("Paramètres invalides")
+    params = dict(params)
+    for param_id, param_config in processor_config["params"].items():
+        if param_id not in params:
+            if not param_config.get("required", True):
+                if "default" in param_config:
+                    params[param_id] = param_config["default"]
+                continue
+            raise ValueError(f"Paramètre manquant: {param_config['label']}")
+
+        if "options" in param_config and params[param_id] not in param_config["options"]:
+            raise ValueError(f"Valeur invalide pour {param_config['label']}: {params[param_id]}")
+
+    return params
+
+
+# Fonctions déjà importées dans ce processus ("module:fonction" -> fonction)
+_LOADED = {}
+
+
+def _load_entry_point(entry_point: str):
+    if entry_point not in _LOADED:
+        module_name, function_name = entry_point.split(":")
+        _LOADED[entry_point] = getattr(importlib.import_module(module_name), function_name)
+    return _LOADED[entry_point]
+
+
+def load_processor(processor_id: str):
+    """Importe (une seule fois) la fonction du processeur"""
+    if processor_id not in PROCESSORS_REGISTRY:
+        raise ValueError(f"Processeur '{processor_id}' non trouvé")
+    
+    return _load_entry_point(PROCESSORS_REGISTRY[processor_id]["entry_point"])
+
+
+def check_files(processor_id: str, files: dict, params: dict) -> list:
+    """
+    Vérifie les en-têtes des fichiers avant de lancer le traitement
+    
+    Returns:
+        Liste des problèmes trouvés (vide si le traitement peut être lancé,
+        ou si le processeur ne déclare pas de vérification préalable)
+    """
+    entry_point = PROCESSORS_REGISTRY[processor_id].get("preflight")
+    if not entry_point:
+        return []
+    return _load_entry_point(entry_point)(files, params)
+
+
+def warm_up(processor_ids=None):
+    """
+    Importe à l'avance les processeurs (tous par défaut)
+    
+    Sert d'initializer aux workers: le premier traitement n'attend pas
+    l'import de pandas et openpyxl.
+    """
+    for processor_id in processor_ids or PROCESSORS_REGISTRY:
+        load_processor(processor_id)
+
+
+def concurrency_limits(processor_id: str, memory_slots=None) -> list:
+    """
+    Limites de traitements simultanés à respecter par le pool
+    
+    Args:
+        memory_slots: places des traitements "memory" (MEMORY_HEAVY_SLOTS par
+            défaut, 0 pour ne pas les limiter)
+    
+    Returns:
+        Liste de (clé, nombre maximal): une par type de traitement limité,
+        une partagée par tous les traitements "memory" si memory_slots > 0
+    """
+    if memory_slots is None:
+        memory_slots = MEMORY_HEAVY_SLOTS
+    config = PROCESSORS_REGISTRY[processor_id]
+    limits = []
+    if config.get("max_concurrency"):
+        limits.append((f"treatment:{processor_id}", config["max_concurrency"]))
+    if config.get("resource_class") == "memory" and memory_slots > 0:
+        limits.append(("class:memory", memory_slots))
+    return limits
+
+
+def process_files(processor_id: str, files: dict, params: dict, progress_callback=None) -> str:
     """
     Exécute le processeur correspondant
     
@@ -46,12 +210,65 @@ def process_files(processor_id: str, files: dict, params: dict) -> str:
         processor_id: ID du processeur
         files: Dictionnaire {file_id: chemin_fichier}
         params: Dictionnaire des paramètres
+        progress_callback: Fonction (current, total) appelée pendant le traitement
     
     Returns:
         Chemin du fichier résultat
     """
-    if processor_id not in PROCESSORS_REGISTRY:
-        raise ValueError(f"Processeur '{processor_id}' non trouvé")
+    processor = load_processor(processor_id)
+    return processor(files, params, progress_callback)
+
+
+def run_processor(processor_id: str, files: dict, params: dict, progress_callback=None,
+                  profile_dir=None) -> dict:
+    """
+    Exécute le processeur dans un worker et remonte ses statistiques
+    
+    Les compteurs (cache des exports...) et les mesures des étapes vivent
+    dans le processus du worker: ils sont retournés avec le résultat pour
+    être agrégés par l'API.
+    
+    profile_dir: répertoire où écrire le profil du traitement (voir
+    profiling.py), None pour ne pas profiler.
     
-    processor = PROCESSORS_REGISTRY[processor_id]["processor"]
-    return processor(files, params)
+    Returns:
+        {"result_path": chemin du fichier résultat (MemoryFile si les fichiers
+        reçus sont en mémoire), "stats": {...}}
+    """
+    export_cache.reset_stats()
+    instrumentation.reset_records(processor_id)
+    try:
+        with instrumentation.stage("total") as record:
+            record.bytes = sum(sources.source_size(source) for source in files.values())
+            with profiling.profiled(profile_dir):
+                result_path = process_files(processor_id, files, params, progress_callback)
+    except Exception as e:
+        # Les mesures accompagnent l'exception jusqu'à l'API (attributs conservés par pickle)
+        e.worker_stats = worker_stats(processor_id)
+        raise
+    return {"result_path": result_path, "stats": worker_stats(processor_id)}
+
+
+def worker_stats(processor_id: str) -> dict:
+    return {
+        "treatment": processor_id,
+        "export_cache": export_cache.get_stats(),
+        "stages": instrumentation.get_records(),
+    }
+
+
+def merge_worker_stats(stats: dict):
+    """Agrège dans le processus de l'API les statistiques remontées par un worker"""
+    export_cache.merge_stats(stats.get("export_cache", {}))
+    if stats.get("treatment"):
+        instrumentation.merge_records(stats["treatment"], stats.get("stages", []))
+        instrumentation.count_treatment(stats["treatment"], "ok")
+
+
+def merge_worker_failure(processor_id: str, error: Exception):
+    """Compte un traitement en échec et agrège les mesures remontées avec l'erreur"""
+    stats = getattr(error, "worker_stats", None)
+    if stats:
+        export_cache.merge_stats(stats.get("export_cache", {}))
+        instrumentation.merge_records(processor_id, stats.get("stages", []))
+    instrumentation.count_treatment(processor_id, "error")
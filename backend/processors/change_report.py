@@ -0,0 +1,55 @@
+"""
+Rapport des modifications apportées par un traitement
+
+Le processeur écrit un résumé JSON à côté du fichier résultat
+(<résultat>.changes.json), ou le joint au résultat s'il est en mémoire
+(attribut changes du MemoryFile). L'API l'ajoute, en texte, au paquet zip
+proposé au téléchargement (voir downloads.py).
+"""
+
+import json
+import os
+
+from . import sources
+
+REPORT_SUFFIX = ".changes.json"
+
+
+def report_path(result_path: str) -> str:
+    return f"{result_path}{REPORT_SUFFIX}"
+
+
+def write_report(result_path, report: dict):
+    if sources.is_memory(result_path):
+        result_path.changes = report
+        return
+    with open(report_path(result_path), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def read_report(result_path):
+    """Rapport du résultat, ou None si le processeur n'en a pas écrit"""
+    if sources.is_memory(result_path):
+        return getattr(result_path, 'changes', None)
+    path = report_path(result_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def format_report(report: dict) -> str:
+    """Version texte du rapport, pour le paquet zip"""
+    lines = ["Rapport des modifications", ""]
+    if report.get("dates"):
+        lines.append(f"Date(s) importée(s) : {', '.join(report['dates'])}")
+    if "articles_after" in report:
+        lines.append(f"Articles suivis : {report['articles_after']} "
+                     f"(dont {report['articles_after'] - report['articles_before']} nouveaux)")
+    for summary in report.get("reports", []):
+        if summary.get("variations") is None:
+            lines.append(f"{summary['title']} : pas de données disponibles pour la période")
+        else:
+            lines.append(f"{summary['title']} : {summary['variations']} variation(s) "
+                         f"entre le {summary['from']} et le {summary['to']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,58 @@
+"""
+Lecture des fichiers Excel par les processeurs
+
+Utilise le moteur calamine (python-calamine, en Rust) quand il est
+installé, bien plus rapide qu'openpyxl pour lire une feuille complète.
+Sans lui, pandas choisit son moteur habituel selon l'extension
+(openpyxl pour .xlsx, xlrd pour .xls).
+
+Variables d'environnement:
+- EXCEL_READ_ENGINE: "auto" (défaut), "calamine" ou "default"
+- EXCEL_READ_COMPARE: si "1", chaque fichier est aussi lu avec le moteur
+  par défaut et les différences éventuelles sont affichées
+"""
+
+import importlib.util
+import os
+
+import pandas as pd
+
+from . import sources
+
+CALAMINE_AVAILABLE = importlib.util.find_spec("python_calamine") is not None
+
+
+def read_engine():
+    """Moteur pandas à utiliser (None: choix par défaut de pandas)"""
+    engine = os.getenv("EXCEL_READ_ENGINE", "auto").lower()
+    if engine == "calamine" and not CALAMINE_AVAILABLE:
+        raise ValueError("EXCEL_READ_ENGINE=calamine mais python-calamine n'est pas installé")
+    if engine in ("auto", "calamine") and CALAMINE_AVAILABLE:
+        return "calamine"
+    return None
+
+
+def read_excel(path, **kwargs):
+    """
+    pd.read_excel avec le moteur le plus rapide disponible
+
+    Les arguments (sheet_name, usecols, dtype...) sont transmis à pandas.
+    path peut aussi être un fichier en mémoire (MemoryFile).
+    """
+    engine = read_engine()
+    df = pd.read_excel(sources.rewind(path), engine=engine, **kwargs)
+
+    if engine is not None and os.getenv("EXCEL_READ_COMPARE") == "1":
+        compare_engines(path, df, **kwargs)
+
+    return df
+
+
+def compare_engines(path, df_fast, **kwargs):
+    """Compare une lecture calamine avec celle du moteur par défaut"""
+    df_default = pd.read_excel(sources.rewind(path), **kwargs)
+    try:
+        pd.testing.assert_frame_equal(df_fast, df_default, check_dtype=False)
+        print(f"🔍 Lecture {sources.source_name(path)}: calamine et moteur par défaut identiques")
+    except AssertionError as e:
+        print(f"⚠️ Lecture {sources.source_name(path)}: calamine diffère du moteur par défaut\n{e}")
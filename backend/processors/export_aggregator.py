@@ -0,0 +1,166 @@
+"""
+Regroupement des exports ligne par ligne, sans DataFrame de l'export
+
+Les lignes de l'export (une par actif) sont regroupées au fil de la lecture,
+en un seul passage: seuls le nombre de lignes et les premières descriptions
+renseignées de chaque couple (Code article, Emplacement) sont conservés.
+
+La mémoire de la lecture dépend du lecteur de lignes (variable
+d'environnement EXPORT_ROW_READER):
+- "openpyxl": lecture en flux (read_only). La mémoire dépend du nombre de
+  couples distincts, pas du nombre de lignes, mais la lecture est
+  nettement plus lente
+- "calamine": rapide, mais python-calamine charge toute la feuille en
+  mémoire native (environ 15 à 20 fois la taille du fichier)
+- "auto" (défaut): calamine, s'il est installé, jusqu'à
+  EXPORT_CALAMINE_MAX_BYTES; au-delà, lecture en flux avec openpyxl
+Les fichiers .xls (xlrd) sont lus en entier: le format est limité à 65 536
+lignes.
+
+Le résultat est identique à pd.read_excel(dtype=object) suivi d'un
+groupby: mêmes valeurs considérées comme vides ("", "N/A", "NULL"...),
+mêmes lignes ignorées (clé vide) et même ordre (clés triées).
+"""
+
+import datetime
+import math
+import os
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from pandas._libs.parsers import STR_NA_VALUES
+
+from . import sources
+from .excel_reader import CALAMINE_AVAILABLE, read_excel
+
+KEY_COLUMNS = ['Code article', 'Emplacement']
+DESCRIPTION_COLUMNS = ["Description de l'actif", "Description de l'emplacement"]
+# Seules colonnes de l'export utilisées par le traitement
+EXPORT_COLUMNS = KEY_COLUMNS + DESCRIPTION_COLUMNS
+
+# Valeurs lues comme vides par pandas, et cellules en erreur
+NA_STRINGS = frozenset(STR_NA_VALUES) | {'#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!'}
+
+# Taille de fichier au-delà de laquelle "auto" lit l'export en flux (openpyxl) plutôt qu'avec calamine
+CALAMINE_MAX_BYTES = int(os.getenv("EXPORT_CALAMINE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+
+def row_reader(path=None) -> str:
+    """Lecteur de lignes de l'export path (voir EXPORT_ROW_READER)"""
+    reader = os.getenv("EXPORT_ROW_READER", "auto").lower()
+    if reader == "auto":
+        if not CALAMINE_AVAILABLE:
+            return "openpyxl"
+        if path is not None and sources.source_size(path) > CALAMINE_MAX_BYTES:
+            print(f"📥 Export volumineux ({sources.source_size(path) // (1024 * 1024)} MB): lecture en flux")
+            return "openpyxl"
+        return "calamine"
+    if reader == "calamine" and not CALAMINE_AVAILABLE:
+        raise ValueError("EXPORT_ROW_READER=calamine mais python-calamine n'est pas installé")
+    if reader not in ("calamine", "openpyxl"):
+        raise ValueError(f"EXPORT_ROW_READER inconnu: {reader}")
+    return reader
+
+
+def normalize(value):
+    """Valeur de cellule comme pd.read_excel(dtype=object) la retournerait (None si vide)"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return None if value in NA_STRINGS else value
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        return int(value) if value.is_integer() else value
+    if isinstance(value, datetime.date):
+        return pd.Timestamp(value)
+    return value
+
+
+def column_indexes(header, columns):
+    """Position de chaque colonne attendue dans la ligne d'en-tête"""
+    header = list(header or [])
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise ValueError(f"Colonnes absentes de l'export: {', '.join(missing)}")
+    return [header.index(column) for column in columns]
+
+
+def _select(rows, columns):
+    """Extrait les colonnes attendues de chaque ligne (la première est l'en-tête)"""
+    header = next(rows, None)
+    indexes = column_indexes(header, columns)
+    for row in rows:
+        yield tuple(row[i] if i < len(row) else None for i in indexes)
+
+
+def iter_export_rows(path, columns=EXPORT_COLUMNS):
+    """Lignes de la première feuille de l'export (chemin ou MemoryFile), réduites aux colonnes demandées"""
+    if sources.source_ext(path) == '.xls':
+        df = read_excel(path, usecols=columns, dtype=object)
+        yield from df[columns].itertuples(index=False, name=None)
+        return
+
+    if row_reader(path) == "calamine":
+        from python_calamine import CalamineWorkbook
+        if sources.is_memory(path):
+            workbook = CalamineWorkbook.from_filelike(sources.rewind(path))
+        else:
+            workbook = CalamineWorkbook.from_path(path)
+        yield from _select(iter(workbook.get_sheet_by_index(0).iter_rows()), columns)
+        return
+
+    workbook = load_workbook(sources.rewind(path), read_only=True, data_only=True)
+    try:
+        yield from _select(workbook.worksheets[0].iter_rows(values_only=True), columns)
+    finally:
+        workbook.close()
+
+
+def aggregate_rows(rows):
+    """
+    Compte les lignes et garde les premières descriptions renseignées par clé
+
+    Returns:
+        {(code, emplacement): [quantité, description actif, description emplacement]}
+    """
+    groups = {}
+    for code, location, asset, place in rows:
+        code = normalize(code)
+        location = normalize(location)
+        if code is None or location is None:
+            continue
+
+        group = groups.get((code, location))
+        if group is None:
+            groups[(code, location)] = [1, normalize(asset), normalize(place)]
+            continue
+        group[0] += 1
+        if group[1] is None:
+            group[1] = normalize(asset)
+        if group[2] is None:
+            group[2] = normalize(place)
+    return groups
+
+
+def groups_to_frame(groups) -> pd.DataFrame:
+    """DataFrame regroupé: Code article, Emplacement, Quantité et descriptions"""
+    keys = list(groups)
+    values = list(groups.values())
+    df = pd.DataFrame({
+        'Code article': pd.Series([key[0] for key in keys], dtype=object),
+        'Emplacement': pd.Series([key[1] for key in keys], dtype=object),
+        'Quantité': pd.Series([value[0] for value in values], dtype='int64'),
+        DESCRIPTION_COLUMNS[0]: pd.Series([value[1] for value in values], dtype=object),
+        DESCRIPTION_COLUMNS[1]: pd.Series([value[2] for value in values], dtype=object),
+    })
+
+    # Même ordre que groupby(sort=True) sur l'export complet
+    order = df.groupby(KEY_COLUMNS, sort=True).ngroup().to_numpy()
+    return df.iloc[np.argsort(order, kind='stable')].reset_index(drop=True)
+
+
+def aggregate_export(path) -> pd.DataFrame:
+    """Lit et regroupe un export en un seul passage (lecteur choisi par row_reader)"""
+    return groups_to_frame(aggregate_rows(iter_export_rows(path)))
@@ -0,0 +1,190 @@
+"""
+Cache local des fichiers d'export déjà regroupés
+
+Un même export est souvent renvoyé plusieurs fois (après un échec, pour une
+autre date, pour vérification). Le résultat du regroupement
+(Code article, Emplacement) -> Quantité + descriptions est conservé sur le
+disque, indexé par l'empreinte SHA-256 du contenu du fichier: un export
+identique n'est ni relu ni regroupé une seconde fois.
+
+Les entrées sont stockées en Parquet (pyarrow). Sans pyarrow, ou si une
+colonne mélange des types, le regroupement n'est pas mis en cache: jamais de
+pickle, qu'un autre utilisateur pourrait déposer pour exécuter du code dans
+le worker. Le répertoire est privé (0700, remis à 0700 si besoin): il n'est
+utilisé que s'il appartient à l'utilisateur du processus et qu'aucun autre
+ne peut le lire ni y écrire.
+
+Quand la taille totale dépasse EXPORT_CACHE_MAX_BYTES, les entrées les
+moins récemment utilisées sont supprimées. EXPORT_CACHE_MAX_BYTES=0
+désactive le cache.
+"""
+
+import hashlib
+import importlib.util
+import os
+import tempfile
+
+from . import sources
+
+CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mat-portal-cache", "exports"))
+CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# À incrémenter quand le format du regroupement change
+CACHE_VERSION = "1"
+
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Compteurs du processus courant. Dans l'API, ceux des workers y sont ajoutés
+# par merge_stats() à la fin de chaque traitement.
+STATS = {"hits": 0, "misses": 0}
+_WARNED = {"unsafe_dir": False}
+
+
+def is_enabled() -> bool:
+    return CACHE_MAX_BYTES > 0
+
+
+def _private_dir() -> bool:
+    """
+    Crée CACHE_DIR et vérifie qu'il est privé: propriétaire = cet utilisateur,
+    aucun droit pour le groupe ni les autres (remis à 0700 si besoin)
+    """
+    os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+    if not hasattr(os, "getuid"):  # Windows: droits hérités du profil utilisateur
+        return True
+    stat = os.stat(CACHE_DIR)
+    if stat.st_uid == os.getuid() and stat.st_mode & 0o077:
+        try:
+            os.chmod(CACHE_DIR, 0o700)
+            stat = os.stat(CACHE_DIR)
+        except OSError:
+            pass
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        if not _WARNED["unsafe_dir"]:
+            print(f"⚠️ Cache des exports ignoré: {CACHE_DIR} n'appartient pas à cet utilisateur "
+                  f"ou est accessible à d'autres")
+            _WARNED["unsafe_dir"] = True
+        return False
+    return True
+
+
+def file_key(path, *parts) -> str:
+    """Empreinte du contenu du fichier et des paramètres du regroupement"""
+    digest = hashlib.sha256(CACHE_VERSION.encode())
+    for part in parts:
+        digest.update(repr(part).encode())
+    if sources.is_memory(path):
+        digest.update(path.getbuffer())
+        return digest.hexdigest()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.parquet")
+
+
+def load(key):
+    """DataFrame en cache pour cette clé, ou None"""
+    if not is_enabled():
+        return None
+
+    path = _entry_path(key)
+    if PARQUET_AVAILABLE and _private_dir() and os.path.exists(path):
+        try:
+            # Import local: l'API lit les statistiques du cache sans charger pandas
+            import pandas as pd
+            df = pd.read_parquet(path)
+        except Exception as e:
+            print(f"⚠️ Entrée de cache illisible, ignorée: {e}")
+        else:
+            # La date de modification sert d'horodatage LRU
+            os.utime(path)
+            STATS["hits"] += 1
+            return df
+
+    STATS["misses"] += 1
+    return None
+
+
+def store(key, df):
+    """Enregistre un DataFrame dans le cache puis applique la limite de taille"""
+    if not is_enabled() or not PARQUET_AVAILABLE or not _private_dir():
+        return
+
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    os.close(fd)
+
+    try:
+        try:
+            df.to_parquet(tmp_path, index=False)
+        except Exception:
+            # Colonne de types mélangés (codes numériques et texte): pas de cache
+            return
+        # Remplacement atomique: plusieurs workers peuvent écrire la même entrée
+        os.replace(tmp_path, _entry_path(key))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    evict()
+
+
+def _entries():
+    entries = []
+    with os.scandir(CACHE_DIR) as it:
+        for entry in it:
+            # .pkl: entrées d'anciennes versions, jamais relues (les premières supprimées par evict())
+            if entry.name.endswith(('.parquet', '.pkl')):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def evict():
+    """Supprime les entrées les moins récemment utilisées au-delà de CACHE_MAX_BYTES"""
+    entries = sorted(_entries())
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def reset_stats():
+    STATS["hits"] = 0
+    STATS["misses"] = 0
+
+
+def get_stats() -> dict:
+    """Compteurs du processus courant"""
+    return dict(STATS)
+
+
+def merge_stats(stats: dict):
+    """Ajoute les compteurs remontés par un worker"""
+    for name in STATS:
+        STATS[name] += stats.get(name, 0)
+
+
+def describe() -> dict:
+    """Compteurs et occupation du cache, pour l'API"""
+    entries = _entries() if os.path.isdir(CACHE_DIR) else []
+    return {
+        "enabled": is_enabled(),
+        "hits": STATS["hits"],
+        "misses": STATS["misses"],
+        "entries": len(entries),
+        "size_bytes": sum(size for _, size, _ in entries),
+        "max_bytes": CACHE_MAX_BYTES,
+    }
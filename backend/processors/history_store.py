@@ -0,0 +1,346 @@
+"""
+Historique des quantités en base SQLite, à côté du fichier de suivi
+
+La feuille 'Liste de Stock' contient une colonne par date d'export: la
+relire entièrement à chaque traitement coûte de plus en plus cher. Quand
+HISTORY_STORE_DIR est défini, chaque fichier de suivi reçoit un identifiant
+(propriété "identifier" du classeur) et sa 'Liste de Stock' est archivée
+dans HISTORY_STORE_DIR/<identifiant>.sqlite, interrogeable en SQL:
+
+- articles: (position, Codification DSNA, Désignation, Magasin, Description)
+- dates: colonnes de date dans l'ordre de la feuille
+- snapshots: (article, date, quantité), seulement les quantités renseignées
+- meta: empreinte de la feuille archivée (sheet_digest) et possibilité de
+  la relire depuis la base (readable)
+
+L'empreinte de la feuille est lue dans le zip du classeur sans le
+décompresser: CRC-32 et taille de la partie XML de la feuille et de la
+table des textes partagés. Si le fichier reçu a la même empreinte que la
+feuille archivée au traitement précédent, la base contient exactement ses
+valeurs: le DataFrame est relu depuis la base (load), le classeur est
+chargé sans analyser la feuille (load_workbook_without_sheet, la feuille
+est de toute façon réécrite), et seules les nouvelles dates sont ajoutées.
+
+Sinon (premier passage, correction à la main, ancienne copie du fichier,
+copies d'un même fichier qui partagent l'identifiant...), la feuille fait
+foi: elle est lue normalement et la base est reconstruite à partir d'elle.
+L'écriture de la feuille dans le classeur reste proportionnelle à
+l'historique.
+"""
+
+import io
+import os
+import sqlite3
+import uuid
+
+import numpy as np
+import pandas as pd
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.xml.constants import SHEET_MAIN_NS, SHARED_STRINGS
+
+from . import sources, tracking_schema
+
+HISTORY_DIR = os.getenv("HISTORY_STORE_DIR", "")
+
+SHEET_NAME = 'Liste de Stock'
+KEY_COLUMNS = ['Codification DSNA', 'Désignation', 'Magasin', 'Description']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    position INTEGER PRIMARY KEY,
+    code, designation, magasin, description
+);
+CREATE TABLE IF NOT EXISTS dates (
+    position INTEGER PRIMARY KEY,
+    date TEXT NOT NULL UNIQUE,
+    label TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    date TEXT NOT NULL,
+    article INTEGER NOT NULL,
+    quantite,
+    PRIMARY KEY (date, article)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Feuille vide lue à la place de la 'Liste de Stock' archivée
+EMPTY_SHEET = f'<worksheet xmlns="{SHEET_MAIN_NS}"><sheetData/></worksheet>'.encode()
+
+
+def is_enabled() -> bool:
+    return bool(HISTORY_DIR)
+
+
+def tracking_id(workbook) -> str:
+    """Identifiant du fichier de suivi, attribué au premier passage"""
+    if not workbook.properties.identifier:
+        workbook.properties.identifier = f"suivi-{uuid.uuid4().hex}"
+    return workbook.properties.identifier
+
+
+def _store_path(identifier: str) -> str:
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    safe_id = "".join(c for c in identifier if c.isalnum() or c in "-_")
+    return os.path.join(HISTORY_DIR, f"{safe_id}.sqlite")
+
+
+def open_store(workbook):
+    """Base d'historique du classeur, ou None si l'historique est désactivé"""
+    if not is_enabled():
+        return None
+    return HistoryStore(_store_path(tracking_id(workbook)))
+
+
+def _read_package(source):
+    """ExcelReader avec le manifeste, le classeur et les propriétés lus (sans les feuilles)"""
+    reader = ExcelReader(sources.rewind(source))
+    reader.read_manifest()
+    reader.read_workbook()
+    reader.read_properties()
+    return reader
+
+
+def _sheet_part(reader, sheet_name=SHEET_NAME):
+    for sheet, rel in reader.parser.find_sheets():
+        if sheet.name == sheet_name:
+            return rel.target
+    return None
+
+
+def sheet_digest(source, reader=None):
+    """
+    Empreinte de la 'Liste de Stock' dans le zip du classeur, ou None
+
+    CRC-32 et taille (non compressée) de la feuille et des textes partagés,
+    lus dans le répertoire du zip: rien n'est décompressé.
+    """
+    own_reader = reader is None
+    if own_reader:
+        reader = _read_package(source)
+    try:
+        part = _sheet_part(reader)
+        if part is None:
+            return None
+        strings = reader.package.find(SHARED_STRINGS)
+        parts = [part] + ([strings.PartName[1:]] if strings is not None else [])
+        infos = [reader.archive.getinfo(name) for name in parts]
+        return ";".join(f"{info.CRC:08x}-{info.file_size}" for info in infos)
+    finally:
+        if own_reader:
+            reader.archive.close()
+
+
+def open_archived(source):
+    """
+    Base d'historique du fichier reçu, et si elle contient exactement sa feuille
+
+    Returns:
+        (HistoryStore ou None, archivé): None si l'historique est désactivé ou
+        si le fichier n'a pas encore d'identifiant (open_store l'attribuera)
+    """
+    if not is_enabled():
+        return None, False
+    reader = _read_package(source)
+    try:
+        identifier = reader.wb.properties.identifier
+        if not identifier:
+            return None, False
+        digest = sheet_digest(source, reader)
+    finally:
+        reader.archive.close()
+
+    store = HistoryStore(_store_path(identifier))
+    return store, digest is not None and store.sheet_digest() == digest
+
+
+class _SkipSheetArchive:
+    """Zip du classeur dont une feuille est lue comme une feuille vide"""
+
+    def __init__(self, archive, skipped: str):
+        self._archive = archive
+        self._skipped = skipped
+
+    def open(self, name, *args, **kwargs):
+        if name == self._skipped:
+            return io.BytesIO(EMPTY_SHEET)
+        return self._archive.open(name, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._archive, name)
+
+
+def load_workbook_without_sheet(source, sheet_name=SHEET_NAME):
+    """
+    Classeur openpyxl complet, sauf la feuille sheet_name chargée vide
+
+    Pour une feuille archivée qui sera réécrite: son XML n'est pas analysé.
+    """
+    reader = _read_package(source)
+    part = _sheet_part(reader, sheet_name)
+    if part is None:
+        reader.archive.close()
+        raise ValueError(f"Feuille '{sheet_name}' absente du classeur")
+    # read() relit tout le classeur, avec la feuille remplacée
+    reader.archive = _SkipSheetArchive(reader.archive, part)
+    reader.read()
+    return reader.wb
+
+
+def _to_db(value):
+    """Valeur pandas/numpy vers un type relu à l'identique depuis sqlite3, ou KeyError"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        # Date, booléen...: archivé en texte, la base ne peut plus redonner la feuille
+        raise KeyError(value)
+    if isinstance(value, float) and value.is_integer():
+        # pd.read_excel relit 3.0 comme 3
+        return int(value)
+    return value
+
+
+def _db_value(value, exact: list):
+    try:
+        return _to_db(value)
+    except KeyError:
+        exact[0] = False
+        return str(value)
+
+
+class HistoryStore:
+    """Historique d'un fichier de suivi"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def _meta(self, name: str):
+        row = self.connection.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name: str, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def sheet_digest(self):
+        """Empreinte de la feuille archivée (voir sheet_digest), si la base peut la redonner"""
+        if self._meta("readable") != "1":
+            return None
+        return self._meta("sheet_digest")
+
+    def labels(self) -> list:
+        return [row[0] for row in self.connection.execute("SELECT label FROM dates ORDER BY position")]
+
+    def article_count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+
+    def load(self) -> pd.DataFrame:
+        """DataFrame de la feuille archivée, comme pd.read_excel l'aurait lu"""
+        articles = self.connection.execute(
+            "SELECT code, designation, magasin, description FROM articles ORDER BY position"
+        ).fetchall()
+        df = pd.DataFrame(articles, columns=KEY_COLUMNS, dtype=object)
+        df = df.where(df.notna(), np.nan).infer_objects()
+
+        columns = {}
+        for date, label in self.connection.execute("SELECT date, label FROM dates ORDER BY position").fetchall():
+            rows = self.connection.execute(
+                "SELECT article, quantite FROM snapshots WHERE date = ?", (date,)
+            ).fetchall()
+            positions = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            columns[label] = self._quantity_column(len(df), positions, [row[1] for row in rows])
+        return pd.concat([df, pd.DataFrame(columns, index=df.index)], axis=1)
+
+    @staticmethod
+    def _quantity_column(size: int, positions, values):
+        """Mêmes types que pd.read_excel: int64 si la colonne est complète et entière"""
+        if not all(isinstance(value, (int, float)) for value in values):
+            # Texte dans la colonne: objets, comme pd.read_excel
+            column = np.full(size, np.nan, dtype=object)
+            column[positions] = np.asarray(values, dtype=object)
+            return column
+        column = np.full(size, np.nan)
+        column[positions] = np.asarray(values, dtype=np.float64)
+        if len(positions) == size and all(isinstance(value, int) for value in values):
+            return column.astype(np.int64)
+        return column
+
+    def append(self, df_tracking, archived: bool, digest):
+        """
+        Archive df_tracking, la feuille écrite dans le fichier d'empreinte digest
+
+        archived: la base contenait déjà exactement la feuille lue (voir
+        open_archived). Seuls les nouveaux articles et les nouvelles dates
+        sont alors ajoutés; sinon la base est reconstruite.
+        """
+        if list(df_tracking.columns[:len(KEY_COLUMNS)]) != KEY_COLUMNS:
+            raise ValueError("Colonnes de 'Liste de Stock' non reconnues, historique non enregistré")
+
+        known_labels = self.labels()
+        known_articles = self.article_count()
+        labels = [label for label, _ in tracking_schema.date_columns(df_tracking.columns)]
+        with self.connection:
+            if archived and labels[:len(known_labels)] == known_labels and len(df_tracking) >= known_articles:
+                readable = self._insert(df_tracking, known_articles, len(known_labels)) \
+                    and self._meta("readable") == "1"
+            else:
+                self.connection.execute("DELETE FROM snapshots")
+                self.connection.execute("DELETE FROM dates")
+                self.connection.execute("DELETE FROM articles")
+                readable = self._insert(df_tracking, 0, 0)
+            self._set_meta("sheet_digest", digest)
+            self._set_meta("readable", "1" if readable else "0")
+
+    def _insert(self, df_tracking, first_article, first_date) -> bool:
+        """
+        Insère les articles et les colonnes de date à partir de ces positions
+
+        Les colonnes qui ne sont pas des dates jj/mm/aaaa (ou une date déjà
+        vue) ne sont pas archivées. Retourne False si la base ne peut plus
+        redonner la feuille à l'identique (colonne ignorée, valeur convertie).
+        """
+        exact = [True]
+        new_articles = df_tracking[KEY_COLUMNS].iloc[first_article:]
+        self.connection.executemany(
+            "INSERT INTO articles (position, code, designation, magasin, description) VALUES (?, ?, ?, ?, ?)",
+            ((first_article + i, *(_db_value(value, exact) for value in row))
+             for i, row in enumerate(new_articles.itertuples(index=False)))
+        )
+
+        dates = tracking_schema.date_columns(df_tracking.columns)
+        skipped = [label for label in df_tracking.columns[len(KEY_COLUMNS):]
+                   if label not in {label for label, _ in dates}]
+        seen = {row[0] for row in self.connection.execute("SELECT date FROM dates")}
+        for position in range(first_date, len(dates)):
+            label, parsed = dates[position]
+            date = parsed.date().isoformat()
+            if date in seen:
+                skipped.append(label)
+                continue
+            seen.add(date)
+            self.connection.execute(
+                "INSERT INTO dates (position, date, label) VALUES (?, ?, ?)", (position, date, label)
+            )
+            values = df_tracking[label]
+            filled = np.flatnonzero(values.notna().to_numpy())
+            self.connection.executemany(
+                "INSERT INTO snapshots (date, article, quantite) VALUES (?, ?, ?)",
+                ((date, int(article), _db_value(value, exact))
+                 for article, value in zip(filled, values.iloc[filled].tolist()))
+            )
+
+        if skipped:
+            print(f"⚠️ Historique: colonnes non archivées (pas une date jj/mm/aaaa ou date en double): "
+                  f"{', '.join(map(str, skipped))}")
+        if not exact[0]:
+            print("⚠️ Historique: valeurs archivées en texte (dates, booléens), la feuille sera relue depuis le classeur")
+        return exact[0] and not skipped
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,266 @@
+"""
+Mesures par étape des traitements, en logs structurés et au format Prometheus
+
+Chaque étape (lecture, fusion, écriture, rapports, sauvegarde...) est
+encadrée par stage(), qui mesure sa durée, le pic de mémoire résidente du
+processus (RSS) pendant l'étape, et les lignes et octets traités quand
+l'étape les renseigne. Chaque mesure est écrite sur la sortie standard en
+une ligne JSON (STAGE_LOG=0 pour désactiver).
+
+Le pic d'une étape est mesuré sous Linux: le pic du processus (VmHWM) est
+remis à la mémoire actuelle au début de l'étape (/proc/self/clear_refs) et
+relu à la fin. Le pic relevé avant chaque remise à zéro est reporté sur
+les étapes encore ouvertes ("total" englobe les autres, plusieurs envois
+simultanés dans l'API). Ailleurs, ou si /proc n'est pas accessible, le pic
+n'est pas mesuré (None): ru_maxrss ne porte que sur toute la vie du worker.
+
+Dans le worker, les mesures d'un traitement sont retournées avec son
+résultat (voir run_processor), puis agrégées dans le processus de l'API par
+merge_records(): histogrammes par traitement et par étape, exposés par
+GET /metrics (render_prometheus).
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from . import export_cache
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(8))  # 64 KB à 1 GB
+
+logger = logging.getLogger("mat_portal.stages")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+logger.disabled = os.getenv("STAGE_LOG", "1") == "0"
+
+# Mesures du traitement en cours dans ce processus (un traitement à la fois par worker)
+RECORDS = []
+CURRENT = {"treatment": None}
+
+# Étapes en cours dans ce processus, pour le pic de mémoire (voir _track_peak)
+_OPEN_STAGES = []
+_peak_lock = threading.Lock()
+_PEAK_RESET = {"available": sys.platform.startswith("linux")}
+
+
+def peak_rss_bytes():
+    """Pic de mémoire résidente du processus depuis la dernière remise à zéro (VmHWM), ou None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak() -> bool:
+    """Remet le pic de mémoire résidente du processus à sa valeur actuelle"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _track_peak(record, opening: bool):
+    """
+    Début (opening) ou fin de la mesure du pic d'une étape
+
+    Le pic atteint depuis la dernière remise à zéro est reporté sur toutes
+    les étapes ouvertes avant d'en ouvrir une nouvelle (remise à zéro) ou
+    d'en fermer une.
+    """
+    if not _PEAK_RESET["available"]:
+        return
+    with _peak_lock:
+        peak = peak_rss_bytes()
+        if peak is not None:
+            for open_record in _OPEN_STAGES:
+                open_record.peak_rss_bytes = max(open_record.peak_rss_bytes or 0, peak)
+        if not opening:
+            if record in _OPEN_STAGES:
+                _OPEN_STAGES.remove(record)
+            return
+        if peak is None or not _reset_peak():
+            _PEAK_RESET["available"] = False
+            for open_record in _OPEN_STAGES:
+                open_record.peak_rss_bytes = None
+            _OPEN_STAGES.clear()
+            return
+        _OPEN_STAGES.append(record)
+
+
+class StageRecord:
+    """Mesure d'une étape; rows et bytes sont renseignés par l'étape elle-même"""
+
+    def __init__(self, name: str, treatment=None):
+        self.name = name
+        self.treatment = treatment
+        self.seconds = None
+        self.rows = None
+        self.bytes = None
+        self.peak_rss_bytes = None
+        self.error = None
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.name,
+            "seconds": round(self.seconds, 6),
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "error": self.error,
+        }
+
+
+@contextmanager
+def stage(name: str, records=None, treatment=None):
+    """
+    Mesure le bloc encadré
+
+    records: liste qui reçoit la mesure (par défaut RECORDS, le traitement
+    en cours dans ce processus).
+    """
+    record = StageRecord(name, treatment or CURRENT["treatment"])
+    _track_peak(record, opening=True)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record.error = e.__class__.__name__
+        raise
+    finally:
+        record.seconds = time.perf_counter() - start
+        _track_peak(record, opening=False)
+        data = record.to_dict()
+        (RECORDS if records is None else records).append(data)
+        logger.info(json.dumps({"event": "stage", "treatment": record.treatment, **data}, ensure_ascii=False))
+
+
+def reset_records(treatment=None):
+    """Début d'un traitement dans le worker"""
+    RECORDS.clear()
+    CURRENT["treatment"] = treatment
+
+
+def get_records() -> list:
+    return list(RECORDS)
+
+
+# Agrégats du processus de l'API
+
+_lock = threading.Lock()
+_histograms = {}  # (nom, labels) -> [compteurs par seuil, somme, nombre]
+_counters = {}    # (nom, labels) -> valeur
+_gauges = {}      # (nom, labels) -> valeur
+
+METRICS_HELP = {
+    "mat_portal_stage_duration_seconds": ("histogram", "Durée des étapes de traitement"),
+    "mat_portal_stage_bytes": ("histogram", "Taille des fichiers lus ou écrits par étape"),
+    "mat_portal_stage_rows_total": ("counter", "Lignes traitées par étape"),
+    "mat_portal_stage_errors_total": ("counter", "Étapes interrompues par une erreur"),
+    "mat_portal_stage_peak_rss_bytes": ("gauge", "Plus haut pic de mémoire résidente du processus pendant l'étape"),
+    "mat_portal_treatments_total": ("counter", "Traitements terminés, par statut"),
+    "mat_portal_deduplicated_requests_total": ("counter", "Demandes rattachées à un traitement identique"),
+    "mat_portal_export_cache_hits_total": ("counter", "Exports lus depuis le cache"),
+    "mat_portal_export_cache_misses_total": ("counter", "Exports absents du cache"),
+}
+
+
+def _observe(name, labels, value, buckets):
+    histogram = _histograms.setdefault((name, labels), [[0] * len(buckets), 0.0, 0])
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            histogram[0][i] += 1
+    histogram[1] += value
+    histogram[2] += 1
+
+
+def merge_records(treatment: str, records: list):
+    """Ajoute aux agrégats les mesures d'un traitement"""
+    with _lock:
+        for record in records:
+            labels = (("treatment", treatment), ("stage", record["stage"]))
+            _observe("mat_portal_stage_duration_seconds", labels, record["seconds"], DURATION_BUCKETS)
+            if record.get("bytes") is not None:
+                _observe("mat_portal_stage_bytes", labels, record["bytes"], SIZE_BUCKETS)
+            if record.get("rows") is not None:
+                key = ("mat_portal_stage_rows_total", labels)
+                _counters[key] = _counters.get(key, 0) + record["rows"]
+            if record.get("error"):
+                key = ("mat_portal_stage_errors_total", labels)
+                _counters[key] = _counters.get(key, 0) + 1
+            if record.get("peak_rss_bytes") is not None:
+                key = ("mat_portal_stage_peak_rss_bytes", labels)
+                _gauges[key] = max(_gauges.get(key, 0), record["peak_rss_bytes"])
+
+
+def count_treatment(treatment: str, status: str):
+    """Compte un traitement terminé ("ok" ou "error") ou refusé par la vérification préalable ("rejected")"""
+    key = ("mat_portal_treatments_total", (("treatment", treatment), ("status", status)))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+def count_deduplicated(treatment: str):
+    """Compte une demande servie par un traitement identique déjà lancé"""
+    key = ("mat_portal_deduplicated_requests_total", (("treatment", treatment),))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus() -> str:
+    """Agrégats au format texte de Prometheus"""
+    with _lock:
+        histograms = {key: (list(counts), total, count) for key, (counts, total, count) in _histograms.items()}
+        values = {**_counters, **_gauges}
+
+    cache_stats = export_cache.get_stats()
+    values[("mat_portal_export_cache_hits_total", ())] = cache_stats["hits"]
+    values[("mat_portal_export_cache_misses_total", ())] = cache_stats["misses"]
+
+    lines = []
+    for name, (metric_type, help_text) in METRICS_HELP.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if metric_type == "histogram":
+            buckets = DURATION_BUCKETS if name.endswith("_seconds") else SIZE_BUCKETS
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        else:
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
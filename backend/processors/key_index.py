@@ -0,0 +1,63 @@
+"""
+Index des lignes du suivi par clé (Codification DSNA, Magasin)
+
+Construit une fois par traitement à la lecture de la 'Liste de Stock', puis
+complété au fil des fusions avec les articles ajoutés en fin de tableau:
+chaque export n'a plus qu'à chercher ses propres clés (une recherche par
+clé de l'export) au lieu de re-hacher toutes les lignes du suivi.
+
+Les positions sont celles des lignes du DataFrame du suivi. L'index reste
+valable tant que les lignes ne sont ni supprimées ni réordonnées, seulement
+ajoutées à la fin.
+"""
+
+import numpy as np
+
+
+class KeyIndex:
+    """(Codification DSNA, Magasin) -> position(s) des lignes du suivi"""
+
+    def __init__(self, codes=(), locations=()):
+        self.positions = {}   # clé -> première ligne
+        self.duplicates = {}  # clé présente sur plusieurs lignes -> toutes ses lignes
+        self.size = 0
+        self.extend(codes, locations)
+
+    @classmethod
+    def from_tracking(cls, df_tracking):
+        return cls(df_tracking['Codification DSNA'].to_numpy(), df_tracking['Magasin'].to_numpy())
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, codes, locations):
+        """Ajoute les lignes suivantes du suivi (ajoutées à la fin du tableau)"""
+        keys = list(zip(codes, locations))
+        for position, key in enumerate(keys, start=self.size):
+            first = self.positions.setdefault(key, position)
+            if first != position:
+                self.duplicates.setdefault(key, [first]).append(position)
+        self.size += len(keys)
+
+    def locate(self, codes, locations):
+        """
+        Lignes du suivi correspondant à chaque clé
+
+        Returns:
+            (sources, targets, unknown): la clé n° sources[i] se trouve à la
+            ligne targets[i] du suivi (plusieurs fois si la clé y est en
+            double); unknown marque les clés absentes du suivi
+        """
+        sources, targets = [], []
+        unknown = np.zeros(len(codes), dtype=bool)
+        for i, key in enumerate(zip(codes, locations)):
+            position = self.positions.get(key)
+            if position is None:
+                unknown[i] = True
+            elif key in self.duplicates:
+                sources.extend([i] * len(self.duplicates[key]))
+                targets.extend(self.duplicates[key])
+            else:
+                sources.append(i)
+                targets.append(position)
+        return np.array(sources, dtype=np.intp), np.array(targets, dtype=np.intp), unknown
@@ -0,0 +1,337 @@
+"""
+Vérification préalable des fichiers d'un traitement, sur leurs seuls en-têtes
+
+Un onglet manquant, une colonne absente ou une date déjà importée n'étaient
+détectés qu'en plein traitement, une fois le classeur entièrement lu. Ici
+seuls la liste des onglets et la première ligne des feuilles utiles sont
+lues, en flux (HeaderReader): quelques millisecondes quelle que soit la
+taille du fichier, dans le processus de l'API, sans occuper de worker.
+
+Chaque traitement peut déclarer une fonction "preflight" dans le registre
+(voir processors/__init__.py), appelée avec les mêmes fichiers et paramètres
+que le traitement. Elle retourne la liste de tous les problèmes trouvés, au
+format des erreurs de validation de FastAPI:
+
+    {"loc": ["file_tracking", "Liste de Stock"], "msg": "...", "type": "preflight"}
+
+Les règles reprennent celles du traitement (stock_tracking): un fichier
+accepté ici peut encore échouer, un fichier refusé ici aurait échoué.
+"""
+
+import datetime
+import os
+import zipfile
+from xml.etree import ElementTree
+
+from . import sources
+
+TRACKING_SHEET = 'Liste de Stock'
+TRACKING_COLUMNS = ['Codification DSNA', 'Désignation', 'Magasin', 'Description']
+# Colonnes lues par export_aggregator
+EXPORT_COLUMNS = ['Code article', 'Emplacement', "Description de l'actif", "Description de l'emplacement"]
+# Onglets obligatoires du mode complet (VARIATION_REPORTS "required" de stock_tracking)
+REQUIRED_REPORT_SHEETS = [("suivi mensuel", "Suivi Mensuel"), ("suivi semestriel", "Suivi Semestriel")]
+
+# Extensions lues par openpyxl (le mode complet réécrit le classeur avec openpyxl)
+OPENPYXL_EXTENSIONS = ('.xlsx', '.xlsm')
+EXPORT_NAME_FORMATS = ('%Y-%m-%d', '%d-%m-%Y')
+
+
+def problem(loc, msg: str) -> dict:
+    return {"loc": list(loc), "msg": msg, "type": "preflight"}
+
+
+def _local(tag: str) -> str:
+    """Nom d'un élément XML sans son espace de noms (OOXML transitional ou strict)"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _column_index(reference: str) -> int:
+    """Position (0 pour A) de la colonne d'une référence de cellule (A1, AB12...)"""
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - ord('A') + 1
+    return index - 1
+
+
+def _text(element) -> str:
+    """Texte d'une chaîne riche (<si> ou <is>), sans les indications phonétiques"""
+    parts = []
+    for child in element:
+        name = _local(child.tag)
+        if name == 't':
+            parts.append(child.text or '')
+        elif name == 'r':
+            parts.extend(t.text or '' for t in child if _local(t.tag) == 't')
+    return ''.join(parts)
+
+
+class HeaderReader:
+    """
+    Onglets et ligne d'en-tête d'un classeur, sans lire les données
+
+    source est un chemin, un MemoryFile ou un fichier ouvert (membre d'une
+    archive zip);
+    ext choisit le lecteur. Un .xlsx est lu directement dans l'archive:
+    workbook.xml pour les onglets, puis le XML de la feuille jusqu'à la fin
+    de sa première ligne, et les chaînes partagées jusqu'à la dernière
+    utilisée par cette ligne. openpyxl, même en lecture seule, parcourt
+    toute la feuille quand elle ne déclare pas ses dimensions. Un .xls est
+    lu avec xlrd (feuilles chargées à la demande).
+
+    Seules les valeurs texte sont comparées par les vérifications: nombres
+    et dates sont retournés tels qu'écrits dans le fichier.
+    """
+
+    def __init__(self, source, ext: str):
+        self.ext = ext
+        if ext == '.xls':
+            import xlrd
+            if isinstance(source, (str, os.PathLike)):
+                self.book = xlrd.open_workbook(source, on_demand=True)
+            else:
+                self.book = xlrd.open_workbook(file_contents=sources.rewind(source).read(), on_demand=True)
+            self.sheetnames = self.book.sheet_names()
+            return
+
+        self.book = zipfile.ZipFile(sources.rewind(source))
+        try:
+            targets = {}
+            self.shared_strings = None
+            for relation in ElementTree.fromstring(self.book.read('xl/_rels/workbook.xml.rels')):
+                target = relation.get('Target', '')
+                target = target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+                targets[relation.get('Id')] = target
+                if relation.get('Type', '').endswith('/sharedStrings'):
+                    self.shared_strings = target
+
+            self.sheet_paths = {}
+            for element in ElementTree.fromstring(self.book.read('xl/workbook.xml')).iter():
+                if _local(element.tag) == 'sheet':
+                    relation_id = next(value for key, value in element.attrib.items() if _local(key) == 'id')
+                    self.sheet_paths[element.get('name')] = targets[relation_id]
+            self.sheetnames = list(self.sheet_paths)
+        except Exception:
+            self.book.close()
+            raise
+
+    def header(self, sheet_name=None) -> list:
+        """Valeurs de la première ligne (première feuille par défaut)"""
+        sheet_name = sheet_name or self.sheetnames[0]
+        if self.ext == '.xls':
+            sheet = self.book.sheet_by_name(sheet_name)
+            return sheet.row_values(0) if sheet.nrows else []
+
+        cells = {}
+        index = -1
+        with self.book.open(self.sheet_paths[sheet_name]) as stream:
+            for _, element in ElementTree.iterparse(stream):
+                name = _local(element.tag)
+                if name == 'c':
+                    # Cellule sans référence: colonne suivant la précédente
+                    index = _column_index(element.get('r')) if element.get('r') else index + 1
+                    cells[index] = self._cell_value(element)
+                    element.clear()
+                elif name in ('row', 'sheetData'):
+                    break
+
+        header = [None] * (max(cells) + 1 if cells else 0)
+        for index, value in cells.items():
+            header[index] = value
+        return self._resolve(header)
+
+    def _cell_value(self, cell):
+        cell_type = cell.get('t', 'n')
+        value = None
+        for child in cell:
+            name = _local(child.tag)
+            if name == 'v':
+                value = child.text
+            elif name == 'is':
+                return _text(child)
+        if value is None:
+            return None
+        if cell_type == 's':
+            return SharedString(int(value))
+        if cell_type == 'b':
+            return value == '1'
+        if cell_type != 'n':
+            return value
+        number = float(value)
+        return int(number) if number.is_integer() else number
+
+    def _resolve(self, header):
+        """Remplace les index de chaînes partagées par leur texte"""
+        wanted = {value for value in header if isinstance(value, SharedString)}
+        if not wanted:
+            return header
+        last = max(wanted)
+        strings = []
+        with self.book.open(self.shared_strings) as stream:
+            for event, element in ElementTree.iterparse(stream):
+                if _local(element.tag) == 'si':
+                    strings.append(_text(element))
+                    element.clear()
+                    if len(strings) > last:
+                        break
+        return [strings[value] if isinstance(value, SharedString) else value for value in header]
+
+    def close(self):
+        if self.ext == '.xls':
+            self.book.release_resources()
+        else:
+            self.book.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SharedString(int):
+    """Index d'une chaîne partagée, remplacé par son texte après lecture de la ligne"""
+
+
+def missing_columns(header, columns) -> list:
+    return [column for column in columns if column not in header]
+
+
+def parse_export_date(export_date_str):
+    """Date d'export au format jj/mm/aaaa ou YYYY-MM-DD, ou None"""
+    for date_format in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(export_date_str, date_format)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def export_date_from_name(stem):
+    """Date d'un export d'archive nommé AAAA-MM-JJ ou JJ-MM-AAAA, ou None"""
+    for date_format in EXPORT_NAME_FORMATS:
+        try:
+            return datetime.datetime.strptime(stem, date_format)
+        except ValueError:
+            pass
+    return None
+
+
+def archive_exports(archive):
+    """
+    Exports d'une archive de reprise d'historique
+
+    Returns:
+        Liste [(ZipInfo, extension, date ou None)] des fichiers Excel de l'archive
+    """
+    exports = []
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        stem, ext = os.path.splitext(name)
+        if info.is_dir() or name.startswith('.') or ext.lower() not in ('.xlsx', '.xls'):
+            continue
+        exports.append((info, ext.lower(), export_date_from_name(stem)))
+    return exports
+
+
+def check_export(source, ext, loc) -> list:
+    """Colonnes de la première feuille d'un export"""
+    try:
+        with HeaderReader(source, ext) as reader:
+            header = reader.header() if reader.sheetnames else []
+    except Exception as e:
+        return [problem(loc, f"Export illisible: {e}")]
+
+    missing = missing_columns(header, EXPORT_COLUMNS)
+    if missing:
+        return [problem(loc, f"Colonnes absentes de l'export: {', '.join(missing)}")]
+    return []
+
+
+def check_tracking(path, export_dates, full=True) -> list:
+    """
+    Onglets et colonnes du fichier de suivi
+
+    full: mode complet (classeur réécrit): fichier .xlsx, onglets de suivi
+    obligatoires et dates d'export pas encore importées.
+    """
+    loc = ("file_tracking",)
+    ext = sources.source_ext(path)
+    if full and ext not in OPENPYXL_EXTENSIONS:
+        return [problem(loc, f"Le fichier de suivi doit être au format .xlsx pour être mis à jour (reçu: {ext})")]
+
+    try:
+        reader = HeaderReader(path, ext)
+    except Exception as e:
+        return [problem(loc, f"Fichier de suivi illisible: {e}")]
+
+    problems = []
+    with reader:
+        if TRACKING_SHEET not in reader.sheetnames:
+            problems.append(problem(loc, f"Aucun onglet '{TRACKING_SHEET}' trouvé"))
+        else:
+            header = reader.header(TRACKING_SHEET)
+            missing = missing_columns(header, TRACKING_COLUMNS)
+            if missing:
+                problems.append(problem(loc + (TRACKING_SHEET,),
+                                        f"Colonnes absentes de la '{TRACKING_SHEET}': {', '.join(missing)}"))
+            if full:
+                # En-têtes texte seulement, comme la comparaison du traitement
+                for export_date in export_dates:
+                    if export_date.strftime('%d/%m/%Y') in header:
+                        problems.append(problem(
+                            loc + (TRACKING_SHEET,),
+                            f"Les données du {export_date.strftime('%d/%m/%Y')} ont déjà été importées."
+                        ))
+
+        if full:
+            sheetnames = [name.lower() for name in reader.sheetnames]
+            for prefix, title in REQUIRED_REPORT_SHEETS:
+                if not any(name.startswith(prefix) for name in sheetnames):
+                    problems.append(problem(loc, f"Aucun onglet '{title}' trouvé"))
+
+    return problems
+
+
+def check_stock_tracking(files: dict, params: dict) -> list:
+    """Vérification préalable de stock-tracking (mode complet ou delta)"""
+    problems = []
+    export_date = parse_export_date(params.get('export_date'))
+    if export_date is None:
+        problems.append(problem(("params", "export_date"),
+                                "Format de date invalide. Utilisez jj/mm/aaaa ou YYYY-MM-DD"))
+
+    full = (params.get('mode') or 'full') == 'full'
+    problems += check_tracking(files['tracking'], [export_date] if export_date else [], full)
+    problems += check_export(files['export'], sources.source_ext(files['export']), ("file_export",))
+    return problems
+
+
+def check_stock_tracking_backfill(files: dict, params: dict) -> list:
+    """Vérification préalable de stock-tracking-backfill: noms et en-têtes des exports de l'archive"""
+    problems = []
+    export_dates = []
+    try:
+        with zipfile.ZipFile(sources.rewind(files['exports'])) as archive:
+            for info, ext, export_date in archive_exports(archive):
+                loc = ("file_exports", info.filename)
+                name = os.path.basename(info.filename)
+                if export_date is None:
+                    problems.append(problem(loc, f"Date illisible dans le nom du fichier '{name}'. "
+                                                 f"Utilisez AAAA-MM-JJ{ext} ou JJ-MM-AAAA{ext}"))
+                    continue
+                if export_date in export_dates:
+                    problems.append(problem(loc, f"Plusieurs exports pour le {export_date.strftime('%d/%m/%Y')}"))
+                    continue
+                export_dates.append(export_date)
+                with archive.open(info) as source:
+                    problems += check_export(source, ext, loc)
+    except zipfile.BadZipFile as e:
+        return [problem(("file_exports",), f"Archive illisible: {e}")]
+
+    if not export_dates and not problems:
+        problems.append(problem(("file_exports",), "Aucun export trouvé dans l'archive"))
+
+    return problems + check_tracking(files['tracking'], sorted(export_dates))
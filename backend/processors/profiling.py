@@ -0,0 +1,130 @@
+"""
+Profilage à la demande d'un traitement
+
+Quand l'API le demande (voir main.py: jeton PROFILING_TOKEN), le processeur
+est exécuté dans le worker sous deux profileurs, et leurs résultats sont
+écrits dans le répertoire du traitement:
+
+- cProfile (déterministe): temps par fonction, en pstats (profile.pstats,
+  lisible avec pstats, snakeviz...) et en résumé texte (profile.txt,
+  fonctions triées par temps cumulé)
+- un échantillonneur: toutes les SAMPLE_INTERVAL secondes, un thread relève
+  la pile d'appels du traitement. Les piles sont comptées au format
+  "collapsed" (profile.collapsed, une ligne "f1;f2;f3 nombre" par pile),
+  lu par flamegraph.pl, speedscope ou inferno
+
+cProfile ralentit le traitement (appels de fonctions Python surtout): les
+durées absolues sont à comparer entre profils, pas avec les mesures des
+étapes d'un traitement normal.
+"""
+
+import collections
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))  # secondes
+TEXT_LIMIT = 60  # fonctions listées dans le résumé texte
+
+# Format -> (nom du fichier, type de contenu)
+PROFILE_FILES = {
+    "pstats": ("profile.pstats", "application/octet-stream"),
+    "collapsed": ("profile.collapsed", "text/plain; charset=utf-8"),
+    "text": ("profile.txt", "text/plain; charset=utf-8"),
+}
+
+
+@lru_cache(maxsize=8192)
+def frame_label(code) -> str:
+    """Nom d'une fonction dans une pile: fonction (fichier:ligne)"""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame, root=None) -> str:
+    """
+    Pile d'appels d'une frame, séparée par des ';'
+
+    La pile commence à root (la fonction profilée) si elle en fait partie,
+    sinon au début du thread.
+    """
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        if frame is root:
+            break
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler(threading.Thread):
+    """Compte les piles d'appels d'un thread, relevées à intervalle régulier"""
+
+    def __init__(self, thread_id: int, root=None, interval: float = SAMPLE_INTERVAL):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[collapse(frame, self.root)] += 1
+            del frame
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def profile_path(profile_dir: str, profile_format: str) -> str:
+    return os.path.join(profile_dir, PROFILE_FILES[profile_format][0])
+
+
+def write_profiles(profile_dir: str, profiler: cProfile.Profile, stacks: collections.Counter):
+    """Écrit les trois fichiers du profil dans profile_dir"""
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler.create_stats()
+    pstats.Stats(profiler).dump_stats(profile_path(profile_dir, "pstats"))
+
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(TEXT_LIMIT)
+    with open(profile_path(profile_dir, "text"), 'w', encoding='utf-8') as f:
+        f.write(summary.getvalue())
+
+    with open(profile_path(profile_dir, "collapsed"), 'w', encoding='utf-8') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profiled(profile_dir):
+    """
+    Profile le bloc encadré et écrit le profil dans profile_dir
+
+    profile_dir=None: pas de profilage. Le profil est écrit même si le bloc
+    échoue (utile pour comprendre un traitement interrompu).
+    """
+    if profile_dir is None:
+        yield
+        return
+
+    # Frame de l'appelant (sous celle de contextlib): les piles échantillonnées partent de lui
+    caller = sys._getframe(2)
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident(), caller)
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        write_profiles(profile_dir, profiler, sampler.counts)
@@ -0,0 +1,84 @@
+"""
+Fichiers des traitements: chemin sur le disque ou fichier en mémoire
+
+Les petits et moyens traitements ne passent pas par le disque: l'API garde
+les fichiers reçus en mémoire (MemoryFile), les transmet au worker, et le
+processeur lit et réécrit ces mêmes objets. Les gros fichiers restent
+écrits dans le répertoire du traitement (chemins), comme avant.
+
+Un MemoryFile garde le nom du fichier d'origine (l'extension choisit le
+lecteur) et se transmet au worker par pickle comme un chemin.
+"""
+
+import io
+import os
+import time
+
+
+class MemoryFile(io.BytesIO):
+    """Fichier binaire en mémoire, avec son nom et sa date de modification"""
+
+    def __init__(self, data=b'', name='fichier'):
+        super().__init__(data)
+        self.name = name
+        self.mtime = time.time()
+
+    def __repr__(self):
+        return f"<MemoryFile {self.name} ({self.getbuffer().nbytes} octets)>"
+
+
+def is_memory(source) -> bool:
+    return isinstance(source, MemoryFile)
+
+
+def source_name(source) -> str:
+    """Nom du fichier, sans répertoire"""
+    return source.name if is_memory(source) else os.path.basename(str(source))
+
+
+def source_ext(source) -> str:
+    return os.path.splitext(source_name(source))[1].lower()
+
+
+def source_size(source) -> int:
+    return source.getbuffer().nbytes if is_memory(source) else os.path.getsize(source)
+
+
+def display_name(source) -> str:
+    """Chemin du fichier, ou son nom s'il est en mémoire (pour les logs)"""
+    return f"{source.name} (en mémoire)" if is_memory(source) else str(source)
+
+
+def exists(source) -> bool:
+    return source is not None and (is_memory(source) or os.path.exists(source))
+
+
+def rewind(source):
+    """Source prête à être relue depuis le début (un chemin est retourné tel quel)"""
+    if is_memory(source):
+        source.seek(0)
+    return source
+
+
+def sibling(source, name: str):
+    """Fichier résultat à côté de source: même répertoire, ou en mémoire comme elle"""
+    if is_memory(source):
+        return MemoryFile(name=name)
+    return os.path.join(os.path.dirname(source), name)
+
+
+def overwrite(target):
+    """Cible prête à être réécrite entièrement (contenu en mémoire vidé)"""
+    if is_memory(target):
+        target.seek(0)
+        target.truncate()
+        target.mtime = time.time()
+    return target
+
+
+def write_text(target, text: str):
+    if is_memory(target):
+        overwrite(target).write(text.encode('utf-8'))
+        return
+    with open(target, 'w', encoding='utf-8') as f:
+        f.write(text)
@@ -3,18 +3,33 @@ Processeur pour le suivi des stocks
 Adapté depuis votre script original
 """
 
+import numpy as np
 import pandas as pd
 import datetime
-from openpyxl import load_workbook
+import json
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.styles import Border, Side, Alignment, PatternFill, Font
 import tempfile
 import os
+import re
+import shutil
+import zipfile
 
+from . import change_report, export_cache, history_store, preflight, sources, tracking_schema
+from .instrumentation import stage
+from .excel_reader import read_excel
+from .export_aggregator import EXPORT_COLUMNS, aggregate_export
+from .key_index import KeyIndex
 
-def process(files: dict, params: dict) -> str:
+
+def process(files: dict, params: dict, progress_callback=None) -> str:
     """
     Traite les fichiers de suivi des stocks
+    
+    Les fichiers sont des chemins ou des fichiers en mémoire (MemoryFile):
+    le résultat est écrit de la même façon, à côté du suivi ou en mémoire.
     """
     print("=" * 50)
     print("🚀 DÉBUT DU TRAITEMENT")
@@ -23,11 +38,26 @@ def process(files: dict, params: dict) -> str:
     file_tracking = files['tracking']
     file_export = files['export']
     export_date_str = params['export_date']
+    mode = params.get('mode') or 'full'
     
-    print(f"📁 Fichier tracking: {file_tracking}")
-    print(f"📁 Fichier export: {file_export}")
+    print(f"📁 Fichier tracking: {sources.display_name(file_tracking)}")
+    print(f"📁 Fichier export: {sources.display_name(file_export)}")
     print(f"📅 Date: {export_date_str}")
     
+    export_date = parse_export_date(export_date_str)
+    
+    if mode == 'delta':
+        return process_delta(file_tracking, file_export, export_date,
+                             params.get('delta_format') or 'xlsx', progress_callback)
+    if mode != 'full':
+        raise ValueError(f"Mode inconnu: {mode}. Utilisez full ou delta")
+    
+    run_pipeline(file_tracking, [(file_export, export_date)], progress_callback)
+    return file_tracking
+
+
+def parse_export_date(export_date_str):
+    """Date d'export au format jj/mm/aaaa ou YYYY-MM-DD"""
     # Accepter les deux formats de date
     try:
         export_date = datetime.datetime.strptime(export_date_str, '%d/%m/%Y')
@@ -38,23 +68,120 @@ def process(files: dict, params: dict) -> str:
             print(f"✅ Date parsée (format ISO): {export_date}")
         except ValueError:
             raise ValueError("Format de date invalide. Utilisez jj/mm/aaaa ou YYYY-MM-DD")
+    return export_date
+
+
+def process_backfill(files: dict, params: dict, progress_callback=None) -> str:
+    """
+    Importe plusieurs exports datés dans le fichier de suivi en une seule passe
+    
+    files['exports'] est une archive zip d'exports nommés par leur date
+    (AAAA-MM-JJ.xlsx ou JJ-MM-AAAA.xlsx). Les exports sont fusionnés dans
+    l'ordre chronologique, puis les suivis mensuel et semestriel sont
+    régénérés une seule fois pour la date la plus récente.
+    """
+    print("=" * 50)
+    print("🚀 DÉBUT DE LA REPRISE D'HISTORIQUE")
+    print("=" * 50)
+    
+    file_tracking = files['tracking']
+    # Exports extraits en mémoire si le suivi y est, sinon à côté du suivi
+    exports_dir = None if sources.is_memory(file_tracking) else os.path.join(os.path.dirname(file_tracking), 'exports')
+    exports = extract_dated_exports(files['exports'], exports_dir)
+    
+    print(f"📁 Fichier tracking: {sources.display_name(file_tracking)}")
+    for file_export, export_date in exports:
+        print(f"📁 Export du {export_date.strftime('%d/%m/%Y')}: {sources.source_name(file_export)}")
+    
+    run_pipeline(file_tracking, exports, progress_callback)
+    return file_tracking
+
+
+def extract_dated_exports(archive_path, dest_dir):
+    """
+    Extrait les exports d'une archive zip et lit leur date dans le nom du fichier
+    
+    dest_dir=None: les exports sont extraits en mémoire (MemoryFile).
+    
+    Returns:
+        Liste [(chemin_export ou MemoryFile, date)] triée par date
+    """
+    exports = []
+    seen_dates = set()
+    if dest_dir is not None:
+        os.makedirs(dest_dir, exist_ok=True)
+    
+    with zipfile.ZipFile(sources.rewind(archive_path)) as archive:
+        # Mêmes règles de nommage que la vérification préalable
+        for info, ext, export_date in preflight.archive_exports(archive):
+            if export_date is None:
+                name = os.path.basename(info.filename)
+                raise ValueError(f"Date illisible dans le nom du fichier '{name}'. Utilisez AAAA-MM-JJ{ext} ou JJ-MM-AAAA{ext}")
+            if export_date in seen_dates:
+                raise ValueError(f"Plusieurs exports pour le {export_date.strftime('%d/%m/%Y')}")
+            seen_dates.add(export_date)
+            
+            # Nom reconstruit: aucun chemin de l'archive n'est utilisé sur le disque
+            name = f"{export_date.strftime('%Y-%m-%d')}{ext}"
+            if dest_dir is None:
+                exports.append((sources.MemoryFile(archive.read(info), name), export_date))
+                continue
+            dest_path = os.path.join(dest_dir, name)
+            with archive.open(info) as src, open(dest_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            exports.append((dest_path, export_date))
+    
+    if not exports:
+        raise ValueError("Aucun export trouvé dans l'archive")
+    
+    return sorted(exports, key=lambda export: export[1])
+
+
+def run_pipeline(file_tracking, exports, progress_callback=None):
+    """
+    Charge le fichier de suivi, importe les exports [(fichier, date)],
+    régénère les suivis pour la dernière date puis sauvegarde une seule fois
+    """
+    if progress_callback is None:
+        def progress_callback(current, total):
+            pass
     
-    def progress_callback(current, total):
-        pass
+    last_export_date = exports[-1][1]
     
     # Exécuter les mises à jour avec logs
     try:
-        print("📊 Étape 1/3: update_tracking...")
-        update_tracking(file_tracking, file_export, export_date, progress_callback)
-        print("✅ update_tracking terminé")
-        
-        print("📊 Étape 2/3: update_monthly_tracking...")
-        update_monthly_tracking(file_tracking, export_date, progress_callback)
-        print("✅ update_monthly_tracking terminé")
+        print("📂 Chargement du fichier de suivi...")
+        with stage("read_tracking") as record:
+            context = TrackingContext(file_tracking)
+            record.rows = len(context.df_tracking)
+            record.bytes = sources.source_size(file_tracking)
+        articles_before = len(context.df_tracking)
         
-        print("📊 Étape 3/3: update_semestrial_tracking...")
-        update_semestrial_tracking(file_tracking, export_date, progress_callback)
-        print("✅ update_semestrial_tracking terminé")
+        try:
+            print("📊 Étape 1/2: update_tracking...")
+            update_tracking_many(context, exports, stage_progress(progress_callback, 0))
+            print("✅ update_tracking terminé")
+            
+            print("📊 Étape 2/2: update_variation_reports...")
+            report_summaries = update_variation_reports(context, last_export_date, stage_progress(progress_callback, 1))
+            print("✅ update_variation_reports terminé")
+            
+            print("💾 Sauvegarde du fichier de suivi...")
+            save_progress = stage_progress(progress_callback, 2)
+            with stage("save") as record:
+                context.save()
+                record.rows = len(context.df_tracking)
+                record.bytes = sources.source_size(file_tracking)
+            save_progress(1, 1)
+            
+            change_report.write_report(file_tracking, {
+                "dates": [export_date.strftime('%d/%m/%Y') for _, export_date in exports],
+                "articles_before": articles_before,
+                "articles_after": len(context.df_tracking),
+                "reports": report_summaries,
+            })
+        finally:
+            context.close()
         
     except Exception as e:
         print(f"❌ ERREUR: {e}")
@@ -63,10 +190,243 @@ def process(files: dict, params: dict) -> str:
         raise
     
     print("=" * 50)
-    print(f"🎉 TRAITEMENT TERMINÉ - Fichier: {file_tracking}")
+    print(f"🎉 TRAITEMENT TERMINÉ - Fichier: {sources.display_name(file_tracking)}")
     print("=" * 50)
+
+
+DELTA_COLUMNS = ['Codification DSNA', 'Désignation', 'Magasin', 'Description',
+                 'Quantité précédente', 'Quantité actuelle', 'Variation']
+DELTA_SHEETS = {
+    "new_articles": "Nouveaux articles",
+    "disappeared_articles": "Articles disparus",
+    "changes": "Variations",
+}
+
+
+def process_delta(file_tracking, file_export, export_date, delta_format, progress_callback=None):
+    """
+    Mode delta: seulement ce qui change avec l'export, sans réécrire le suivi
     
-    return file_tracking
+    La 'Liste de Stock' est lue (sans charger le classeur dans openpyxl),
+    l'export est fusionné en mémoire comme en mode complet, puis comparé à
+    la date la plus récente du suivi avant export_date. Le fichier de suivi
+    n'est ni modifié ni sauvegardé.
+    
+    Returns:
+        Chemin du fichier delta (.xlsx ou .json) à côté du fichier de suivi,
+        ou MemoryFile si le suivi est en mémoire
+    """
+    if delta_format not in ('xlsx', 'json'):
+        raise ValueError(f"Format de delta inconnu: {delta_format}. Utilisez xlsx ou json")
+    if progress_callback is None:
+        def progress_callback(current, total):
+            pass
+    
+    export_date_str = export_date.strftime('%d/%m/%Y')
+    
+    with stage("read_tracking") as record:
+        df_tracking = read_excel(file_tracking, sheet_name='Liste de Stock')
+        df_tracking.columns = [column.strftime('%d/%m/%Y') if isinstance(column, datetime.datetime) else column
+                               for column in df_tracking.columns]
+        df_tracking = tracking_schema.compact(df_tracking)
+        record.rows = len(df_tracking)
+        record.bytes = sources.source_size(file_tracking)
+    progress_callback(1, 4)
+    
+    with stage("read_export") as record:
+        df_grouped = load_grouped_export(file_export)
+        record.rows = len(df_grouped)
+        record.bytes = sources.source_size(file_export)
+    progress_callback(2, 4)
+    
+    with stage("delta") as record:
+        delta = compute_delta(df_tracking, df_grouped, export_date)
+        record.rows = sum(len(df) for df in delta["tables"].values())
+    progress_callback(3, 4)
+    
+    result_path = sources.sibling(file_tracking, f"delta.{delta_format}")
+    with stage("write") as record:
+        if delta_format == 'json':
+            write_delta_json(delta, export_date_str, result_path)
+        else:
+            write_delta_workbook(delta, export_date_str, result_path)
+        record.bytes = sources.source_size(result_path)
+    progress_callback(4, 4)
+    
+    for key, df in delta["tables"].items():
+        print(f"📊 {DELTA_SHEETS[key]}: {len(df)}")
+    print(f"🎉 DELTA TERMINÉ - Fichier: {sources.display_name(result_path)}")
+    return result_path
+
+
+def compute_delta(df_tracking, df_grouped, export_date):
+    """
+    Nouveaux articles, articles disparus et variations de quantité
+    
+    Returns:
+        {"reference_date": date de comparaison ou None, "tables": {clé: DataFrame}}
+    """
+    export_date_str = export_date.strftime('%d/%m/%Y')
+    
+    # Date de comparaison: la plus récente des colonnes de date antérieures à l'export
+    previous_dates = [(column_date, column) for column, column_date in tracking_schema.date_columns(df_tracking.columns)
+                      if column != export_date_str and column_date < export_date]
+    reference_col = max(previous_dates)[1] if previous_dates else None
+    
+    key_columns = ['Codification DSNA', 'Désignation', 'Magasin', 'Description']
+    base = df_tracking[key_columns + ([reference_col] if reference_col else [])]
+    if export_date_str in base.columns:
+        base = base.drop(columns=export_date_str)
+    
+    # Même rapprochement que le mode complet (doublons, nouveaux articles...)
+    merged = merge_export(base.copy(), df_grouped, export_date_str)
+    known = len(base)
+    
+    previous = merged[reference_col].fillna(0) if reference_col else pd.Series(0, index=merged.index)
+    current = merged[export_date_str]
+    
+    delta = merged[key_columns].copy()
+    delta['Quantité précédente'] = previous
+    delta['Quantité actuelle'] = current
+    # Entiers étroits: la différence est calculée en Int64 pour ne pas déborder
+    delta['Variation'] = current.astype('Int64') - previous.astype('Int64') \
+        if tracking_schema.is_typed(merged) else current - previous
+    delta = tracking_schema.to_legacy(delta[DELTA_COLUMNS])
+    
+    # Quantités entières affichées sans décimales (fillna a pu passer la colonne en float)
+    for column in DELTA_COLUMNS[4:]:
+        values = delta[column]
+        if pd.api.types.is_float_dtype(values) and values.notna().all() and (values % 1 == 0).all():
+            delta[column] = values.astype('int64')
+    
+    is_new = np.arange(len(merged)) >= known
+    disappeared = ~is_new & (previous > 0).to_numpy() & (current == 0).to_numpy()
+    changed = ~is_new & ~disappeared & (delta['Variation'] != 0).to_numpy()
+    
+    return {
+        "reference_date": reference_col,
+        "tables": {
+            "new_articles": delta[is_new].reset_index(drop=True),
+            "disappeared_articles": delta[disappeared].reset_index(drop=True),
+            "changes": delta[changed].reset_index(drop=True),
+        },
+    }
+
+
+def write_delta_workbook(delta, export_date_str, result_path):
+    """Classeur delta: un onglet résumé puis un onglet par catégorie"""
+    workbook = Workbook()
+    summary = workbook.active
+    summary.title = 'Résumé'
+    summary.append(['Date d\'export', export_date_str])
+    summary.append(['Comparée au', delta["reference_date"] or "Aucune date précédente"])
+    for key, df in delta["tables"].items():
+        summary.append([DELTA_SHEETS[key], len(df)])
+    summary.column_dimensions['A'].width = 24
+    summary.column_dimensions['B'].width = 24
+    
+    for key, df in delta["tables"].items():
+        worksheet = workbook.create_sheet(DELTA_SHEETS[key])
+        write_dataframe(worksheet, df)
+        style_headers(worksheet, df)
+    
+    workbook.save(result_path)
+
+
+def write_delta_json(delta, export_date_str, result_path):
+    """Delta en JSON: une liste d'objets par catégorie"""
+    payload = {"export_date": export_date_str, "reference_date": delta["reference_date"]}
+    for key, df in delta["tables"].items():
+        # to_json convertit NaN en null et les types numpy en nombres JSON
+        payload[key] = json.loads(df.to_json(orient='records', force_ascii=False))
+    sources.write_text(result_path, json.dumps(payload, ensure_ascii=False, indent=2))
+
+
+# Les étapes (mise à jour, rapports de variation mensuel et semestriel,
+# sauvegarde) se partagent la progression globale
+STAGE_COUNT = 3
+PROGRESS_SCALE = 1000
+
+
+def stage_progress(progress_callback, stage_index):
+    """Convertit la progression d'une étape en progression globale du traitement"""
+    def callback(current, total):
+        fraction = current / total if total else 1
+        overall = (stage_index + min(fraction, 1)) / STAGE_COUNT
+        progress_callback(round(overall * PROGRESS_SCALE), PROGRESS_SCALE)
+    callback(0, 1)
+    return callback
+
+
+class TrackingContext:
+    """
+    Fichier de suivi chargé une seule fois pour toutes les étapes du traitement
+
+    Le classeur openpyxl et la feuille 'Liste de Stock' (en DataFrame) sont
+    partagés en mémoire entre update_tracking et update_variation_reports.
+    Le fichier n'est écrit qu'une fois, par save().
+
+    Avec l'historique activé (voir history_store), la feuille est relue
+    depuis la base quand celle-ci contient exactement la feuille reçue (même
+    empreinte), sans analyser la feuille dans le classeur. save() archive
+    ensuite la feuille écrite.
+    
+    index (KeyIndex) donne la ligne de chaque (Codification DSNA, Magasin) du
+    DataFrame, pour toutes les fusions du traitement.
+    """
+
+    def __init__(self, file_tracking):
+        self.file_tracking = file_tracking
+        self.workbook = None
+        self.df_tracking = None
+        self.history = None
+        self.archived = False  # la base contient exactement la feuille reçue
+
+        try:
+            self.history, self.archived = history_store.open_archived(file_tracking)
+        except Exception as e:
+            print(f"⚠️ Historique illisible, lecture de la feuille: {e}")
+
+        if self.archived:
+            try:
+                self.df_tracking = self.history.load()
+                self.workbook = history_store.load_workbook_without_sheet(file_tracking)
+                print("♻️ Liste de Stock lue depuis l'historique")
+            except Exception as e:
+                print(f"⚠️ Historique illisible, lecture de la feuille: {e}")
+                self.archived = False
+                self.df_tracking = None
+
+        if self.df_tracking is None:
+            self.workbook = load_workbook(sources.rewind(file_tracking))
+            if self.history is None:
+                try:
+                    self.history = history_store.open_store(self.workbook)
+                except Exception as e:
+                    print(f"⚠️ Historique indisponible, non enregistré: {e}")
+            # pandas relit directement le classeur déjà chargé, sans reparser le fichier
+            self.df_tracking = pd.read_excel(self.workbook, sheet_name='Liste de Stock', engine='openpyxl')
+
+        # Types compacts, puis index construit une fois et complété par chaque fusion
+        self.df_tracking = tracking_schema.compact(self.df_tracking)
+        self.index = KeyIndex.from_tracking(self.df_tracking)
+
+    def save(self):
+        """Écrit le classeur modifié dans le fichier de suivi (ou son MemoryFile), puis l'historique"""
+        self.workbook.save(sources.overwrite(self.file_tracking))
+
+        if self.history is not None:
+            try:
+                self.history.append(self.df_tracking, self.archived, history_store.sheet_digest(self.file_tracking))
+            except Exception as e:
+                # La base sera reconstruite depuis la feuille au prochain traitement
+                print(f"⚠️ Historique non mis à jour ({e.__class__.__name__}): {e}")
+
+    def close(self):
+        """Ferme le classeur"""
+        self.workbook.close()
+        if self.history is not None:
+            self.history.close()
 
 
 def find_sheet(workbook, prefix):
@@ -87,30 +447,38 @@ def clear_worksheet(worksheet):
         worksheet.delete_rows(2, max_row - 1)
 
 
-def style_headers(worksheet):
+def style_headers(worksheet, df):
     """Style les en-têtes"""
     header_fill = PatternFill(start_color='003366', end_color='003366', fill_type='solid')
     header_font = Font(color='FFFFFF', bold=True)
     for cell in worksheet[1]:
         cell.fill = header_fill
         cell.font = header_font
-    adjust_column_width(worksheet)
+    adjust_column_width(worksheet, df)
 
 
-def adjust_column_width(worksheet):
-    """Ajuste la largeur des colonnes"""
-    for column_cells in worksheet.columns:
-        length = 0
-        for cell in column_cells:
-            try:
-                value_length = len(str(cell.value))
-            except:
-                value_length = 0
-            if value_length > length:
-                length = value_length
+def adjust_column_width(worksheet, df):
+    """
+    Ajuste la largeur des colonnes à partir du DataFrame écrit dans la feuille
+
+    La longueur de chaque valeur est calculée par colonne avec pandas, sans
+    relire les cellules: str(None) compte 4 caractères, comme dans la feuille.
+    """
+    for c_idx, column in enumerate(df.columns, start=1):
+        values = df[column]
+        length = len(str(column))
+        if len(values):
+            length = max(length, values.astype(str).str.len().max())
         
         adjusted_length = min(length + 2, 50)
-        worksheet.column_dimensions[column_cells[0].column_letter].width = adjusted_length
+        worksheet.column_dimensions[get_column_letter(c_idx)].width = adjusted_length
+
+
+def write_dataframe(worksheet, df):
+    """Écrit un DataFrame, en-têtes compris, dans une feuille vide"""
+    # append() ajoute une ligne entière en une fois, sans passer par cell() pour chaque valeur
+    for row in dataframe_to_rows(df, index=False, header=True):
+        worksheet.append(row)
 
 
 def format_date_columns(df):
@@ -122,285 +490,301 @@ def format_date_columns(df):
 
 
 def is_valid_date(date_str):
-    """Vérifie si une date est valide"""
-    try:
-        datetime.datetime.strptime(date_str, '%d/%m/%Y')
-        return True
-    except ValueError:
-        return False
+    """Vérifie si une date est valide (en-têtes interprétés une seule fois, voir tracking_schema)"""
+    return tracking_schema.parse_date_label(date_str) is not None
 
 
-def update_tracking(file_tracking, file_export, export_date, progress_callback):
-    """Met à jour le suivi des stocks"""
-    df_tracking = pd.read_excel(file_tracking, sheet_name='Liste de Stock')
-    df_export = pd.read_excel(file_export)
+def merge_export(df_tracking, df_grouped, export_date_str, index=None):
+    """
+    Reporte les quantités de l'export dans une nouvelle colonne de date
+
+    Les lignes existantes (Codification DSNA + Magasin) reçoivent la quantité
+    regroupée, ou 0 si l'article n'apparaît pas dans l'export. Les articles
+    inconnus sont ajoutés en fin de tableau, en un seul bloc, dans l'ordre du
+    regroupement. L'ordre des lignes et des colonnes existantes est conservé.
     
-    export_date_str = export_date.strftime('%d/%m/%Y')
+    index: KeyIndex des lignes de df_tracking, construit ici s'il n'est pas
+    fourni. Il est complété avec les articles ajoutés.
+    """
+    if index is None:
+        index = KeyIndex.from_tracking(df_tracking)
+    
+    # Une recherche par clé de l'export, sans re-hacher les lignes du suivi
+    export_rows, targets, unknown = index.locate(df_grouped['Code article'].to_numpy(),
+                                                 df_grouped['Emplacement'].to_numpy())
+    quantities = df_grouped['Quantité'].to_numpy()
+    column = np.zeros(len(df_tracking), dtype=quantities.dtype)
+    column[targets] = quantities[export_rows]
+    if tracking_schema.is_typed(df_tracking):
+        column = pd.array(column, dtype=tracking_schema.narrow_integer_dtype(quantities))
+    df_tracking[export_date_str] = column
     
-    if export_date_str in df_tracking.columns:
-        raise ValueError("Les données pour cette date ont déjà été importées.")
+    new_articles = df_grouped[unknown]
+    if new_articles.empty:
+        return df_tracking
     
-    # Regrouper par Code article + Emplacement
-    df_grouped = df_export.groupby(['Code article', 'Emplacement']).size().reset_index(name='Quantité')
+    new_rows_df = pd.DataFrame({
+        'Codification DSNA': new_articles['Code article'].to_numpy(),
+        'Désignation': new_articles["Description de l'actif"].to_numpy(),
+        'Magasin': new_articles['Emplacement'].to_numpy(),
+        'Description': new_articles["Description de l'emplacement"].to_numpy(),
+        export_date_str: new_articles['Quantité'].to_numpy(),
+    })
+    index.extend(new_rows_df['Codification DSNA'], new_rows_df['Magasin'])
+    return tracking_schema.concat_rows(df_tracking, new_rows_df)
+
+
+def load_grouped_export(file_export):
+    """Export regroupé en un seul passage, depuis le cache si ce fichier a déjà été traité"""
+    if not export_cache.is_enabled():
+        return aggregate_export(file_export)
     
-    df_descriptions = df_export.groupby(['Code article', 'Emplacement']).agg({
-        "Description de l'actif": 'first',
-        "Description de l'emplacement": 'first'
-    }).reset_index()
+    key = export_cache.file_key(file_export, EXPORT_COLUMNS)
+    df_grouped = export_cache.load(key)
+    if df_grouped is not None:
+        print("♻️ Export déjà regroupé, lu depuis le cache")
+        return df_grouped
     
-    df_grouped = df_grouped.merge(df_descriptions, on=['Code article', 'Emplacement'], how='left')
-    df_tracking[export_date_str] = 0
+    df_grouped = aggregate_export(file_export)
+    export_cache.store(key, df_grouped)
+    return df_grouped
+
+
+def update_tracking(context, file_export, export_date, progress_callback):
+    """Met à jour le suivi des stocks"""
+    update_tracking_many(context, [(file_export, export_date)], progress_callback)
+
+
+def update_tracking_many(context, exports, progress_callback):
+    """
+    Met à jour le suivi des stocks avec une liste d'exports [(fichier, date)]
     
-    total_operations = len(df_grouped) + len(df_tracking)
-    processed_operations = 0
+    Chaque export ajoute sa colonne de date, dans l'ordre de la liste. La
+    feuille 'Liste de Stock' n'est réécrite qu'une fois, à la fin.
+    """
+    df_tracking = context.df_tracking
     
-    for idx, row in df_grouped.iterrows():
-        codification = row['Code article']
-        magasin = row['Emplacement']
-        quantite = row['Quantité']
-        designation = row["Description de l'actif"]
-        description_emplacement = row["Description de l'emplacement"]
-        
-        condition = (df_tracking['Codification DSNA'] == codification) & (df_tracking['Magasin'] == magasin)
-        if not df_tracking[condition].empty:
-            df_tracking.loc[condition, export_date_str] = quantite
-        else:
-            new_row = {
-                'Codification DSNA': codification,
-                'Désignation': designation,
-                'Magasin': magasin,
-                'Description': description_emplacement,
-                export_date_str: quantite
-            }
-            new_row_df = pd.DataFrame([new_row])
-            df_tracking = pd.concat([df_tracking, new_row_df], ignore_index=True)
-        
-        processed_operations += 1
-        progress_callback(processed_operations, total_operations)
+    for file_export, export_date in exports:
+        if export_date.strftime('%d/%m/%Y') in df_tracking.columns:
+            raise ValueError("Les données pour cette date ont déjà été importées.")
+    
+    # Lecture et fusion de chaque export, puis écriture de la feuille
+    total_steps = 2 * len(exports) + 1
+    for index, (file_export, export_date) in enumerate(exports):
+        export_date_str = export_date.strftime('%d/%m/%Y')
+        with stage("read_export") as record:
+            df_grouped = load_grouped_export(file_export)
+            record.rows = len(df_grouped)
+            record.bytes = sources.source_size(file_export)
+        progress_callback(2 * index + 1, total_steps)
+        
+        with stage("merge") as record:
+            df_tracking = merge_export(df_tracking, df_grouped, export_date_str, context.index)
+            record.rows = len(df_tracking)
+        progress_callback(2 * index + 2, total_steps)
     
     df_tracking = format_date_columns(df_tracking)
+    context.df_tracking = df_tracking
     
-    # CORRECTION: Tout faire en une seule opération avec le workbook
-    workbook = load_workbook(file_tracking)
+    workbook = context.workbook
     
-    # Supprimer et recréer la feuille
-    if 'Liste de Stock' in workbook.sheetnames:
-        del workbook['Liste de Stock']
+    with stage("write") as record:
+        # Supprimer et recréer la feuille
+        if 'Liste de Stock' in workbook.sheetnames:
+            del workbook['Liste de Stock']
+        
+        worksheet = workbook.create_sheet('Liste de Stock', 0)
+        
+        # Écrire les données, avec les types que la feuille avait à la lecture
+        df_written = tracking_schema.to_legacy(df_tracking)
+        write_dataframe(worksheet, df_written)
+        
+        # Appliquer le style
+        style_headers(worksheet, df_written)
+        del df_written
+        record.rows = len(df_tracking)
+    progress_callback(total_steps, total_steps)
+
+
+# Rapports de variation: une feuille par période, repérée par le début de son nom.
+# lookback: nombre de colonnes de date entre la date d'export et la date de comparaison
+VARIATION_REPORTS = [
+    {"sheet": "suivi mensuel", "title": "Suivi Mensuel", "stage": "monthly", "lookback": 1, "required": True,
+     "period": "le mois", "no_variation": "Aucune variation ce mois-ci"},
+    {"sheet": "suivi trimestriel", "title": "Suivi Trimestriel", "stage": "quarterly", "lookback": 3, "required": False,
+     "period": "le trimestre", "no_variation": "Aucune variation ce trimestre"},
+    {"sheet": "suivi semestriel", "title": "Suivi Semestriel", "stage": "semestrial", "lookback": 6, "required": True,
+     "period": "le semestre", "no_variation": "Aucune variation ce semestre"},
+    {"sheet": "suivi annuel", "title": "Suivi Annuel", "stage": "yearly", "lookback": 12, "required": False,
+     "period": "l'année", "no_variation": "Aucune variation cette année"},
+]
+
+# Période libre: une feuille "Suivi 9 mois" compare avec la 9e date précédente
+CUSTOM_REPORT_PATTERN = re.compile(r'^suivi (\d+) mois', re.IGNORECASE)
+
+REPORT_COLUMNS = ['Codification DSNA', 'Désignation', 'Magasin', 'Description', 'Variation', 'Quantité actuelle']
+
+GREY_FILL = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
+LOW_STOCK_FILL = PatternFill(start_color='FFCCCC', end_color='FFCCCC', fill_type='solid')
+MEDIUM_STOCK_FILL = PatternFill(start_color='FFDAB9', end_color='FFDAB9', fill_type='solid')
+
+
+def find_variation_reports(workbook):
+    """
+    Rapports à produire pour ce classeur
     
-    worksheet = workbook.create_sheet('Liste de Stock', 0)
+    Returns:
+        Liste [(rapport, nom de la feuille)]
+    """
+    reports = []
+    for report in VARIATION_REPORTS:
+        sheet_name = find_sheet(workbook, report["sheet"])
+        if sheet_name:
+            reports.append((report, sheet_name))
+        elif report["required"]:
+            raise ValueError(f"Aucun onglet '{report['title']}' trouvé")
     
-    # Écrire les données
-    for r_idx, row in enumerate(dataframe_to_rows(df_tracking, index=False, header=True), start=1):
-        for c_idx, value in enumerate(row, start=1):
-            worksheet.cell(row=r_idx, column=c_idx, value=value)
+    for sheet_name in workbook.sheetnames:
+        match = CUSTOM_REPORT_PATTERN.match(sheet_name)
+        if match and int(match.group(1)) > 0:
+            months = int(match.group(1))
+            reports.append(({
+                "sheet": sheet_name.lower(), "title": sheet_name, "stage": f"report_{months}_months",
+                "lookback": months, "required": False,
+                "period": f"les {months} mois", "no_variation": f"Aucune variation sur {months} mois"
+            }, sheet_name))
     
-    # Appliquer le style
-    style_headers(worksheet)
+    return reports
+
+
+def compute_variations(df_tracking, export_date_str, lookbacks):
+    """
+    Calcule en une passe les variations de la date d'export pour plusieurs périodes
+    
+    Returns:
+        {lookback: (colonne de comparaison, DataFrame des variations non nulles)},
+        ou None pour une période sans colonne de date à comparer
+    """
+    results = dict.fromkeys(lookbacks)
+    if export_date_str not in df_tracking.columns:
+        return results
+    
+    col_idx = df_tracking.columns.get_loc(export_date_str)
+    previous_cols = {}
+    for lookback in lookbacks:
+        if col_idx >= lookback and is_valid_date(df_tracking.columns[col_idx - lookback]):
+            previous_cols[lookback] = df_tracking.columns[col_idx - lookback]
+    if not previous_cols:
+        return results
+    
+    # Une seule soustraction pour toutes les colonnes de comparaison
+    # Mêmes types qu'à la lecture de la feuille: variations des nouveaux articles en NaN
+    current = tracking_schema.legacy_values(df_tracking[export_date_str])
+    deltas = tracking_schema.to_legacy(df_tracking[sorted(set(previous_cols.values()))]).rsub(current, axis=0)
+    
+    for lookback, previous_col in previous_cols.items():
+        variation = deltas[previous_col]
+        changed = (variation != 0).to_numpy()
+        variations = tracking_schema.to_legacy(df_tracking.loc[changed, REPORT_COLUMNS[:4]])
+        variations['Variation'] = variation[changed]
+        variations['Quantité actuelle'] = current[changed]
+        results[lookback] = (previous_col, variations)
     
-    # Sauvegarder et fermer
-    workbook.save(file_tracking)
-    workbook.close()
+    return results
 
 
-def update_monthly_tracking(file_tracking, export_date, progress_callback):
-    """Met à jour le suivi mensuel"""
-    # CORRECTION: Charger le workbook une seule fois
-    workbook = load_workbook(file_tracking)
+def write_report_message(worksheet, message):
+    """Message centré sur la ligne 3 (pas de données, aucune variation)"""
+    worksheet['A3'] = message
+    worksheet.merge_cells('A3:F3')
+    worksheet['A3'].alignment = Alignment(horizontal='center')
+    worksheet['A3'].fill = GREY_FILL
+
+
+def render_variation_report(worksheet, report, result, export_date_str):
+    """Écrit un rapport de variation dans sa feuille"""
+    clear_worksheet(worksheet)
     
-    try:
-        suivi_mensuel_sheet_name = find_sheet(workbook, 'suivi mensuel')
-        
-        if not suivi_mensuel_sheet_name:
-            workbook.close()
-            raise ValueError("Aucun onglet 'Suivi Mensuel' trouvé")
-        
-        worksheet = workbook[suivi_mensuel_sheet_name]
-        clear_worksheet(worksheet)
-        
-        df_tracking = pd.read_excel(file_tracking, sheet_name='Liste de Stock')
-        export_date_str = export_date.strftime('%d/%m/%Y')
-        
-        if export_date_str not in df_tracking.columns:
-            worksheet.insert_rows(2)
-            worksheet['A3'] = "Pas de données disponibles pour le mois."
-            worksheet.merge_cells('A3:F3')
-            worksheet['A3'].alignment = Alignment(horizontal='center')
-            worksheet['A3'].fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
-            workbook.save(file_tracking)
-            return
-        
-        col_idx = df_tracking.columns.get_loc(export_date_str)
-        
-        if col_idx < 1:
-            worksheet.insert_rows(2)
-            worksheet['A3'] = "Pas de données disponibles pour le mois."
-            worksheet.merge_cells('A3:F3')
-            worksheet['A3'].alignment = Alignment(horizontal='center')
-            worksheet['A3'].fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
-            workbook.save(file_tracking)
-            return
-        
-        previous_month_col = df_tracking.columns[col_idx - 1]
-        
-        if not is_valid_date(previous_month_col):
-            worksheet.insert_rows(2)
-            worksheet['A3'] = "Pas de données disponibles pour le mois."
-            worksheet.merge_cells('A3:F3')
-            worksheet['A3'].alignment = Alignment(horizontal='center')
-            worksheet['A3'].fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
-            workbook.save(file_tracking)
-            return
-        
-        df_tracking['Variation'] = df_tracking[export_date_str] - df_tracking[previous_month_col]
-        df_tracking['Quantité actuelle'] = df_tracking[export_date_str]
-        
-        variations = df_tracking[df_tracking['Variation'] != 0]
-        variations = variations[['Codification DSNA', 'Désignation', 'Magasin', 'Description', 'Variation', 'Quantité actuelle']]
-        
-        start_date = datetime.datetime.strptime(previous_month_col, '%d/%m/%Y').strftime('%d/%m/%Y')
-        end_date = datetime.datetime.strptime(export_date_str, '%d/%m/%Y').strftime('%d/%m/%Y')
-        period_study = f"Variation entre le {start_date} et le {end_date}"
-        
+    if result is None:
         worksheet.insert_rows(2)
-        worksheet['A1'] = period_study
-        worksheet.merge_cells('A1:F1')
-        worksheet['A1'].alignment = Alignment(horizontal='center')
-        worksheet['A1'].fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
-        
-        if not variations.empty:
-            for r_idx, row in enumerate(dataframe_to_rows(variations, index=False, header=False), start=3):
-                for c_idx, value in enumerate(row, start=1):
-                    cell = worksheet.cell(row=r_idx, column=c_idx, value=value)
-                    if pd.notna(value) and c_idx == len(variations.columns):  # Dernière colonne
-                        if value <= 5:
-                            cell.fill = PatternFill(start_color='FFCCCC', end_color='FFCCCC', fill_type='solid')
-                        elif value <= 10:
-                            cell.fill = PatternFill(start_color='FFDAB9', end_color='FFDAB9', fill_type='solid')
-        else:
-            worksheet.insert_rows(3)
-            worksheet['A3'] = "Aucune variation ce mois-ci"
-            worksheet.merge_cells('A3:F3')
-            worksheet['A3'].alignment = Alignment(horizontal='center')
-            worksheet['A3'].fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
-        
-        headers = ['Codification DSNA', 'Désignation', 'Magasin', 'Description', 'Variation', 'Quantité actuelle']
-        for col_num, header in enumerate(headers, 1):
-            cell = worksheet.cell(row=2, column=col_num, value=header)
-            cell.fill = PatternFill(start_color='003366', end_color='003366', fill_type='solid')
-            cell.font = Font(color='FFFFFF', bold=True)
-            cell.alignment = Alignment(horizontal='center')
-            cell.border = Border(
-                left=Side(border_style='thin', color='FFFFFF'),
-                right=Side(border_style='thin', color='FFFFFF'),
-                top=Side(border_style='thin', color='FFFFFF'),
-                bottom=Side(border_style='thin', color='FFFFFF')
-            )
-        
-        # CORRECTION: Sauvegarder et fermer
-        workbook.save(file_tracking)
-        
-    finally:
-        # IMPORTANT: Toujours fermer le workbook
-        workbook.close()
+        write_report_message(worksheet, f"Pas de données disponibles pour {report['period']}.")
+        return
+    
+    previous_col, variations = result
+    
+    worksheet.insert_rows(2)
+    start_date = tracking_schema.parse_date_label(previous_col).strftime('%d/%m/%Y')
+    worksheet['A1'] = f"Variation entre le {start_date} et le {export_date_str}"
+    worksheet.merge_cells('A1:F1')
+    worksheet['A1'].alignment = Alignment(horizontal='center')
+    worksheet['A1'].fill = GREY_FILL
+    
+    if not variations.empty:
+        for r_idx, row in enumerate(dataframe_to_rows(variations, index=False, header=False), start=3):
+            for c_idx, value in enumerate(row, start=1):
+                worksheet.cell(row=r_idx, column=c_idx, value=value)
+        
+        # Stock faible: fonds calculés sur la colonne entière, pas cellule par cellule
+        quantities = pd.to_numeric(variations['Quantité actuelle'], errors='coerce')
+        last_col = len(REPORT_COLUMNS)
+        for r_idx in np.flatnonzero((quantities <= 5).to_numpy()) + 3:
+            worksheet.cell(row=int(r_idx), column=last_col).fill = LOW_STOCK_FILL
+        for r_idx in np.flatnonzero(((quantities > 5) & (quantities <= 10)).to_numpy()) + 3:
+            worksheet.cell(row=int(r_idx), column=last_col).fill = MEDIUM_STOCK_FILL
+    else:
+        worksheet.insert_rows(3)
+        write_report_message(worksheet, report["no_variation"])
+    
+    for col_num, header in enumerate(REPORT_COLUMNS, 1):
+        cell = worksheet.cell(row=2, column=col_num, value=header)
+        cell.fill = PatternFill(start_color='003366', end_color='003366', fill_type='solid')
+        cell.font = Font(color='FFFFFF', bold=True)
+        cell.alignment = Alignment(horizontal='center')
+        cell.border = Border(
+            left=Side(border_style='thin', color='FFFFFF'),
+            right=Side(border_style='thin', color='FFFFFF'),
+            top=Side(border_style='thin', color='FFFFFF'),
+            bottom=Side(border_style='thin', color='FFFFFF')
+        )
 
 
-def update_semestrial_tracking(file_tracking, export_date, progress_callback):
-    """Met à jour le suivi semestriel"""
-    # CORRECTION: Même pattern que monthly
-    workbook = load_workbook(file_tracking)
+def update_variation_reports(context, export_date, progress_callback):
+    """
+    Met à jour les suivis de variation (mensuel, semestriel, et trimestriel,
+    annuel ou "Suivi N mois" si le classeur contient ces onglets)
     
-    try:
-        suivi_semestrial_sheet_name = find_sheet(workbook, 'suivi semestriel')
-        
-        if not suivi_semestrial_sheet_name:
-            workbook.close()
-            raise ValueError("Aucun onglet 'Suivi Semestriel' trouvé")
-        
-        worksheet = workbook[suivi_semestrial_sheet_name]
-        clear_worksheet(worksheet)
-        
-        df_tracking = pd.read_excel(file_tracking, sheet_name='Liste de Stock')
-        export_date_str = export_date.strftime('%d/%m/%Y')
-        
-        if export_date_str not in df_tracking.columns:
-            worksheet.insert_rows(2)
-            worksheet['A3'] = "Pas de données disponibles pour le semestre."
-            worksheet.merge_cells('A3:F3')
-            worksheet['A3'].alignment = Alignment(horizontal='center')
-            worksheet['A3'].fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
-            workbook.save(file_tracking)
-            return
-        
-        col_idx = df_tracking.columns.get_loc(export_date_str)
-        
-        if col_idx < 6:
-            worksheet.insert_rows(2)
-            worksheet['A3'] = "Pas de données disponibles pour le semestre."
-            worksheet.merge_cells('A3:F3')
-            worksheet['A3'].alignment = Alignment(horizontal='center')
-            worksheet['A3'].fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
-            workbook.save(file_tracking)
-            return
-        
-        previous_semester_col = df_tracking.columns[col_idx - 6]
-        
-        if not is_valid_date(previous_semester_col):
-            worksheet.insert_rows(2)
-            worksheet['A3'] = "Pas de données disponibles pour le semestre."
-            worksheet.merge_cells('A3:F3')
-            worksheet['A3'].alignment = Alignment(horizontal='center')
-            worksheet['A3'].fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
-            workbook.save(file_tracking)
-            return
-        
-        df_tracking['Variation'] = df_tracking[export_date_str] - df_tracking[previous_semester_col]
-        df_tracking['Quantité actuelle'] = df_tracking[export_date_str]
-        
-        variations = df_tracking[df_tracking['Variation'] != 0]
-        variations = variations[['Codification DSNA', 'Désignation', 'Magasin', 'Description', 'Variation', 'Quantité actuelle']]
-        
-        start_date = datetime.datetime.strptime(previous_semester_col, '%d/%m/%Y').strftime('%d/%m/%Y')
-        end_date = datetime.datetime.strptime(export_date_str, '%d/%m/%Y').strftime('%d/%m/%Y')
-        period_study = f"Variation entre le {start_date} et le {end_date}"
-        
-        worksheet.insert_rows(2)
-        worksheet['A1'] = period_study
-        worksheet.merge_cells('A1:F1')
-        worksheet['A1'].alignment = Alignment(horizontal='center')
-        worksheet['A1'].fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
-        
-        if not variations.empty:
-            for r_idx, row in enumerate(dataframe_to_rows(variations, index=False, header=False), start=3):
-                for c_idx, value in enumerate(row, start=1):
-                    cell = worksheet.cell(row=r_idx, column=c_idx, value=value)
-                    if pd.notna(value) and c_idx == len(variations.columns):
-                        if value <= 5:
-                            cell.fill = PatternFill(start_color='FFCCCC', end_color='FFCCCC', fill_type='solid')
-                        elif value <= 10:
-                            cell.fill = PatternFill(start_color='FFDAB9', end_color='FFDAB9', fill_type='solid')
-        else:
-            worksheet.insert_rows(3)
-            worksheet['A3'] = "Aucune variation ce semestre"
-            worksheet.merge_cells('A3:F3')
-            worksheet['A3'].alignment = Alignment(horizontal='center')
-            worksheet['A3'].fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
-        
-        headers = ['Codification DSNA', 'Désignation', 'Magasin', 'Description', 'Variation', 'Quantité actuelle']
-        for col_num, header in enumerate(headers, 1):
-            cell = worksheet.cell(row=2, column=col_num, value=header)
-            cell.fill = PatternFill(start_color='003366', end_color='003366', fill_type='solid')
-            cell.font = Font(color='FFFFFF', bold=True)
-            cell.alignment = Alignment(horizontal='center')
-            cell.border = Border(
-                left=Side(border_style='thin', color='FFFFFF'),
-                right=Side(border_style='thin', color='FFFFFF'),
-                top=Side(border_style='thin', color='FFFFFF'),
-                bottom=Side(border_style='thin', color='FFFFFF')
-            )
-        
-        # CORRECTION: Sauvegarder et fermer
-        workbook.save(file_tracking)
-        
-    finally:
-        # IMPORTANT: Toujours fermer le workbook
-        workbook.close()
+    Les variations de toutes les périodes sont calculées ensemble, puis
+    chaque feuille est écrite à partir de ce résultat commun.
+    
+    Returns:
+        Résumé de chaque rapport, pour le rapport des modifications
+    """
+    workbook = context.workbook
+    reports = find_variation_reports(workbook)
+    export_date_str = export_date.strftime('%d/%m/%Y')
+    
+    with stage("variations") as record:
+        results = compute_variations(
+            context.df_tracking, export_date_str, {report["lookback"] for report, _ in reports}
+        )
+        record.rows = len(context.df_tracking)
+    progress_callback(1, len(reports) + 1)
+    
+    summaries = []
+    for index, (report, sheet_name) in enumerate(reports):
+        result = results[report["lookback"]]
+        count = len(result[1]) if result is not None else 0
+        with stage(report["stage"]) as record:
+            render_variation_report(workbook[sheet_name], report, result, export_date_str)
+            record.rows = count
+        print(f"📊 {sheet_name}: {count} variation(s)")
+        progress_callback(index + 2, len(reports) + 1)
+        
+        summaries.append({
+            "title": sheet_name,
+            "from": result[0] if result is not None else None,
+            "to": export_date_str,
+            "variations": count if result is not None else None,
+        })
+    
+    return summaries
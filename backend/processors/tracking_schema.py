@@ -0,0 +1,132 @@
+"""
+Types compacts de la 'Liste de Stock' en mémoire
+
+pd.read_excel charge la feuille en types inférés: textes répétés en objets
+Python, quantités en float64 dès qu'une cellule est vide (articles ajoutés
+après coup). Pendant le traitement, le DataFrame du suivi utilise plutôt:
+
+- des catégories pour Codification DSNA, Désignation, Magasin et Description
+- des entiers nullables au plus étroit (Int8 à Int64) pour les quantités
+- des en-têtes de date interprétés une seule fois (parse_date_label)
+
+Le fichier écrit ne change pas: to_legacy() redonne les types que pandas
+aurait lus (float64 si la colonne a des vides, int64 sinon) avant
+l'écriture de la feuille et le calcul des variations.
+"""
+
+import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+KEY_COLUMNS = ['Codification DSNA', 'Désignation', 'Magasin', 'Description']
+DATE_FORMAT = '%d/%m/%Y'
+
+INTEGER_DTYPES = ['Int8', 'Int16', 'Int32', 'Int64']
+
+
+@lru_cache(maxsize=4096)
+def _parse_label(label: str):
+    try:
+        return datetime.datetime.strptime(label, DATE_FORMAT)
+    except ValueError:
+        return None
+
+
+def parse_date_label(label):
+    """Date d'un en-tête jj/mm/aaaa, ou None (en-tête texte ou autre type)"""
+    if not isinstance(label, str):
+        return None
+    return _parse_label(label)
+
+
+def date_columns(columns) -> list:
+    """[(en-tête, date)] des colonnes de date, dans l'ordre des colonnes"""
+    return [(label, date) for label, date in ((label, parse_date_label(label)) for label in columns)
+            if date is not None]
+
+
+def is_typed(df) -> bool:
+    """Le DataFrame a déjà été compacté par compact()"""
+    return 'Codification DSNA' in df.columns and isinstance(df['Codification DSNA'].dtype, pd.CategoricalDtype)
+
+
+def narrow_integer_dtype(values) -> str:
+    """Plus petit type entier nullable contenant toutes les valeurs"""
+    values = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+    if len(values) == 0:
+        return INTEGER_DTYPES[0]
+    low, high = values.min(), values.max()
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype.lower())
+        if info.min <= low and high <= info.max:
+            return dtype
+    return INTEGER_DTYPES[-1]
+
+
+def compact_quantities(series):
+    """Colonne de quantités en entiers nullables, inchangée si elle n'est pas entière"""
+    if pd.api.types.is_integer_dtype(series):
+        if isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+            return series
+        return series.astype(narrow_integer_dtype(series.to_numpy()))
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy()
+        present = values[~np.isnan(values)]
+        if np.array_equal(present, np.floor(present)) and np.isfinite(present).all():
+            return series.astype(narrow_integer_dtype(values))
+    return series
+
+
+def compact(df):
+    """Catégories pour les colonnes d'article, entiers nullables pour les quantités"""
+    for column in KEY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    for label, _ in date_columns(df.columns):
+        df[label] = compact_quantities(df[label])
+    return df
+
+
+def concat_rows(df, new_rows):
+    """
+    Ajoute des lignes en fin de tableau en gardant les types de df
+
+    Les catégories de df sont complétées avec les nouvelles valeurs, et les
+    quantités des nouvelles lignes prennent le type de leur colonne.
+    """
+    if not is_typed(df):
+        return pd.concat([df, new_rows], ignore_index=True)
+
+    new_rows = new_rows.copy()
+    for column in new_rows.columns:
+        if column not in df.columns:
+            continue
+        dtype = df[column].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            missing = pd.Index(new_rows[column].dropna().unique()).difference(dtype.categories, sort=False)
+            if len(missing):
+                df[column] = df[column].cat.add_categories(missing)
+            new_rows[column] = pd.Categorical(new_rows[column], dtype=df[column].dtype)
+        else:
+            new_rows[column] = new_rows[column].astype(dtype)
+    return pd.concat([df, new_rows], ignore_index=True)
+
+
+def legacy_values(series):
+    """Valeurs d'une colonne avec le type que pd.read_excel lui aurait donné"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(object)
+    if isinstance(series.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(series):
+        if series.isna().any():
+            return series.astype('float64')
+        return series.astype('int64')
+    return series
+
+
+def to_legacy(df):
+    """DataFrame avec les types de pd.read_excel (copie, sauf si rien n'est à convertir)"""
+    if not any(isinstance(dtype, pd.api.extensions.ExtensionDtype) for dtype in df.dtypes):
+        return df
+    return pd.DataFrame({column: legacy_values(df[column]) for column in df.columns}, index=df.index)
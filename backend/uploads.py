@@ -0,0 +1,261 @@
+"""
+Réception des fichiers envoyés à l'API
+
+Les fichiers sont copiés sur le disque par blocs: la mémoire utilisée par
+une requête ne dépend pas de la taille des fichiers. Les limites de taille
+sont vérifiées au fil de la réception, et le format Excel est contrôlé sur
+les premiers octets avant tout traitement.
+
+Les petits fichiers peuvent aussi être gardés en mémoire (read_upload): le
+traitement les reçoit alors sans passer par le disque. Seules les routes
+créées avec memory_upload_route les reçoivent en mémoire, et seulement pour
+les champs déclarés, dans la limite d'un budget par requête
+(MemoryBudgetParser). Les autres routes gardent la règle de Starlette.
+"""
+
+import os
+import tempfile
+
+from fastapi import HTTPException, UploadFile
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from processors.sources import MemoryFile
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+# Signatures des formats acceptés: xlsx et zip (archive zip), xls (conteneur OLE2)
+FILE_SIGNATURES = {
+    '.xlsx': b'PK\x03\x04',
+    '.zip': b'PK\x03\x04',
+    '.xls': b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',
+}
+
+
+def file_too_large(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Fichier trop volumineux (maximum {max_size // (1024 * 1024)} MB)"
+    )
+
+
+async def save_upload(upload_file: UploadFile, dest_path: str, file_ext: str, max_size: int, digest=None):
+    """
+    Copie un fichier reçu vers dest_path par blocs de UPLOAD_CHUNK_SIZE
+
+    La copie est interrompue dès que max_size est dépassé, et le fichier
+    partiel est supprimé. Le premier bloc doit commencer par la signature
+    du format annoncé par l'extension. digest (hashlib), s'il est fourni,
+    reçoit chaque bloc: l'empreinte du fichier est calculée sans le relire.
+    """
+    try:
+        with open(dest_path, 'wb') as f:
+            written = await copy_upload(upload_file, f, file_ext, max_size, digest, in_thread=True)
+    except Exception:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return written
+
+
+async def read_upload(upload_file: UploadFile, name: str, file_ext: str, max_size: int, digest=None) -> MemoryFile:
+    """Comme save_upload, mais le fichier reçu est gardé en mémoire sous le nom name"""
+    memory_file = MemoryFile(name=name)
+    await copy_upload(upload_file, memory_file, file_ext, max_size, digest)
+    return memory_file
+
+
+async def copy_upload(upload_file: UploadFile, dest, file_ext: str, max_size: int, digest=None,
+                      in_thread: bool = False) -> int:
+    """Copie par blocs vers dest (fichier binaire ouvert) avec les contrôles de save_upload"""
+    written = 0
+    while True:
+        chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        if written == 0:
+            signature = FILE_SIGNATURES.get(file_ext)
+            if signature and not chunk.startswith(signature):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Le fichier {upload_file.filename} n'est pas un fichier {file_ext} valide"
+                )
+
+        written += len(chunk)
+        if written > max_size:
+            raise file_too_large(max_size)
+
+        if in_thread:
+            await run_in_threadpool(dest.write, chunk)
+        else:
+            dest.write(chunk)
+        if digest is not None:
+            digest.update(chunk)
+
+    if written == 0:
+        raise HTTPException(status_code=400, detail=f"Le fichier {upload_file.filename} est vide")
+
+    return written
+
+
+class MemoryBudgetParser(MultiPartParser):
+    """
+    MultiPartParser qui garde en mémoire les fichiers de memory_fields,
+    tant que leur total ne dépasse pas memory_budget octets
+
+    Un fichier qui dépasse ce qui reste du budget est écrit sur le disque
+    dès ce dépassement, tout comme les fichiers des autres champs (fichiers
+    temporaires, sans passer par la mémoire).
+    """
+
+    def __init__(self, headers, stream, *, memory_fields=(), memory_budget: int = 0, **kwargs):
+        super().__init__(headers, stream, **kwargs)
+        self.memory_fields = set(memory_fields)
+        self.memory_budget = memory_budget
+        self.memory_bytes = 0  # fichiers terminés gardés en mémoire
+        self._part_bytes = 0
+        self._part_limit = 0   # 0: fichier sur le disque
+
+    def on_headers_finished(self) -> None:
+        super().on_headers_finished()
+        part = self._current_part
+        self._part_bytes = 0
+        if part.file is None:
+            return
+
+        remaining = self.memory_budget - self.memory_bytes
+        self._part_limit = remaining if part.field_name in self.memory_fields and remaining > 0 else 0
+        default_spool = part.file.file
+        self._files_to_close_on_error.remove(default_spool)
+        default_spool.close()
+        spool = (tempfile.SpooledTemporaryFile(max_size=self._part_limit) if self._part_limit
+                 else tempfile.TemporaryFile())
+        self._files_to_close_on_error.append(spool)
+        part.file.file = spool
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        self._part_bytes += end - start
+        super().on_part_data(data, start, end)
+
+    def on_part_end(self) -> None:
+        if self._current_part.file is not None and 0 < self._part_bytes <= self._part_limit:
+            self.memory_bytes += self._part_bytes
+        super().on_part_end()
+
+
+class MemoryUploadRequest(Request):
+    """Request dont le formulaire multipart est lu par MemoryBudgetParser"""
+
+    def __init__(self, scope, receive, memory_fields, memory_budget: int):
+        super().__init__(scope, receive)
+        self.memory_fields = memory_fields
+        self.memory_budget = memory_budget
+
+    async def _get_form(self, *, max_files=1000, max_fields=1000):
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if self._form is None and content_type == "multipart/form-data":
+            parser = MemoryBudgetParser(self.headers, self.stream(), max_files=max_files, max_fields=max_fields,
+                                        memory_fields=self.memory_fields, memory_budget=self.memory_budget)
+            try:
+                self._form = await parser.parse()
+            except MultiPartException as exc:
+                raise HTTPException(status_code=400, detail=exc.message)
+        return await super()._get_form(max_files=max_files, max_fields=max_fields)
+
+
+def memory_upload_route(memory_fields, memory_budget: int) -> type:
+    """
+    Classe de route (APIRouter(route_class=...)) dont les fichiers reçus
+    restent en mémoire dans la limite de memory_budget octets par requête
+
+    memory_fields(path_params) -> noms des champs fichier à garder en mémoire
+    """
+    class MemoryUploadRoute(APIRoute):
+        def get_route_handler(self):
+            handler = super().get_route_handler()
+
+            async def memory_upload_handler(request: Request):
+                fields = memory_fields(request.path_params) if memory_budget > 0 else ()
+                return await handler(MemoryUploadRequest(request.scope, request.receive, fields, memory_budget))
+
+            return memory_upload_handler
+
+    return MemoryUploadRoute
+
+
+class RequestTooLarge(HTTPException):
+    """Corps de requête au-delà de la limite, rendu en 413 par FastAPI"""
+
+    def __init__(self):
+        super().__init__(status_code=413, detail="Requête trop volumineuse")
+
+
+class BodySizeLimitMiddleware:
+    """
+    Limite la taille totale du corps des requêtes, route par route
+
+    route_limits: {chemin: taille maximale} des routes qui reçoivent des
+    fichiers; les autres sont limitées à max_body_size. Une requête dont
+    l'en-tête Content-Length dépasse la limite est refusée avant la lecture
+    du corps. Sans Content-Length (envoi par morceaux), la réception est
+    interrompue dès que la limite est franchie, avant que le formulaire ne
+    soit entièrement reçu.
+    """
+
+    def __init__(self, app, max_body_size: int, route_limits=None):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.route_limits = route_limits or {}
+
+    def limit_for(self, path: str) -> int:
+        return self.route_limits.get(path.rstrip('/'), self.max_body_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_body_size = self.limit_for(scope["path"])
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() \
+                and int(content_length) > max_body_size:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_size:
+                    raise RequestTooLarge()
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except RequestTooLarge:
+            if response_started:
+                raise
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        response = JSONResponse(
+            status_code=413,
+            content={"detail": "Requête trop volumineuse"},
+            headers={"Connection": "close"}
+        )
+        await response(scope, receive, send)
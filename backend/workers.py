@@ -0,0 +1,183 @@
+"""
+Exécution des traitements hors de la boucle d'événements
+
+Les processeurs sont synchrones et gourmands en CPU (pandas, openpyxl).
+Ils tournent dans un pool de processus borné pour que l'API reste
+disponible pendant un traitement. Au-delà de la capacité du pool
+(traitements en cours + file d'attente), les nouvelles demandes sont
+refusées immédiatement au lieu de s'accumuler.
+
+Un traitement peut aussi être soumis avec des limites de concurrence
+(clé, nombre maximal), par exemple pour les traitements gourmands en
+mémoire: au-delà, il attend dans le pool qu'un traitement de même clé se
+termine, sans occuper de worker.
+"""
+
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class PoolSaturatedError(Exception):
+    """Levée quand le pool n'accepte plus de nouveaux traitements"""
+
+
+class ProcessingPool:
+    """
+    Pool de processus avec une limite de traitements simultanés
+    et une profondeur de file d'attente
+    """
+
+    def __init__(self, max_workers: int, max_queued: int, initializer=None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.initializer = initializer
+        self._executor = None
+        self._pending = 0
+        self._active = {}    # clé de limite -> traitements en cours
+        self._deferred = []  # traitements en attente d'une limite: (future, fn, args, limits)
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        """Nombre maximal de traitements acceptés (en cours + en attente)"""
+        return self.max_workers + self.max_queued
+
+    @property
+    def pending(self) -> int:
+        """Nombre de traitements en cours ou en attente"""
+        return self._pending
+
+    def is_saturated(self) -> bool:
+        """Indique si un nouveau traitement serait refusé"""
+        return self._pending >= self.capacity
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn: les workers ne copient pas l'état du serveur (boucle asyncio, sockets)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self.initializer,
+            )
+        return self._executor
+
+    def _within_limits(self, limits) -> bool:
+        return all(self._active.get(key, 0) < maximum for key, maximum in limits)
+
+    def _start(self, future, fn, args, limits) -> list:
+        """
+        Envoie le traitement aux workers (appelé avec le verrou)
+
+        Returns:
+            Traitements démarrés, à surveiller avec _watch() une fois le
+            verrou relâché
+        """
+        if not future.set_running_or_notify_cancel():
+            # Annulé pendant son attente
+            self._pending -= 1
+            return []
+        for key, _ in limits:
+            self._active[key] = self._active.get(key, 0) + 1
+        try:
+            try:
+                worker_future = self._get_executor().submit(fn, *args)
+            except BrokenProcessPool:
+                # Un worker a été tué (mémoire insuffisante...): on repart sur un pool neuf
+                self._executor = None
+                worker_future = self._get_executor().submit(fn, *args)
+        except Exception as e:
+            started = self._finish(limits)
+            future.set_exception(e)
+            return started
+        return [(future, worker_future, limits)]
+
+    def _watch(self, started):
+        """
+        Met à jour les traitements démarrés quand leur worker termine
+
+        Appelé sans le verrou: le callback d'un worker déjà terminé est
+        exécuté tout de suite, et _on_done prend le verrou.
+        """
+        for future, worker_future, limits in started:
+            worker_future.add_done_callback(
+                lambda done, future=future, limits=limits: self._on_done(future, done, limits)
+            )
+
+    def _on_done(self, future, worker_future, limits):
+        with self._lock:
+            started = self._finish(limits)
+        self._watch(started)
+        try:
+            future.set_result(worker_future.result())
+        except BaseException as e:
+            future.set_exception(e)
+
+    def _finish(self, limits) -> list:
+        """
+        Libère les places d'un traitement et démarre les suivants (appelé avec le verrou)
+
+        Returns:
+            Traitements démarrés (voir _start)
+        """
+        self._pending -= 1
+        for key, _ in limits:
+            self._active[key] -= 1
+        started = []
+        waiting, self._deferred = self._deferred, []
+        for task in waiting:
+            if self._within_limits(task[3]):
+                started += self._start(*task)
+            else:
+                self._deferred.append(task)
+        return started
+
+    def submit(self, fn, *args, limits=()):
+        """
+        Soumet fn(*args) au pool
+
+        Args:
+            limits: liste de (clé, nombre maximal de traitements simultanés
+                pour cette clé)
+
+        Returns:
+            concurrent.futures.Future du traitement
+
+        Raises:
+            PoolSaturatedError: si la capacité du pool est atteinte
+        """
+        future = Future()
+        started = []
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise PoolSaturatedError("Capacité de traitement atteinte")
+            self._pending += 1
+            if self._within_limits(limits):
+                started = self._start(future, fn, args, limits)
+            else:
+                self._deferred.append((future, fn, args, limits))
+
+        # Échec immédiat de la soumission (pas du traitement): même comportement qu'un submit direct
+        submit_error = future.exception() if future.done() else None
+        self._watch(started)
+        if submit_error is not None:
+            raise submit_error
+        return future
+
+    def warm_up(self):
+        """Démarre les workers à l'avance (leur initializer importe les processeurs)"""
+        executor = self._get_executor()
+        for _ in range(self.max_workers):
+            executor.submit(int)
+
+    async def run(self, fn, *args):
+        """Exécute fn(*args) dans le pool sans bloquer la boucle d'événements"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        """Arrête les workers"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
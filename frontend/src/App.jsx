@@ -17,6 +17,18 @@ const APPS_CONFIG = [
       { id: 'export_date', label: "Date d'export", type: 'date', placeholder: '' }
     ]
   },
+  {
+    id: 'stock-tracking-backfill',
+    name: "Reprise d'historique",
+    description: 'Import de plusieurs exports datés en une seule fois (rattrapage de mois manquants)',
+    icon: FileSpreadsheet,
+    color: 'from-indigo-500 to-indigo-600',
+    files: [
+      { id: 'tracking', label: 'Fichier de suivi', accept: '.xlsx,.xls' },
+      { id: 'exports', label: 'Archive des exports (AAAA-MM-JJ.xlsx)', accept: '.zip' }
+    ],
+    params: []
+  },
   {
     id: 'sales-analysis',
     name: 'Analyse des Ventes',
@@ -56,6 +68,32 @@ const FUNNY_MESSAGES = [
   "Recensement des claviers qui ont décidé de faire une pause café prolongée..."
 ];
 
+const POLL_INTERVAL_MS = 1000;
+
+// Extrait le message d'erreur d'une réponse de l'API
+async function extractErrorMessage(response) {
+  let errorData;
+  try {
+    errorData = await response.json();
+    console.error('❌ Erreur API complète:', JSON.stringify(errorData, null, 2));
+  } catch {
+    errorData = { detail: `Erreur HTTP ${response.status}` };
+  }
+  
+  let errorMessage = 'Erreur lors du traitement';
+  if (errorData.detail) {
+    if (Array.isArray(errorData.detail)) {
+      // FastAPI validation errors sont dans un tableau
+      errorMessage = errorData.detail.map(err => {
+        return `${err.loc ? err.loc.join(' > ') : ''}: ${err.msg}`;
+      }).join('\n');
+    } else if (typeof errorData.detail === 'string') {
+      errorMessage = errorData.detail;
+    }
+  }
+  return errorMessage;
+}
+
 // Composant Card pour chaque application
 function AppCard({ app, onClick }) {
   const Icon = app.icon;
@@ -249,51 +287,43 @@ function AppProcessingPage({ app, onBack }) {
       // Ajouter les paramètres
       formData.append('params', JSON.stringify(params));
 
-      // Simulation de progression
-      const progressInterval = setInterval(() => {
-        setProgress(prev => {
-          if (prev >= 90) return prev;
-          return prev + Math.random() * 15;
-        });
-      }, 500);
-
-      // Appel API réel
-      const response = await fetch(`${API_URL}/api/process/${app.id}`, {
+      // Lancer le traitement en arrière-plan
+      const response = await fetch(`${API_URL}/api/jobs/${app.id}`, {
         method: 'POST',
         body: formData,
       });
 
-      clearInterval(progressInterval);
-
       console.log('📡 Réponse reçue, status:', response.status);
 
       if (!response.ok) {
-        let errorData;
-        try {
-          errorData = await response.json();
-          console.error('❌ Erreur API complète:', JSON.stringify(errorData, null, 2));
-        } catch {
-          errorData = { detail: `Erreur HTTP ${response.status}` };
-        }
-        
-        // Extraire le message d'erreur
-        let errorMessage = 'Erreur lors du traitement';
-        if (errorData.detail) {
-          if (Array.isArray(errorData.detail)) {
-            // FastAPI validation errors sont dans un tableau
-            errorMessage = errorData.detail.map(err => {
-              return `${err.loc ? err.loc.join(' > ') : ''}: ${err.msg}`;
-            }).join('\n');
-          } else if (typeof errorData.detail === 'string') {
-            errorMessage = errorData.detail;
-          }
+        throw new Error(await extractErrorMessage(response));
+      }
+
+      const job = await response.json();
+
+      // Suivre la progression réelle du traitement
+      let status;
+      do {
+        await new Promise(resolve => setTimeout(resolve, POLL_INTERVAL_MS));
+        const statusResponse = await fetch(`${API_URL}${job.status_url}`);
+        if (!statusResponse.ok) {
+          throw new Error(await extractErrorMessage(statusResponse));
         }
-        
-        throw new Error(errorMessage);
+        status = await statusResponse.json();
+        setProgress(status.progress);
+      } while (status.state === 'queued' || status.state === 'running');
+
+      if (status.state === 'failed') {
+        throw new Error(status.error || 'Erreur lors du traitement');
+      }
+
+      const resultResponse = await fetch(`${API_URL}${job.result_url}`);
+      if (!resultResponse.ok) {
+        throw new Error(await extractErrorMessage(resultResponse));
       }
 
       // Récupérer le nom du fichier depuis les headers de la réponse
-      const contentDisposition = response.headers.get('Content-Disposition');
+      const contentDisposition = resultResponse.headers.get('Content-Disposition');
       let filename = `resultat_${app.id}_${Date.now()}.xlsx`;
       
       if (contentDisposition) {
@@ -305,7 +335,7 @@ function AppProcessingPage({ app, onBack }) {
 
       console.log('📄 Nom du fichier:', filename);
 
-      const blob = await response.blob();
+      const blob = await resultResponse.blob();
       console.log('💾 Blob reçu, taille:', blob.size, 'bytes');
       
       const url = window.URL.createObjectURL(blob);